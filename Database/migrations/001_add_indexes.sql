@@ -0,0 +1,32 @@
+
+/* Indexes on the columns used to look up and clean the data items */
+
+CREATE INDEX raw_data_item_abs_path_idx ON RAW_DATA_ITEM (abs_path);
+CREATE INDEX raw_data_item_item_id_idx ON RAW_DATA_ITEM (item_id);
+CREATE INDEX raw_data_item_last_check_idx ON RAW_DATA_ITEM (last_check);
+
+CREATE INDEX osg_data_item_abs_path_idx ON OSG_DATA_ITEM (abs_path);
+CREATE INDEX osg_data_item_last_check_idx ON OSG_DATA_ITEM (last_check);
+CREATE INDEX osg_data_item_osg_location_id_idx ON OSG_DATA_ITEM (osg_location_id);
+
+CREATE INDEX osg_data_item_pc_site_osg_data_item_id_idx ON OSG_DATA_ITEM_PC_SITE (osg_data_item_id);
+CREATE INDEX osg_data_item_pc_site_raw_data_item_id_idx ON OSG_DATA_ITEM_PC_SITE (raw_data_item_id);
+CREATE INDEX osg_data_item_mesh_osg_data_item_id_idx ON OSG_DATA_ITEM_MESH (osg_data_item_id);
+CREATE INDEX osg_data_item_mesh_raw_data_item_id_idx ON OSG_DATA_ITEM_MESH (raw_data_item_id);
+CREATE INDEX osg_data_item_picture_osg_data_item_id_idx ON OSG_DATA_ITEM_PICTURE (osg_data_item_id);
+CREATE INDEX osg_data_item_picture_raw_data_item_id_idx ON OSG_DATA_ITEM_PICTURE (raw_data_item_id);
+
+CREATE INDEX osg_data_item_pc_background_abs_path_idx ON OSG_DATA_ITEM_PC_BACKGROUND (abs_path);
+CREATE INDEX osg_data_item_pc_background_last_check_idx ON OSG_DATA_ITEM_PC_BACKGROUND (last_check);
+CREATE INDEX osg_data_item_pc_background_raw_data_item_id_idx ON OSG_DATA_ITEM_PC_BACKGROUND (raw_data_item_id);
+
+CREATE INDEX potree_data_item_pc_abs_path_idx ON POTREE_DATA_ITEM_PC (abs_path);
+CREATE INDEX potree_data_item_pc_last_check_idx ON POTREE_DATA_ITEM_PC (last_check);
+CREATE INDEX potree_data_item_pc_raw_data_item_id_idx ON POTREE_DATA_ITEM_PC (raw_data_item_id);
+
+CREATE INDEX nexus_data_item_mesh_abs_path_idx ON NEXUS_DATA_ITEM_MESH (abs_path);
+CREATE INDEX nexus_data_item_mesh_last_check_idx ON NEXUS_DATA_ITEM_MESH (last_check);
+CREATE INDEX nexus_data_item_mesh_raw_data_item_id_idx ON NEXUS_DATA_ITEM_MESH (raw_data_item_id);
+
+CREATE INDEX osg_item_camera_item_id_idx ON OSG_ITEM_CAMERA (item_id);
+CREATE INDEX osg_item_object_item_id_idx ON OSG_ITEM_OBJECT (item_id);
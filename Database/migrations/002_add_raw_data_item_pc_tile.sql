@@ -0,0 +1,26 @@
+
+/* Statistics of the LAS/LAZ files (tiles) of the raw point clouds */
+
+CREATE TABLE RAW_DATA_ITEM_PC_TILE
+(
+	raw_data_item_id int NOT NULL,
+	file_name text NOT NULL,
+	number_points bigint NOT NULL,
+	minx double precision,
+	miny double precision,
+	minz double precision,
+	maxx double precision,
+	maxy double precision,
+	maxz double precision,
+	srid int,
+	mtime double precision NOT NULL,
+	size bigint NOT NULL,
+	PRIMARY KEY (raw_data_item_id, file_name)
+) WITHOUT OIDS;
+
+ALTER TABLE RAW_DATA_ITEM_PC_TILE
+	ADD FOREIGN KEY (raw_data_item_id)
+	REFERENCES RAW_DATA_ITEM_PC (raw_data_item_id)
+	ON UPDATE RESTRICT
+	ON DELETE CASCADE
+;
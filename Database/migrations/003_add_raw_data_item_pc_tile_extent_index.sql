@@ -0,0 +1,5 @@
+
+/* GiST index on the 2D extent of the tiles of the raw point clouds. 
+   The queries must use the same expression, i.e. ST_MakeEnvelope(minx, miny, maxx, maxy) */
+
+CREATE INDEX raw_data_item_pc_tile_extent_idx ON RAW_DATA_ITEM_PC_TILE USING GIST (ST_MakeEnvelope(minx, miny, maxx, maxy));
@@ -0,0 +1,25 @@
+
+/* Robust statistics of the Z of the points in the cutouts of the items (computed by UpdateDBItemZ) */
+
+CREATE TABLE ITEM_Z_STATS
+(
+	item_id int NOT NULL,
+	number_points bigint NOT NULL,
+	min_z double precision,
+	max_z double precision,
+	avg_z double precision,
+	p1_z double precision,
+	p50_z double precision,
+	p99_z double precision,
+	histogram_min_z double precision,
+	histogram_bin_size double precision,
+	histogram int[],
+	PRIMARY KEY (item_id)
+) WITHOUT OIDS;
+
+ALTER TABLE ITEM_Z_STATS
+	ADD FOREIGN KEY (item_id)
+	REFERENCES ITEM (item_id)
+	ON UPDATE RESTRICT
+	ON DELETE CASCADE
+;
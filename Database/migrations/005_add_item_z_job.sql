@@ -0,0 +1,22 @@
+
+/* Summary of the last UpdateDBItemZ job of each item (used to resume partially completed runs) */
+
+CREATE TABLE ITEM_Z_JOB
+(
+	item_id int NOT NULL,
+	las_folder text NOT NULL,
+	status text NOT NULL,
+	cost double precision,
+	number_points bigint,
+	elapsed double precision,
+	message text,
+	last_run int,
+	PRIMARY KEY (item_id)
+) WITHOUT OIDS;
+
+ALTER TABLE ITEM_Z_JOB
+	ADD FOREIGN KEY (item_id)
+	REFERENCES ITEM (item_id)
+	ON UPDATE RESTRICT
+	ON DELETE CASCADE
+;
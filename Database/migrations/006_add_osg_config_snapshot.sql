@@ -0,0 +1,9 @@
+/* Hashes of the active objects and cameras of the last XML configuration imported by UpdateDBFromOSG (used by its diff mode) */
+
+CREATE TABLE OSG_CONFIG_SNAPSHOT
+(
+	kind text NOT NULL,
+	unique_name text NOT NULL,
+	hash text NOT NULL,
+	PRIMARY KEY (kind, unique_name)
+) WITHOUT OIDS;
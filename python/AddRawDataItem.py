@@ -44,7 +44,7 @@
 #                       |- Sn
 ###############################################################################
 
-import time, os, shutil, argparse, utils, json, liblas, glob
+import time, os, shutil, argparse, utils, las_utils, json, glob
 
 logger = None
 
@@ -143,20 +143,16 @@ def check_input_data(opts):
     # SRID for PCs must not be null
     if (opts.type == utils.PC_FT):
         if os.path.isfile(opts.file):  # input is file
-            lasHeader = liblas.file.File(opts.file, mode='r').header
-            srid = utils.readSRID(lasHeader)
+            srid = las_utils.readSRID(opts.file)
             if srid is None:
                 logger.warning("srid is not defined in lasheader " + opts.file)
         else:  # input is directory
-            files = glob.glob(opts.file + '/*.las') + glob.glob(
-                opts.file + '/*.laz')
-            for filename in files:
-                # check all *.las en *.laz files in directory
-                lasHeader = liblas.file.File(filename, mode='r').header
-                srid = utils.readSRID(lasHeader)
-                if srid is None:
+            # check all *.las en *.laz files in directory
+            (info, tiles) = las_utils.scanLAS(opts.file, opts.scanthreads)
+            for tile in tiles:
+                if tile.srid is None:
                     logger.warning("srid is not defined in lasheader " +
-                                   filename)
+                                   os.path.join(opts.file, tile.fileName))
     # MESH should have an obj extension
     if (opts.type == utils.MESH_FT):
         # if input is a file it should have obj extension:
@@ -407,6 +403,7 @@ def argument_parser():
     requiredNamedMESHPIC.add_argument('-p', '--period', action='store', help='Period (choose from ' + utils.MESH_FT + ':' + utils.CURR_FT + ',' + utils.ARCREC_FT + '; ' +  utils.PIC_FT + ':' + utils.CURR_FT + ',' + utils.HIST_FT + ')', choices=[utils.CURR_FT, utils.HIST_FT, utils.ARCREC_FT])
     parser.add_argument('-s', '--srid', action='store', help='spatial reference system SRID [only for MESH SITE]')
     parser.add_argument('--eight', help='8 bit color [only for PC SITE or MESH]', action="store_true")
+    parser.add_argument('--scanthreads', default=las_utils.DEFAULT_SCAN_THREADS, type=int, help='Number of threads used to read the headers of the LAS/LAZ files [only for PC, default ' + str(las_utils.DEFAULT_SCAN_THREADS) + ']')
     parser.add_argument('-l', '--log', help='Log level', choices=utils.LOG_LEVELS_LIST, default=utils.DEFAULT_LOG_LEVEL)
     requiredNamedSITE.add_argument('--site', action='store', type=int, help='Site number')
     return parser
@@ -8,7 +8,10 @@ import os, argparse, logging, time, utils
 def run(opts):
     # Set logging
     #logname = os.path.splitext(os.path.basename(opts.sql))[0] + '.log'
-    logname = os.path.basename(opts.sql) + '.log'
+    if opts.migrate:
+        logname = os.path.splitext(os.path.basename(__file__))[0] + '.log'
+    else:
+        logname = os.path.basename(opts.sql) + '.log'
     utils.start_logging(filename=logname, level=opts.log)
    
     localtime = utils.getCurrentTimeAsAscii()
@@ -16,17 +19,30 @@ def run(opts):
     msg = os.path.basename(__file__) + ' script starts at %s.' %localtime
     print msg
     logging.info(msg)
-    os.system('createdb ' + utils.postgresConnectString(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport, True))
+    if opts.migrate:
+        # Only the pending migrations are applied to the existing DB
+        connection, cursor = utils.connectToDB(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport) 
+        success_loading = True
+    else:
+        if opts.sql == '':
+            raise Exception('Option --sql is required to create the DB')
+        os.system('createdb ' + utils.postgresConnectString(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport, True))
+        
+        connection, cursor = utils.connectToDB(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport) 
     
-    connection, cursor = utils.connectToDB(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport) 
-
-    msg = 'Adding PostGIS extension'
-    logging.info(msg)
-    #print msg
-    cursor.execute("CREATE EXTENSION POSTGIS")
-    connection.commit()
-
-    success_loading = utils.load_sql_file(cursor, opts.sql)
+        msg = 'Adding PostGIS extension'
+        logging.info(msg)
+        #print msg
+        cursor.execute("CREATE EXTENSION POSTGIS")
+        connection.commit()
+    
+        success_loading = utils.load_sql_file(cursor, opts.sql)
+    
+    if success_loading:
+        newVersions = utils.applyMigrations(cursor, opts.migrations)
+        msg = 'Applied %d migrations' % len(newVersions)
+        logging.info(msg)
+        print msg
  
     msg = 'Granting relevant permissions' 
     logging.info(msg)
@@ -53,7 +69,9 @@ def argument_parser():
     """ Define the arguments and return the parser object"""
     parser = argparse.ArgumentParser(
     description="Create the DB")
-    parser.add_argument('-f','--sql',default='',help='File with the SQL commands to create the DB',type=str, required=True)
+    parser.add_argument('-f','--sql',default='',help='File with the SQL commands to create the DB (required unless --migrate is used)',type=str)
+    parser.add_argument('-m','--migrate',default=False,help='Do not create the DB, only apply the pending migrations to the existing DB [default False]',action='store_true')
+    parser.add_argument('--migrations',default=utils.DEFAULT_MIGRATIONS_DIR,help='Folder with the numbered migration files (NNN_description.sql) [default ' + utils.DEFAULT_MIGRATIONS_DIR + ']',type=str)
     parser.add_argument('-d','--dbname',default=utils.DEFAULT_DB,help='Postgres DB name [default ' + utils.DEFAULT_DB + ']',type=str)
     parser.add_argument('-u','--dbuser',default=utils.USERNAME,help='DB user [default ' + utils.USERNAME + ']',type=str)
     parser.add_argument('-p','--dbpass',default='',help='DB pass',type=str)
@@ -7,7 +7,10 @@
 # Created:          26.01.2015
 # Last modified:    28.01.2015
 # Changes:
-# Notes:
+# Notes:            * The configuration is streamed to the output file with
+#                     viewer_conf_writer while it is read from the DB
+#                   * The rows of the active objects are read with named
+#                     (server-side) cursors
 ##############################################################################
 
 import os
@@ -16,6 +19,7 @@ import glob
 import utils
 import argparse
 import viewer_conf_api
+import viewer_conf_writer
 
 logger = None
 
@@ -41,6 +45,12 @@ DEFAULT_PREFENCES = """
     <backFaceCulling on="1" />
 </preferences>"""
 
+# Items with robust low and high Z, i.e. the 1 and 99 percentiles of the Z of 
+# the points in their cutouts (from ITEM_Z_STATS) when available
+ITEM_ROBUST_Z = """(
+SELECT ITEM.*, COALESCE(ITEM_Z_STATS.p1_z, ITEM.min_z) AS low_z, COALESCE(ITEM_Z_STATS.p99_z, ITEM.max_z) AS high_z 
+FROM ITEM LEFT JOIN ITEM_Z_STATS USING (item_id))"""
+
 
 def run(opts):
     global logger
@@ -64,80 +74,101 @@ def run(opts):
                                            opts.dbpass, opts.dbhost,
                                            opts.dbport)
     
-    # Check that provided background is in DB
+    # Check that provided background is in DB. We also get the offsets of all 
+    # the backgrounds (by SRID) to convert the positions without querying the DB
     query = """
-SELECT OSG_DATA_ITEM_PC_BACKGROUND.abs_path,srid 
+SELECT OSG_DATA_ITEM_PC_BACKGROUND.abs_path, srid, offset_x, offset_y, offset_z 
 FROM OSG_DATA_ITEM_PC_BACKGROUND JOIN RAW_DATA_ITEM USING (raw_data_item_id)"""
     rows, num_rows = utils.fetchDataFromDB(cursor, query)
     backGroundAbsPath = None
     backgroundSRID = None
-    for (bgAbsPath,bgSRID) in rows:
+    backgroundOffsets = {}
+    for (bgAbsPath, bgSRID, bgOffsetX, bgOffsetY, bgOffsetZ) in rows:
         if opts.background == os.path.basename(bgAbsPath):
             backGroundAbsPath = bgAbsPath
             backgroundSRID = bgSRID
+        if bgSRID not in backgroundOffsets:
+            backgroundOffsets[bgSRID] = (bgOffsetX, bgOffsetY, bgOffsetZ)
     if backGroundAbsPath == None:
         errorMsg = 'Background ' + opts.background + ' is not found'
         logger.error(errorMsg)
         raise Exception(errorMsg)
     
-    # Get the root object: the OSG configuration
-    rootObject = viewer_conf_api.osgRCconfiguration()
-    # set version
-    rootObject.set_version("0.2")
+    # The configuration is written while it is read from the DB (in a 
+    # temporal file that replaces the output when it is complete)
+    tempOutput = opts.output + '_TEMP'
+    outfile = open(tempOutput, 'w')
+    try:
+        writeConfiguration(opts, connection, cursor, outfile, backGroundAbsPath, backgroundSRID, backgroundOffsets)
+    except:
+        # The incomplete configuration is not left on disk
+        outfile.close()
+        os.remove(tempOutput)
+        raise
+    outfile.close()
+    os.rename(tempOutput, opts.output)
+    
+    elapsed_time = time.time() - t0
+    msg = 'Finished. Total elapsed time: %.02f seconds. See %s' % (elapsed_time, logname)
+    print(msg)
+    logger.info(msg)
+
+def writeConfiguration(opts, connection, cursor, outfile, backGroundAbsPath, backgroundSRID, backgroundOffsets):
+    """ Writes the configuration to outfile while it is read from the DB. The
+    rows of the active objects are read with server-side cursors (see
+    fetchRows)"""
+    writer = viewer_conf_writer.ViewerConfWriter(outfile)
+    # Start the root object: the OSG configuration
+    writer.startConfiguration("0.2")
 
     # Add all the different XML of the active objects
     # (we add distinct since the boundings will share XMLs)
     query = """
 SELECT DISTINCT xml_abs_path 
 FROM OSG_DATA_ITEM ORDER BY xml_abs_path"""
-    rows, num_rows = utils.fetchDataFromDB(cursor, query)
-    for (xmlPath,) in rows:
+    utils.dbExecute(cursor, query)
+    for (xmlPath,) in cursor:
         if xmlPath.count(opts.osg) == 0:
             logger.error('Mismatch between given OSG data directory ' +
                          'and DB content')
-        rootObject.add_objectLibrary(viewer_conf_api.objectLibrary
-                                     (url=os.path.relpath(xmlPath, opts.osg)))
+        writer.writeObjectLibrary(os.path.relpath(xmlPath, opts.osg))
 
     # Add the object library with the boundings
-    rootObject.add_objectLibrary(viewer_conf_api.objectLibrary
-                                 (url=utils.BOUNDINGS_XML_RELATIVE))
+    writer.writeObjectLibrary(utils.BOUNDINGS_XML_RELATIVE)
 
     # Add the cameras that are in the DB
-    cameras = viewer_conf_api.cameras()
+    writer.startElement('cameras')
     query = """
 SELECT osg_camera_name, srid, x, y, z, h, p, r 
 FROM OSG_CAMERA JOIN OSG_LOCATION USING (osg_location_id)"""
-    rows, num_rows = utils.fetchDataFromDB(cursor, query)
-    for (name, srid, x, y, z, h, p, r) in rows:
-        if (srid is not None) and (srid == bgSRID):
-            x, y, z = getOSGPosition(x, y, z, srid)
+    utils.dbExecute(cursor, query)
+    for (name, srid, x, y, z, h, p, r) in cursor:
+        if (srid is not None) and (srid == backgroundSRID):
+            x, y, z = getOSGPosition(x, y, z, backgroundOffsets, srid)
         else:
             x, y, z = getOSGPosition(x, y, z)
-        cameras.add_camera(viewer_conf_api.camera
-                           (name=name, x=x, y=y, z=z, h=h, p=p, r=r))
+        writer.writeCamera(name, x, y, z, h, p, r)
     # Add Default cameras for the items that have no camera in the DB
     query = """
 SELECT 
-    item_id, ST_SRID(geom), st_x(st_centroid(geom)), st_y(st_centroid(geom)), min_z + ((max_z - min_z) / 2) 
-FROM ITEM WHERE NOT background AND geom IS NOT null AND item_id NOT IN (
+    item_id, ST_SRID(geom), st_x(st_centroid(geom)), st_y(st_centroid(geom)), low_z + ((high_z - low_z) / 2) 
+FROM """ + ITEM_ROBUST_Z + """ A WHERE NOT background AND geom IS NOT null AND item_id NOT IN (
     SELECT DISTINCT item_id FROM OSG_ITEM_CAMERA
 ) ORDER BY item_id"""
-    rows, numitems = utils.fetchDataFromDB(cursor, query)
-    for (itemId, srid, x, y, z) in rows:
+    utils.dbExecute(cursor, query)
+    for (itemId, srid, x, y, z) in cursor:
         # only call getOSGPosition if [x,y,z] are not None
         # should item_id = -1 be added? 
         if all(position is not None for position in [x,y,z]) and itemId>0:
-            if (srid is not None) and (srid == bgSRID):
-                x, y, z = getOSGPosition(x, y, z, srid)
+            if (srid is not None) and (srid == backgroundSRID):
+                x, y, z = getOSGPosition(x, y, z, backgroundOffsets, srid)
             else:
                 x, y, z = getOSGPosition(x, y, z)
-            cameras.add_camera(viewer_conf_api.camera
-                               (name=utils.DEFAULT_CAMERA_PREFIX + str(itemId),
-                                x=x, y=y, z=z))
-    rootObject.set_cameras(cameras)
+            writer.writeCamera(utils.DEFAULT_CAMERA_PREFIX + str(itemId), x, y, z)
+    writer.endElement()
     
     # Add the XML content of the preferences
-    rootObject.set_preferences(viewer_conf_api.parseString(DEFAULT_PREFENCES))
+    writer.writeObject(viewer_conf_api.parseString(DEFAULT_PREFENCES), 'preferences')
     
     attributes = viewer_conf_api.attributes()
     # Use generic method to fill all properties.
@@ -155,22 +186,20 @@ FROM ITEM WHERE NOT background AND geom IS NOT null AND item_id NOT IN (
             getattr(elements, 'add_' + property)(getattr(
                 viewer_conf_api, property)(name=element))
         getattr(attributes, 'set_' + property + 's')(elements)
-    rootObject.set_attributes(attributes)
+    writer.writeObject(attributes, 'attributes')
     # Add all the static objects, i.e. the OSG from the background
 
     # Add the static object for the background
-    staticObjects = viewer_conf_api.staticObjects()
-    staticObjects.add_staticObject(viewer_conf_api.staticObject
-                                           (url=os.path.relpath(
-                                           glob.glob(backGroundAbsPath + '/' + utils.OSG_DATA_PREFIX + '.osgb')[0],
-                                           opts.osg)))
+    writer.startElement('staticObjects')
+    writer.writeStaticObject(os.path.relpath(
+        glob.glob(backGroundAbsPath + '/' + utils.OSG_DATA_PREFIX + '.osgb')[0],
+        opts.osg))
     # Add hardcode DOME
-    staticObjects.add_staticObject(viewer_conf_api.staticObject
-                                   (url=utils.DOMES_OSG_RELATIVE))
-    rootObject.set_staticObjects(staticObjects)
+    writer.writeStaticObject(utils.DOMES_OSG_RELATIVE)
+    writer.endElement()
 
     # Add the 5 different layers of active objects
-    activeObjects = viewer_conf_api.activeObjects()
+    writer.startElement('activeObjects')
     # First we add points, meshes and pcitures which are related to
     # the active_objects_sites
     layersData = [('points', 'OSG_DATA_ITEM_PC_SITE', utils.AO_TYPE_PC),
@@ -178,140 +207,119 @@ FROM ITEM WHERE NOT background AND geom IS NOT null AND item_id NOT IN (
                   ('meshes', 'OSG_DATA_ITEM_MESH', utils.AO_TYPE_MESH)]
     
     for (layerName, tableName, inType) in layersData:
-        layer = viewer_conf_api.layer(name=layerName)
+        writer.startElement('layer', [('name', layerName)])
         
         query = """
-SELECT item_id, raw_data_item_id, OSG_LOCATION.srid, x, y, z, xs, ys, zs, h, p, r, cast_shadow 
+SELECT item_id, raw_data_item_id, RAW_DATA_ITEM.abs_path, OSG_LOCATION.srid, x, y, z, xs, ys, zs, h, p, r, cast_shadow 
 FROM """ + tableName + """ JOIN OSG_DATA_ITEM USING (osg_data_item_id) 
                            JOIN OSG_LOCATION  USING (osg_location_id) 
                            JOIN RAW_DATA_ITEM USING (raw_data_item_id) 
 ORDER BY item_id"""
-        rows, numitems = utils.fetchDataFromDB(cursor, query)
-        for (itemId, rawDataItemId, srid, x, y, z, xs, ys, zs, h, p, r, castShadow) in rows:
+        for (itemId, rawDataItemId, absPath, srid, x, y, z, xs, ys, zs, h, p, r, castShadow) in fetchRows(connection, query):
             # only call getOSGPosition if [x,y,z] are not None            
             if all(position is not None for position in [x,y,z]):
-                if (srid is not None) and (srid == bgSRID):
-                    x, y, z  = getOSGPosition(x, y, z, srid)
+                if (srid is not None) and (srid == backgroundSRID):
+                    x, y, z  = getOSGPosition(x, y, z, backgroundOffsets, srid)
                 else:
                     x, y, z = getOSGPosition(x, y, z)
-            uniqueName = utils.codeOSGActiveObjectUniqueName(cursor, inType, rawDataItemId)
-            activeObject = viewer_conf_api.activeObject(prototype=uniqueName,
-                                                        uniqueName=uniqueName)
-            setting = viewer_conf_api.setting(
+            uniqueName = utils.codeOSGActiveObjectUniqueName(None, inType, rawDataItemId, itemId = itemId, absPath = absPath)
+            writer.writeActiveObject(uniqueName, uniqueName, dict(
                 x=x, y=y, z=z, xs=xs, ys=ys, zs=zs, h=h, p=p, r=r,
-                castShadow=(1 if castShadow else 0))
-            activeObject.set_setting(setting)
-            layer.add_activeObject(activeObject)
-        activeObjects.add_layer(layer)
+                castShadow=(1 if castShadow else 0)))
+        writer.endElement()
 
     # Add the boundings
-    layer = viewer_conf_api.layer(name='boundings')
+    writer.startElement('layer', [('name', 'boundings')])
     # We first add the boundings that are currently in the DB
     query = """
 SELECT item_id, object_number, x, y, z, xs, ys, zs, h, p, r, OSG_LOCATION.cast_shadow, srid 
 FROM OSG_ITEM_OBJECT JOIN OSG_LOCATION USING (osg_location_id) 
 ORDER BY item_id,object_number"""
-    osgItemObjects, numOsgItemObjects = utils.fetchDataFromDB(cursor, query)
-    # osgItemObjects is (itemId, objectNumber, x, y, z, xs, ys, zs, h, p, r, castShadow, srid)
+    for (itemId, objectNumber, x, y, z, xs, ys, zs, h, p, r, castShadow, srid) in fetchRows(connection, query):
+        writeBounding(writer, backgroundSRID, backgroundOffsets, itemId, objectNumber, x, y, z, xs, ys, zs, h, p, r, castShadow, srid)
     # Now we add Default OSG data items for the objects that are not in OSG_ITEM_OBJECT table
+    # (their position and size are from the footprint of their item, if any)
     query = """
-SELECT item_id,object_number 
-FROM item_object 
-WHERE (item_id,object_number) NOT IN (SELECT item_id,object_number FROM OSG_ITEM_OBJECT)
-ORDER BY item_id,object_number"""
-    objects, num_objects = utils.fetchDataFromDB(cursor, query)
-    for (itemId, objectNumber) in objects:
-        srid = None
-        (x,y,z) = (0,0,0)
-        (xs,ys,zs) = (1,1,1)
-        query = """
-SELECT ST_SRID(geom), st_x(st_centroid(geom)), st_y(st_centroid(geom)), min_z + ((max_z - min_z) / 2), 
-       st_xmax(geom)-st_xmin(geom) as dx, st_ymax(geom)-st_ymin(geom) as dy, (max_z - min_z) as dz 
-FROM ITEM 
-WHERE item_id = %s and geom is not %s"""
-        queryArgs = [itemId, None]
-        footprints, num_footprints = utils.fetchDataFromDB(cursor, query, queryArgs)
-        if num_footprints:
-            (srid, x, y, z, xs, ys, zs) = footprints[0]
+SELECT O.item_id, O.object_number, A.item_id IS NOT NULL, ST_SRID(A.geom), st_x(st_centroid(A.geom)), st_y(st_centroid(A.geom)), 
+       A.low_z + ((A.high_z - A.low_z) / 2), st_xmax(A.geom)-st_xmin(A.geom) as dx, st_ymax(A.geom)-st_ymin(A.geom) as dy, (A.high_z - A.low_z) as dz 
+FROM ITEM_OBJECT O 
+     LEFT JOIN OSG_ITEM_OBJECT S ON (O.item_id = S.item_id AND O.object_number = S.object_number) 
+     LEFT JOIN """ + ITEM_ROBUST_Z + """ A ON (O.item_id = A.item_id AND A.geom IS NOT NULL) 
+WHERE S.item_id IS NULL 
+ORDER BY O.item_id, O.object_number"""
+    for (itemId, objectNumber, hasFootprint, srid, x, y, z, xs, ys, zs) in fetchRows(connection, query):
+        if hasFootprint:
             if xs == 0: xs = 1
             if ys == 0: ys = 1
             if zs == 0: zs = 1
-        osgItemObjects.append([itemId, objectNumber, x, y, z, xs, ys, zs, 0, 0, 0, False, srid])
-    # Now let's add them to the XML
-    for (itemId, objectNumber, x, y, z, xs, ys, zs, h, p, r, castShadow, srid) in osgItemObjects:
-        # only call getOSGPosition if [x,y,z] are not None
-        if all(position is not None for position in [x,y,z]) and itemId>0:        
-            if (srid is not None) and (srid == bgSRID):
-                x, y, z  = getOSGPosition(x, y, z, srid)
-            else:
-                x, y, z = getOSGPosition(x, y, z)                
-            uniqueName = utils.codeOSGActiveObjectUniqueName(cursor, utils.AO_TYPE_OBJ, itemId = itemId, objectId = objectNumber)
-            proto = "Bounding Box"
-            activeObject = viewer_conf_api.activeObject(prototype=proto,
-                                                        uniqueName=uniqueName)
-            setting = viewer_conf_api.setting(
-                x=x, y=y, z=z, xs=xs, ys=ys, zs=zs, h=h, p=p, r=r,
-            castShadow=(1 if castShadow else 0))
-            activeObject.set_setting(setting)
-            layer.add_activeObject(activeObject)
-    activeObjects.add_layer(layer)
+        else:
+            srid = None
+            (x,y,z) = (0,0,0)
+            (xs,ys,zs) = (1,1,1)
+        writeBounding(writer, backgroundSRID, backgroundOffsets, itemId, objectNumber, x, y, z, xs, ys, zs, 0, 0, 0, False, srid)
+    writer.endElement()
 
     # Add the labels
-    layer = viewer_conf_api.layer(name='labels')
-    utils.dbExecute(cursor, 'SELECT osg_label_name, text, red, green, blue, ' +
-                    'rotate_screen, outline, font, srid, x, y, z, xs, ys, zs, h, ' +
-                    'p, r, cast_shadow FROM OSG_LABEL INNER JOIN ' +
-                    'OSG_LOCATION ON OSG_LABEL.osg_location_id=' +
-                    'OSG_LOCATION.osg_location_id')
-    rows = cursor.fetchall()
-    for (name, text, red, green, blue, rotatescreen, outline, font, srid, x, y, z, xs, ys, zs, h, p, r, castShadow) in rows:
+    writer.startElement('layer', [('name', 'labels')])
+    query = ('SELECT osg_label_name, text, red, green, blue, ' +
+             'rotate_screen, outline, font, srid, x, y, z, xs, ys, zs, h, ' +
+             'p, r, cast_shadow FROM OSG_LABEL INNER JOIN ' +
+             'OSG_LOCATION ON OSG_LABEL.osg_location_id=' +
+             'OSG_LOCATION.osg_location_id')
+    for (name, text, red, green, blue, rotatescreen, outline, font, srid, x, y, z, xs, ys, zs, h, p, r, castShadow) in fetchRows(connection, query):
         proto = "labelPrototype"
-        uniqueName = utils.codeOSGActiveObjectUniqueName(cursor, utils.AO_TYPE_LAB, labelName = name)
-        if (srid is not None) and (srid == bgSRID):
-            x, y, z = getOSGPosition(x, y, z, srid)
+        uniqueName = utils.codeOSGActiveObjectUniqueName(None, utils.AO_TYPE_LAB, labelName = name)
+        if (srid is not None) and (srid == backgroundSRID):
+            x, y, z = getOSGPosition(x, y, z, backgroundOffsets, srid)
         else:
             x, y, z = getOSGPosition(x, y, z)
-        activeObject = viewer_conf_api.activeObject(
-            prototype=proto, uniqueName=uniqueName, labelText=text,
+        writer.writeActiveObject(proto, uniqueName, dict(
+            x=x, y=y, z=z, xs=xs, ys=ys, zs=zs, h=h, p=p, r=r,
+            castShadow=(1 if castShadow else 0)), labelText=text,
             labelColorRed=red, labelColorGreen=green, labelColorBlue=blue,
             labelRotateScreen=rotatescreen, outline=outline, Font=font)
-        setting = viewer_conf_api.setting(
-            x=x, y=y, z=z, xs=xs, ys=ys, zs=zs, h=h, p=p, r=r,
-            castShadow=(1 if castShadow else 0))
-        activeObject.set_setting(setting)
-        layer.add_activeObject(activeObject)
-    activeObjects.add_layer(layer)
+    writer.endElement()
 
-    rootObject.set_activeObjects(activeObjects)
+    # Close the active objects and the configuration
+    writer.close()
 
-    # Create the XML
-    rootObject.export(open(opts.output, 'w'), 0)
-    
-    elapsed_time = time.time() - t0
-    msg = 'Finished. Total elapsed time: %.02f seconds. See %s' % (elapsed_time, logname)
-    print(msg)
-    logger.info(msg)
+def fetchRows(connection, query):
+    """ Iterates the rows of the query with a named (server-side) cursor, the
+    rows are fetched in batches of itersize instead of all at once"""
+    namedCursor = connection.cursor(name = 'create_osg_config')
+    try:
+        logger.debug(query)
+        namedCursor.execute(query)
+        for row in namedCursor:
+            yield row
+    finally:
+        namedCursor.close()
+
+def writeBounding(writer, backgroundSRID, backgroundOffsets, itemId, objectNumber, x, y, z, xs, ys, zs, h, p, r, castShadow, srid):
+    """ Writes the bounding of the item object in the current layer"""
+    # only call getOSGPosition if [x,y,z] are not None
+    if all(position is not None for position in [x,y,z]) and itemId>0:        
+        if (srid is not None) and (srid == backgroundSRID):
+            x, y, z  = getOSGPosition(x, y, z, backgroundOffsets, srid)
+        else:
+            x, y, z = getOSGPosition(x, y, z)                
+        uniqueName = utils.codeOSGActiveObjectUniqueName(None, utils.AO_TYPE_OBJ, itemId = itemId, objectId = objectNumber)
+        proto = "Bounding Box"
+        writer.writeActiveObject(proto, uniqueName, dict(
+            x=x, y=y, z=z, xs=xs, ys=ys, zs=zs, h=h, p=p, r=r,
+            castShadow=(1 if castShadow else 0)))
 
-def getOSGPosition(x, y, z, ItemSRID=None):
+def getOSGPosition(x, y, z, backgroundOffsets=None, ItemSRID=None):
+    """ Converts the position to relative to the background with the same SRID.
+    backgroundOffsets is a dictionary with the offsets of the backgrounds by SRID"""
+    offset_x, offset_y, offset_z = 0, 0, 0
     if (ItemSRID is not None):
-        backgroundOffsets, num_backgrounds = utils.fetchDataFromDB(
-            cursor, 'SELECT offset_x, offset_y, offset_z, srid FROM ' +
-            'OSG_DATA_ITEM_PC_BACKGROUND INNER JOIN RAW_DATA_ITEM ON ' +
-            'OSG_DATA_ITEM_PC_BACKGROUND.raw_data_item_id=' +
-            'RAW_DATA_ITEM.raw_data_item_id')
-        background = [BACK for BACK in backgroundOffsets if 
-                      BACK[3] == ItemSRID]
-        if len(background) == 0:
+        if ItemSRID not in backgroundOffsets:
             logger.warning('No background with the same SRID %s is found'
                 % (ItemSRID))
-        #if len(background) > 1:
-        #    logger.warning('Multiple backgrounds with the same SRID %s found'
-        #        % (ItemSRID))
         else:
             # found the associated background in the database
-            offset_x, offset_y, offset_z, srid = background[0]
-    else:
-        offset_x, offset_y, offset_z = 0, 0, 0
+            offset_x, offset_y, offset_z = backgroundOffsets[ItemSRID]
     # convert item position to relative to associated background
     x_out = x - offset_x
     y_out = y - offset_y
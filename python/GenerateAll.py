@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Script to run all the pending conversions (OSG, POTree
+#                   and Nexus) as a single pipeline and register the
+#                   generated data items in the DB
+# Notes:            * The conversion tasks are queried from the DB (the raw
+#                     data items without the related converted data item)
+#                   * The site OSG conversions depend on the OSG conversion
+#                     of the point cloud backgrounds with the same SRID
+#                     (they need their offsets)
+#                   * The tasks run on a pool of processes, with a limit of
+#                     concurrent tasks per converter
+#                   * Finally UpdateDB registers the generated data items
+##############################################################################
+
+import os, time, argparse, logging, multiprocessing, Queue
+import utils, converter_utils, GenerateOSG, GeneratePOTree, GenerateNexus, UpdateDB
+
+# The generators (as the types of UpdateDB)
+OSG_GEN = 'o'
+POTREE_GEN = 'p'
+NEXUS_GEN = 'n'
+GENERATORS = OSG_GEN + POTREE_GEN + NEXUS_GEN
+GENERATORS_NAMES = {OSG_GEN: utils.OSG_FT, POTREE_GEN: utils.POT_FT, NEXUS_GEN: utils.NEX_FT}
+
+def getTasks(cursor, generators):
+    """ Get the DAG of conversion tasks. Each task is a (generator, rawDataItemId)
+    tuple. Returns the list of tasks (in submission order), the dictionary
+    task -> set of tasks it depends on, the dictionary of the raw data items
+    that are backgrounds and the dictionary with the SRID of the point cloud
+    backgrounds raw data items"""
+    tasks = []
+    dependencies = {}
+    backgrounds = {}
+    backgroundsSRIDs = {}
+    if OSG_GEN in generators:
+        rows = GenerateOSG.getPendingItems(cursor, backgrounds = True)
+        for (rawDataItemId, absPath, isBackground, srid) in rows:
+            if isBackground and '/PC/' in absPath:
+                backgroundsSRIDs[rawDataItemId] = srid
+        for (rawDataItemId, absPath, isBackground, srid) in rows:
+            task = (OSG_GEN, rawDataItemId)
+            tasks.append(task)
+            dependencies[task] = set()
+            if not isBackground:
+                # aligned with the point cloud backgrounds with same SRID
+                for (backgroundId, backgroundSRID) in backgroundsSRIDs.items():
+                    if backgroundSRID == srid:
+                        dependencies[task].add((OSG_GEN, backgroundId))
+    if POTREE_GEN in generators:
+        for (rawDataItemId, absPath, isBackground) in GeneratePOTree.getPendingItems(cursor):
+            task = (POTREE_GEN, rawDataItemId)
+            tasks.append(task)
+            dependencies[task] = set()
+            backgrounds[rawDataItemId] = isBackground
+    if NEXUS_GEN in generators:
+        for (rawDataItemId, absPath) in GenerateNexus.getPendingItems(cursor):
+            task = (NEXUS_GEN, rawDataItemId)
+            tasks.append(task)
+            dependencies[task] = set()
+    return (tasks, dependencies, backgrounds, backgroundsSRIDs)
+
+def runTask(generator, rawDataItemId, outDir, levels, backgroundOffsets, cacheDir, timeout, memLimit, potreeEngine, dbname, dbuser, dbpass, dbhost, dbport):
+    """ Runs a conversion task in a process of the pool with its own DB
+    connection. Returns (generator, rawDataItemId, offsets, errorMessage, elapsed).
+    The offsets are only returned by the OSG conversions"""
+    t0 = time.time()
+    (offsets, errorMsg) = (None, None)
+    (connection, cursor) = (None, None)
+    try:
+        connection, cursor = utils.connectToDB(dbname, dbuser, dbpass, dbhost, dbport)
+        if generator == OSG_GEN:
+            (mainOsgb, xmlPath, offsets) = GenerateOSG.createOSG(cursor, rawDataItemId, outDir, backgroundOffsets, cacheDir, timeout, memLimit)
+        elif generator == POTREE_GEN:
+            GeneratePOTree.createPOTree(cursor, rawDataItemId, outDir, levels, cacheDir, timeout, memLimit, potreeEngine)
+        else:
+            GenerateNexus.createNexus(cursor, rawDataItemId, outDir, cacheDir, timeout, memLimit)
+    except Exception as e:
+        errorMsg = str(e)
+    finally:
+        if connection != None:
+            utils.closeConnectionDB(connection, cursor)
+    return (generator, rawDataItemId, offsets, errorMsg, time.time() - t0)
+
+def run(opts):
+    # Start logging
+    logname = os.path.splitext(os.path.basename(__file__))[0] + '.log'
+    utils.start_logging(filename=logname, level=opts.log)
+    localtime = utils.getCurrentTimeAsAscii()
+    t0 = time.time()
+    msg = os.path.basename(__file__) + ' script starts at %s.' % localtime
+    print msg
+    logging.info(msg)
+
+    for generator in opts.generators:
+        if generator not in GENERATORS:
+            raise Exception('Unknown generator ' + generator + '. Valid generators are ' + GENERATORS)
+    if min(opts.cores, opts.osgjobs, opts.potreejobs, opts.nexusjobs) < 1:
+        raise Exception('The number of processes and the maximum number of concurrent conversions must be at least 1')
+
+    # The output folders are absolute since they are used by the processes 
+    # of the pool
+    outDirs = {OSG_GEN: os.path.abspath(opts.osgDir),
+               POTREE_GEN: os.path.abspath(opts.potreeDir),
+               NEXUS_GEN: os.path.abspath(opts.nexusDir)}
+    limits = {OSG_GEN: opts.osgjobs, POTREE_GEN: opts.potreejobs, NEXUS_GEN: opts.nexusjobs}
+
+    # database connection
+    connection, cursor = utils.connectToDB(opts.dbname, opts.dbuser,
+                                           opts.dbpass, opts.dbhost,
+                                           opts.dbport)
+    (tasks, dependencies, backgrounds, backgroundsSRIDs) = getTasks(cursor, opts.generators)
+    # Estimated costs of the tasks for the admission control
+    costs = {}
+    for generator in opts.generators:
+        for (rawDataItemId, cost) in converter_utils.getConversionsCosts(cursor, GENERATORS_NAMES[generator], [t[1] for t in tasks if t[0] == generator]).items():
+            costs[(generator, rawDataItemId)] = cost
+    utils.closeConnectionDB(connection, cursor)
+
+    msg = 'Pending conversion tasks: ' + ', '.join('%d %s' % (len([t for t in tasks if t[0] == g]), GENERATORS_NAMES[g]) for g in opts.generators)
+    print msg
+    logging.info(msg)
+
+    pool = multiprocessing.Pool(opts.cores)
+    resultsQueue = Queue.Queue()
+    running = dict((generator, 0) for generator in GENERATORS)
+    backgroundOffsets = {}
+    admission = converter_utils.AdmissionControl(opts.maxmem, opts.maxcpu)
+    (done, failed) = (set(), set())
+    pending = list(tasks)
+    numRunning = 0
+    while len(pending) or numRunning:
+        # Submit the tasks whose dependencies are done while there are free
+        # processes, the limit of the converter is not reached and their 
+        # estimated cost is admitted
+        for task in list(pending):
+            if numRunning >= opts.cores:
+                break
+            (generator, rawDataItemId) = task
+            if len(dependencies[task] & failed):
+                logging.error('Skipping %s conversion of raw data item %d: the conversion of the background failed' % (GENERATORS_NAMES[generator], rawDataItemId))
+                failed.add(task)
+                pending.remove(task)
+                continue
+            if running[generator] >= limits[generator] or not dependencies[task] <= done:
+                continue
+            cost = costs.get(task, (0, 1))
+            if not admission.canAdmit(cost):
+                continue
+            admission.admit(cost)
+            levels = None
+            if generator == POTREE_GEN:
+                levels = GeneratePOTree.getNumLevels(opts, backgrounds[rawDataItemId])
+            pool.apply_async(runTask, (generator, rawDataItemId, outDirs[generator], levels, backgroundOffsets, opts.cache, opts.timeout, opts.memlimit, opts.potreeengine,
+                                       opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport),
+                             callback = resultsQueue.put)
+            logging.info('Starting %s conversion of raw data item %d (estimated memory %.0f MB)' % (GENERATORS_NAMES[generator], rawDataItemId, cost[0]))
+            running[generator] += 1
+            numRunning += 1
+            pending.remove(task)
+        if numRunning == 0:
+            # the remaining tasks depend on failed tasks
+            continue
+        (generator, rawDataItemId, offsets, errorMsg, elapsed) = resultsQueue.get()
+        task = (generator, rawDataItemId)
+        running[generator] -= 1
+        numRunning -= 1
+        admission.release(costs.get(task, (0, 1)))
+        if errorMsg != None:
+            failed.add(task)
+            logging.error('%s conversion of raw data item %d failed in %.2f seconds: %s' % (GENERATORS_NAMES[generator], rawDataItemId, elapsed, errorMsg))
+        else:
+            done.add(task)
+            if task[0] == OSG_GEN and rawDataItemId in backgroundsSRIDs:
+                backgroundOffsets[backgroundsSRIDs[rawDataItemId]] = offsets
+            logging.info('%s conversion of raw data item %d done in %.2f seconds' % (GENERATORS_NAMES[generator], rawDataItemId, elapsed))
+    pool.close()
+    pool.join()
+
+    msg = 'Conversions: %d done, %d failed' % (len(done), len(failed))
+    print msg
+    logging.info(msg)
+    if len(failed):
+        logging.error('Failed conversions: ' + ', '.join('%s %d' % (GENERATORS_NAMES[t[0]], t[1]) for t in sorted(failed)))
+
+    # Register the generated data items in the DB
+    if len(done):
+        updateDBArgs = ['-i', opts.data, '-t', ''.join(g for g in opts.generators if g in set(t[0] for t in done)), '-d', opts.dbname, '-u', opts.dbuser, '--log', opts.log]
+        for (option, value) in (('-p', opts.dbpass), ('-b', opts.dbhost), ('-r', opts.dbport)):
+            if value:
+                updateDBArgs.extend([option, value])
+        UpdateDB.run(utils.apply_argument_parser(UpdateDB.argument_parser(), updateDBArgs))
+
+    elapsed_time = time.time() - t0
+    msg = 'Finished. Total elapsed time: %.02f seconds. See %s' % (elapsed_time, logname)
+    print(msg)
+    logging.info(msg)
+
+def argument_parser():
+    """ Define the arguments and return the parser object"""
+    description = "Runs all the pending conversions (OSG, POTree and Nexus) of the raw data items in parallel and registers the generated data items in the DB"
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('-g', '--generators', default=GENERATORS,
+                        help='What conversions are run? o for OSG, p for POTREE, n for NEXUS [default all, i.e. ' + GENERATORS + ']',
+                        type=str)
+    parser.add_argument('-d', '--dbname', default=utils.DEFAULT_DB,
+                        help='Postgres DB name [default ' + utils.DEFAULT_DB +
+                        ']', action='store')
+    parser.add_argument('-u', '--dbuser', default=utils.USERNAME,
+                        help='DB user [default ' + utils.USERNAME +
+                        ']', action='store')
+    parser.add_argument('-p', '--dbpass', default='', help='DB pass', action='store')
+    parser.add_argument('-t', '--dbhost', default='', help='DB host', action='store')
+    parser.add_argument('-r', '--dbport', default='', help='DB port', action='store')
+    parser.add_argument('-i', '--data', default=utils.DEFAULT_DATA_DIR,
+                        help='Data folder used to register the generated data items [default ' +
+                        utils.DEFAULT_DATA_DIR + ']', action='store')
+    parser.add_argument('--osgDir', default=utils.DEFAULT_OSG_DATA_DIR,
+                        help='OSG data directory [default ' +
+                        utils.DEFAULT_OSG_DATA_DIR + ']', action='store')
+    parser.add_argument('--potreeDir', default=utils.DEFAULT_POTREE_DATA_DIR,
+                        help='POTree data directory [default ' +
+                        utils.DEFAULT_POTREE_DATA_DIR + ']', action='store')
+    parser.add_argument('--nexusDir', default=utils.DEFAULT_NEXUS_DATA_DIR,
+                        help='Nexus data directory [default ' +
+                        utils.DEFAULT_NEXUS_DATA_DIR + ']', action='store')
+    parser.add_argument('--levels', default='',
+                        help='Number of levels of the POTree octrees [default is 4 for sites and 8 for backgrounds]',
+                        type=str)
+    parser.add_argument('--potreeengine', default=GeneratePOTree.DEFAULT_ENGINE,
+                        help='Engine used to build the POTree octrees (the native engine runs in the process of the task) [default ' + GeneratePOTree.DEFAULT_ENGINE + ']',
+                        choices=GeneratePOTree.ENGINES)
+    parser.add_argument('-c', '--cores', default=1,
+                        help='Number of processes of the pool, i.e. maximum number of concurrent conversions [default 1]',
+                        type=int)
+    parser.add_argument('--osgjobs', default=1,
+                        help='Maximum number of concurrent OSG conversions [default 1]',
+                        type=int)
+    parser.add_argument('--potreejobs', default=1,
+                        help='Maximum number of concurrent POTree conversions [default 1]',
+                        type=int)
+    parser.add_argument('--nexusjobs', default=1,
+                        help='Maximum number of concurrent Nexus conversions [default 1]',
+                        type=int)
+    parser.add_argument('--cache', default='',
+                        help='Folder of the conversions cache. The conversions of input files and converter options already in the cache are hardlinked from it instead of running the converter [default is not to use the cache, the suggested folder is ' +
+                        converter_utils.DEFAULT_CACHE_DIR + ']', action='store')
+    parser.add_argument('--timeout', default=0,
+                        help='Maximum time in seconds of a conversion, the converter is killed if it runs longer [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--memlimit', default=0,
+                        help='Maximum memory in MB used by a converter, it is killed if it uses more [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--maxmem', default=0,
+                        help='Maximum total estimated memory in MB of the concurrent conversions, a conversion only starts if the estimated memory of the running conversions plus its own fits [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--maxcpu', default=0,
+                        help='Maximum total estimated number of CPUs of the concurrent conversions [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('-l', '--log', help='Log level',
+                        choices=utils.LOG_LEVELS_LIST,
+                        default=utils.DEFAULT_LOG_LEVEL)
+    return parser
+
+if __name__ == "__main__":
+    try:
+        utils.checkSuperUser()
+        run(utils.apply_argument_parser(argument_parser()))
+    except Exception as e:
+        print e
@@ -11,12 +11,13 @@
 # Changes:
 ##############################################################################
 
-import shutil, time, os, utils, glob, subprocess, argparse, shlex, logging
+import shutil, time, os, utils, glob, argparse, shlex, logging
+import converter_utils
 
 CONVERTER_COMMAND = 'nxsbuild'
 outputFormat = 'nxs'
 
-def createNexus(cursor, itemId, nexusDir):
+def createNexus(cursor, itemId, nexusDir, cacheDir = None, timeout = None, memLimit = None):
     
     # extract abspath using raw_data_item_id
     data_items, num_items = utils.fetchDataFromDB(
@@ -43,22 +44,33 @@ def createNexus(cursor, itemId, nexusDir):
         error('Database key absPath should define a directory, ' +
                       'file detected: ' + abspath, outFolder)
         # os.chdir(os.path.dirname(inFile))
-    else:
-        # input is already a directory
-        os.chdir(abspath)
 
     # create the output folder
     os.system('mkdir -p ' + outFolder)
     
+    # The cache key uses the converter options without the folders
+    cacheKey = None
+    if cacheDir:
+        cacheKey = converter_utils.getCacheKey(cacheDir, [inputFile,], 
+            CONVERTER_COMMAND + ' ' + inputFileName + ' -o ' + outputFileName)
+    if cacheKey != None and converter_utils.fetchFromCache(cacheDir, cacheKey, outFolder):
+        return
+    
     # Run the nxsbuild in the docker container nxs in the docker-machine
     outputPath = os.path.join(outFolder, outputFileName)
-    command = "nxsbuild " + inputFileName + " -o " + outputPath
-    logging.info(command)
-    os.system(command)
+    logFile = os.path.join(outFolder, CONVERTER_COMMAND + '.log')
+    command = CONVERTER_COMMAND + " " + inputFileName + " -o " + outputPath
+    # the converter runs in the input folder (without changing ours)
+    try:
+        converter_utils.runConverter(shlex.split(command), logFile, abspath, timeout, memLimit)
+    except Exception as e:
+        error(str(e), outFolder)
 
     if not os.path.isfile(outputPath):
         error('none Nexus file was generated (found in ' + outFolder +
                      ').', outFolder)
+    if cacheKey != None:
+        converter_utils.storeInCache(cacheDir, cacheKey, outFolder)
 
 def extract_inType(abspath, site_id, nexusDir):
     '''
@@ -113,6 +125,17 @@ def error(errorMessage, outFolder):
      shutil.rmtree(outFolder)
      raise Exception(errorMessage)
  
+def getPendingItems(cursor):
+    """ Gets the mesh raw data items with PLY and without related Nexus data 
+    item as a list of (raw_data_item_id, abs_path)"""
+    query = """
+SELECT raw_data_item_id,abs_path
+FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) JOIN RAW_DATA_ITEM_MESH USING (raw_data_item_id) 
+WHERE ply_abs_path is NOT NULL AND raw_data_item_id NOT IN (
+          SELECT raw_data_item_id FROM NEXUS_DATA_ITEM_MESH)"""
+    raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
+    return raw_data_items
+
 def run(opts):
     # Start logging
     logname = os.path.splitext(os.path.basename(__file__))[0] + '.log'
@@ -131,16 +154,11 @@ def run(opts):
         utils.listRawDataItems(cursor)
         return
     elif opts.itemid == '' or opts.itemid == '!':
-        query = """
-SELECT raw_data_item_id,abs_path
-FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) JOIN RAW_DATA_ITEM_MESH USING (raw_data_item_id) 
-WHERE ply_abs_path is NOT NULL AND raw_data_item_id NOT IN (
-          SELECT raw_data_item_id FROM NEXUS_DATA_ITEM_MESH)"""
         # Get the list of items that are not converted yet (we sort by background to have the background converted first)
-        raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
+        raw_data_items = getPendingItems(cursor)
         for (rawDataItemId,absPath) in raw_data_items:
             if opts.itemid == '' :
-                createNexus(cursor, rawDataItemId, opts.nexusDir)
+                createNexus(cursor, rawDataItemId, opts.nexusDir, opts.cache, opts.timeout, opts.memlimit)
             else:
                 m = '\t'.join((str(rawDataItemId),absPath))
                 print m
@@ -152,7 +170,7 @@ WHERE ply_abs_path is NOT NULL AND raw_data_item_id NOT IN (
             if num_rows == 0:
                 logging.error('There is not a raw data item with id %d' % int(rawDataItemId))
                 return
-            createNexus(cursor, int(rawDataItemId), opts.nexusDir)
+            createNexus(cursor, int(rawDataItemId), opts.nexusDir, opts.cache, opts.timeout, opts.memlimit)
 
     # close DB connection
     utils.closeConnectionDB(connection, cursor)
@@ -184,6 +202,15 @@ def argument_parser():
                         help='Nexus data directory [default ' +
                         utils.DEFAULT_NEXUS_DATA_DIR + ']', action='store')
 
+    parser.add_argument('--cache', default='',
+                        help='Folder of the conversions cache. The conversions of input files and converter options already in the cache are hardlinked from it instead of running the converter [default is not to use the cache, the suggested folder is ' +
+                        converter_utils.DEFAULT_CACHE_DIR + ']', action='store')
+    parser.add_argument('--timeout', default=0,
+                        help='Maximum time in seconds of a conversion, the converter is killed if it runs longer [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--memlimit', default=0,
+                        help='Maximum memory in MB used by a converter, it is killed if it uses more [default 0, i.e. no limit]',
+                        type=int)
     parser.add_argument('-l', '--log', help='Log level',
                         choices=utils.LOG_LEVELS_LIST,
                         default=utils.DEFAULT_LOG_LEVEL)
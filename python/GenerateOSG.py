@@ -18,11 +18,12 @@
 #                   * Unique identifier is created in xml config file
 ##############################################################################
 
-import shutil, os, time, utils, glob, subprocess, argparse, shlex, logging
+import shutil, os, time, utils, glob, argparse, shlex, logging
+import converter_utils
+from multiprocessing.pool import ThreadPool
 
 CONVERTER_COMMAND = 'ViaAppia'
-
-cwd = None
+DEFAULT_JOBS = 1
 
 def getOSGFileFormat(inType):
     return 'osgb'
@@ -43,15 +44,23 @@ def updateXMLDescription(xmlPath, cursor, aoType, rawDataItemId):
     shutil.move(tempFile, xmlPath)
 
 
-def createOSG(cursor, itemId, osgDir):
-    global cwd
+def createOSG(cursor, itemId, osgDir, backgroundOffsets = None, cacheDir = None, timeout = None, memLimit = None):
+    """ Converts the raw data item with the OSG converter. It does not change 
+    the current working directory nor any global state so several conversions 
+    can run concurrently. backgroundOffsets is an optional dictionary 
+    srid -> (offsetX, offsetY, offsetZ) with the offsets of the backgrounds 
+    converted in this same run (and hence not yet in the DB). If cacheDir is 
+    specified the output is taken from the conversions cache when possible. 
+    The converter is killed if it runs more than timeout seconds or uses more 
+    than memLimit MB. 
+    Returns the main OSG file, the XML file and the offsets of the conversion"""
     (mainOsgb, xmlPath, offsets) = (None, None, (0, 0, 0))
     
     # extract abspath using raw_data_item_id
     data_items, num_items = utils.fetchDataFromDB(
-        cursor, "SELECT abs_path, item_id FROM RAW_DATA_ITEM WHERE " +
+        cursor, "SELECT abs_path, item_id, srid FROM RAW_DATA_ITEM WHERE " +
         "raw_data_item_id = %s", (itemId,))
-    absPath, site_id = data_items[0]
+    absPath, site_id, srid = data_items[0]
 
     # extract inType & outFolder, create outFolder in non-existent
     inType, inKind, outFolder = extract_inType(absPath, site_id, osgDir)
@@ -78,7 +87,7 @@ def createOSG(cursor, itemId, osgDir):
         if len(inputFiles) == 0: #Meshes without OBJ are ignores
             logging.warning('Ignoring ' + absPath + ': no OBJ is found')
             shutil.rmtree(outFolder)
-            return 
+            return (mainOsgb, xmlPath, offsets)
     # A PICTURE
     elif inType == utils.PIC_FT:
         inputFiles = glob.glob(absPath + '/*.png') + glob.glob(absPath + '/*.jpg') + glob.glob(absPath + '/*.jpeg') + glob.glob(absPath + '/*.PNG') + glob.glob(absPath + '/*.JPG') + glob.glob(absPath + '/*.JPEG')
@@ -119,15 +128,15 @@ def createOSG(cursor, itemId, osgDir):
     if len(data_items) > 0:
         aligned = True
         (abOffsetX, abOffsetY, abOffsetZ) = data_items[0]
+    elif backgroundOffsets != None and srid in backgroundOffsets:
+        # the background was converted in this run but it is not in the DB yet
+        aligned = True
+        (abOffsetX, abOffsetY, abOffsetZ) = backgroundOffsets[srid]
     
-    cwd = os.getcwd()
     if os.path.isfile(absPath):
         # input was a file -> raise IOError
         error('Database key abspath should define a directory, ' +
                       'file detected: ' + absPath, outFolder)
-    else:
-        # input is already a directory
-        os.chdir(absPath)
 
     outputPrefix = utils.OSG_DATA_PREFIX
     ofile = getOSGFileFormat(inType)
@@ -156,17 +165,23 @@ def createOSG(cursor, itemId, osgDir):
     if aligned:
         command += ' --translate ' + str(abOffsetX) + ' ' + str(abOffsetY) + \
             ' ' + str(abOffsetZ)
-    command += ' &> ' + logFile
-    logging.info(command)
-    args = shlex.split(command)
-    subprocess.Popen(args, stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE).communicate()
-
-    # move files to outFolder; drop outputPrefix from filename
-    logging.info("Moving files to " + outFolder)
-    outputFiles = glob.glob(outputPrefix + '*')
-    for filename in outputFiles:
-        shutil.move(os.path.abspath(filename), os.path.join(outFolder,filename))
+    
+    # The cache key uses the command before adding the log file
+    cacheKey = None
+    if cacheDir:
+        cacheKey = converter_utils.getCacheKey(cacheDir, glob.glob(inputFileAbsPath), command)
+    if cacheKey == None or not converter_utils.fetchFromCache(cacheDir, cacheKey, outFolder):
+        # the converter runs in the input folder (without changing ours)
+        try:
+            converter_utils.runConverter(shlex.split(command), logFile, absPath, timeout, memLimit)
+        except Exception as e:
+            error(str(e), outFolder)
+    
+        # move files to outFolder; drop outputPrefix from filename
+        logging.info("Moving files to " + outFolder)
+        outputFiles = glob.glob(os.path.join(absPath, outputPrefix + '*'))
+        for filename in outputFiles:
+            shutil.move(filename, os.path.join(outFolder, os.path.basename(filename)))
 
     ofiles = sorted(glob.glob(os.path.join(outFolder, '*' + ofile)))
     if len(ofiles) == 0:
@@ -197,8 +212,9 @@ def createOSG(cursor, itemId, osgDir):
                 offsets[i] = float(offsets[i])
         elif aligned:
             logging.warn('No offset file was found and it was expected!')
-    # We move back to the current working directory
-    os.chdir(cwd)
+        if cacheKey != None:
+            converter_utils.storeInCache(cacheDir, cacheKey, outFolder)
+    return (mainOsgb, xmlPath, offsets)
     
 def extract_inType(abspath, site_id, osgDir):
     '''
@@ -263,10 +279,58 @@ def error(errorMessage, outFolder):
     logging.error(errorMessage)
     logging.info('Removing %s ' % outFolder)
     shutil.rmtree(outFolder)
-    # We move back to the current working directory
-    os.chdir(cwd)
     raise Exception(errorMessage)
 
+def getPendingItems(cursor, backgrounds = False):
+    """ Gets the raw data items of sites (and also the backgrounds if 
+    backgrounds is True) without related OSG data item as a list of 
+    (raw_data_item_id, abs_path, background, srid), the backgrounds first"""
+    query = """
+SELECT raw_data_item_id, abs_path, background, srid 
+FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) 
+WHERE """ + ('' if backgrounds else 'NOT background AND ') + """raw_data_item_id NOT IN (
+          SELECT raw_data_item_id FROM OSG_DATA_ITEM_PC_SITE 
+          UNION 
+          SELECT raw_data_item_id FROM OSG_DATA_ITEM_PC_BACKGROUND 
+          UNION 
+          SELECT raw_data_item_id FROM OSG_DATA_ITEM_MESH 
+          UNION 
+          SELECT raw_data_item_id FROM OSG_DATA_ITEM_PICTURE)
+ORDER BY background DESC, raw_data_item_id"""
+    raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
+    return raw_data_items
+
+def convertItem(opts, rawDataItemId, backgroundOffsets, admission, cost):
+    """ Converts a raw data item in a thread of the pool once the admission 
+    control admits its cost. Each conversion uses its own DB connection (a 
+    failed query does not abort the transaction of the other conversions). 
+    Returns the id, the offsets and the error message (if any)"""
+    admission.acquire(cost)
+    (connection, cursor) = (None, None)
+    try:
+        connection, cursor = utils.connectToDB(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport)
+        (mainOsgb, xmlPath, offsets) = createOSG(cursor, rawDataItemId, opts.osgDir, backgroundOffsets, opts.cache, opts.timeout, opts.memlimit)
+        return (rawDataItemId, offsets, None)
+    except Exception as e:
+        logging.error('Conversion of raw data item %d failed: %s' % (rawDataItemId, str(e)))
+        return (rawDataItemId, None, str(e))
+    finally:
+        if connection != None:
+            utils.closeConnectionDB(connection, cursor)
+        admission.release(cost)
+
+def convertItems(opts, rawDataItemIds, backgroundOffsets, admission, costs):
+    """ Converts the raw data items running up to opts.jobs converters at the 
+    same time (as long as their estimated costs are admitted). Returns the list 
+    of (id, offsets, error message)"""
+    if len(rawDataItemIds) == 0:
+        return []
+    pool = ThreadPool(min(opts.jobs, len(rawDataItemIds)))
+    results = [pool.apply_async(convertItem, (opts, rawDataItemId, backgroundOffsets, admission, costs.get(rawDataItemId, (0, 1)))) for rawDataItemId in rawDataItemIds]
+    pool.close()
+    pool.join()
+    return [result.get() for result in results]
+
 
 def run(opts):
     # Start logging
@@ -288,27 +352,48 @@ def run(opts):
         utils.listRawDataItems(cursor)
         return
     elif opts.itemid == '' or opts.itemid == '!':
-        query = """
-SELECT raw_data_item_id, abs_path 
-FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) 
-WHERE NOT background AND raw_data_item_id NOT IN (
-          SELECT raw_data_item_id FROM OSG_DATA_ITEM_PC_SITE 
-          UNION 
-          SELECT raw_data_item_id FROM OSG_DATA_ITEM_MESH 
-          UNION 
-          SELECT raw_data_item_id FROM OSG_DATA_ITEM_PICTURE)"""
         # Get the list of items that are not converted yet (we sort by background to have the background converted first)
-        raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
-        for (rawDataItemId, absPath) in raw_data_items:
-            if opts.itemid == '':
-                createOSG(cursor, rawDataItemId, opts.osgDir)
-            else:
+        raw_data_items = getPendingItems(cursor, opts.backgrounds)
+        if opts.itemid == '!':
+            for (rawDataItemId, absPath, isBackground, srid) in raw_data_items:
                 m = '\t'.join((str(rawDataItemId),absPath))
                 print m
                 logging.info(m)
+            raw_data_items = []
     else:
-        for rawDataItemId in opts.itemid.split(','):
-            createOSG(cursor, int(rawDataItemId), opts.osgDir)    
+        rawDataItemIds = [int(rawDataItemId) for rawDataItemId in opts.itemid.split(',')]
+        raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, """
+SELECT raw_data_item_id, abs_path, background, srid 
+FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) 
+WHERE raw_data_item_id = ANY(%s)
+ORDER BY background DESC, raw_data_item_id""", [rawDataItemIds,])
+        if num_raw_data_items != len(set(rawDataItemIds)):
+            logging.error('Some of the raw data items %s do not exist' % opts.itemid)
+    
+    # The backgrounds are converted first since the site conversions need their 
+    # offsets, then all the sites (they are independent from each other)
+    backgrounds = [row for row in raw_data_items if row[2]]
+    sites = [row for row in raw_data_items if not row[2]]
+    backgroundsSRIDs = dict((row[0], row[3]) for row in backgrounds if '/PC/' in row[1])
+    backgroundOffsets = {}
+    failed = []
+    # Estimated costs of the conversions for the admission control
+    costs = converter_utils.getConversionsCosts(cursor, utils.OSG_FT, [row[0] for row in raw_data_items])
+    admission = converter_utils.AdmissionControl(opts.maxmem, opts.maxcpu)
+    for (rawDataItemId, offsets, errorMsg) in convertItems(opts, [row[0] for row in backgrounds], None, admission, costs):
+        if errorMsg != None:
+            failed.append(rawDataItemId)
+        elif rawDataItemId in backgroundsSRIDs:
+            backgroundOffsets[backgroundsSRIDs[rawDataItemId]] = offsets
+    for (rawDataItemId, offsets, errorMsg) in convertItems(opts, [row[0] for row in sites], backgroundOffsets, admission, costs):
+        if errorMsg != None:
+            failed.append(rawDataItemId)
+    
+    if len(failed):
+        msg = 'Conversion failed for raw data items: ' + ','.join(str(rawDataItemId) for rawDataItemId in failed)
+        logging.error(msg)
+        utils.closeConnectionDB(connection, cursor)
+        raise Exception(msg)
 
     # close DB connection
     utils.closeConnectionDB(connection, cursor)
@@ -325,8 +410,11 @@ def argument_parser():
 
     # fill argument groups
     parser.add_argument('-i','--itemid',default='',
-                       help='Comma-separated list of Raw Data Item Ids [default is to convert all raw data items related to sites that have a OBJ file and do not have a related OSG data item] (with ? the available raw data items are listed, with ! it lists all the raw data items with OBJ and without any related OSG data item)',
+                       help='Comma-separated list of Raw Data Item Ids [default is to convert all raw data items related to sites (and also to backgrounds with --backgrounds) that have a OBJ file and do not have a related OSG data item] (with ? the available raw data items are listed, with ! it lists all the raw data items with OBJ and without any related OSG data item)',
                        type=str, required=False)
+    parser.add_argument('--backgrounds', default=False,
+                        help='Also convert the raw data items related to backgrounds without related OSG data item when no list of raw data item ids is given (they are converted before the sites) [default False]',
+                        action='store_true')
     parser.add_argument('-d', '--dbname', default=utils.DEFAULT_DB,
                         help='Postgres DB name [default ' + utils.DEFAULT_DB +
                         ']', action='store')
@@ -339,6 +427,24 @@ def argument_parser():
     parser.add_argument('-o', '--osgDir', default=utils.DEFAULT_OSG_DATA_DIR,
                         help='OSG data directory [default ' +
                         utils.DEFAULT_OSG_DATA_DIR + ']', action='store')
+    parser.add_argument('-j', '--jobs', default=DEFAULT_JOBS,
+                        help='Number of converters to run concurrently [default ' +
+                        str(DEFAULT_JOBS) + ']', type=int)
+    parser.add_argument('--cache', default='',
+                        help='Folder of the conversions cache. The conversions of input files and converter options already in the cache are hardlinked from it instead of running the converter [default is not to use the cache, the suggested folder is ' +
+                        converter_utils.DEFAULT_CACHE_DIR + ']', action='store')
+    parser.add_argument('--timeout', default=0,
+                        help='Maximum time in seconds of a conversion, the converter is killed if it runs longer [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--memlimit', default=0,
+                        help='Maximum memory in MB used by a converter, it is killed if it uses more [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--maxmem', default=0,
+                        help='Maximum total estimated memory in MB of the concurrent conversions, a conversion only starts if the estimated memory of the running conversions plus its own fits [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--maxcpu', default=0,
+                        help='Maximum total estimated number of CPUs of the concurrent conversions [default 0, i.e. no limit]',
+                        type=int)
     parser.add_argument('-l', '--log', help='Log level',
                         choices=utils.LOG_LEVELS_LIST,
                         default=utils.DEFAULT_LOG_LEVEL)
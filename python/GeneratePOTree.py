@@ -20,13 +20,23 @@
 #                   * Unique identifier is created in xml config file
 ##############################################################################
 
-import shutil, time, os, utils, glob, subprocess, argparse, shlex, logging
+import shutil, time, os, utils, glob, argparse, shlex, logging
+import converter_utils, las_utils, octree_builder
 
 CONVERTER_COMMAND = 'PotreeConverter'
 outputFormat = 'LAS'
+# Engines that build the octrees: the PotreeConverter binary or octree_builder
+ENGINE_POTREECONVERTER = 'PotreeConverter'
+ENGINE_NATIVE = 'native'
+ENGINES = [ENGINE_POTREECONVERTER, ENGINE_NATIVE]
+DEFAULT_ENGINE = ENGINE_POTREECONVERTER
+
+def createPOTree(cursor, itemId, potreeDir, levels, cacheDir = None, timeout = None, memLimit = None, engine = DEFAULT_ENGINE, numProcs = 1, workDir = octree_builder.DEFAULT_WORK_DIR):
+    """ Converts the point cloud raw data item to POTree with the engine. The 
+    native engine uses numProcs processes and keeps its spill files in workDir
+    (LAZ files are always converted with PotreeConverter). timeout and memLimit 
+    only apply to PotreeConverter"""
 
-def createPOTree(cursor, itemId, potreeDir, levels):
-    
     (mainOsgb, xmlPath, offsets) = (None, None, (0, 0, 0))
 
     # extract abspath using raw_data_item_id
@@ -45,31 +55,100 @@ def createPOTree(cursor, itemId, potreeDir, levels):
         error('Database key abspath should define a directory, ' +
                       'file detected: ' + inFile, outFolder)
         # os.chdir(os.path.dirname(inFile))
-    else:
-        # input is already a directory
-        os.chdir(inFile)
 
     outputPrefix = 'data'
 
     logFile = os.path.join(outFolder, outputPrefix + '.log')
     
-    command = CONVERTER_COMMAND + ' -o ' + outFolder + ' -l ' + \
-        str(levels) + ' --output-format ' + outputFormat + ' --source ' + \
-            inFile
-    command += ' &> ' + logFile
-    logging.info(command)
-    args = shlex.split(command)
-    subprocess.Popen(args, stdout=subprocess.PIPE,
-                     stderr=subprocess.PIPE).communicate()
+    inputFiles = las_utils.getLASFiles(inFile)
+    if engine == ENGINE_NATIVE and len([f for f in inputFiles if las_utils.isLAZFile(f)]):
+        logging.warn('The native engine can not read the LAZ files in ' + inFile + '. Using ' + ENGINE_POTREECONVERTER)
+        engine = ENGINE_POTREECONVERTER
+    
+    # The cache key uses the converter options without the folders
+    cacheKey = None
+    if cacheDir:
+        cacheKey = converter_utils.getCacheKey(cacheDir, inputFiles, 
+            engine + ' -l ' + str(levels) + ' --output-format ' + outputFormat)
+    if cacheKey != None and converter_utils.fetchFromCache(cacheDir, cacheKey, outFolder):
+        return
+    
+    if engine == ENGINE_NATIVE:
+        logging.info('Building octree of ' + inFile + ' in ' + outFolder)
+        try:
+            octree_builder.buildOctree(inputFiles, outFolder, levels, numProcs, workDir = workDir)
+        except Exception as e:
+            octree_builder.removeWorkFolder(outFolder, workDir)
+            error(str(e), outFolder)
+    else:
+        command = CONVERTER_COMMAND + ' -o ' + outFolder + ' -l ' + \
+            str(levels) + ' --output-format ' + outputFormat + ' --source ' + \
+                inFile
+        try:
+            converter_utils.runConverter(shlex.split(command), logFile, inFile, timeout, memLimit)
+        except Exception as e:
+            error(str(e), outFolder)
 
     ofiles = sorted(glob.glob(os.path.join(outFolder, '*')))
     if len(ofiles) == 0:
         error('none POTree file was generated (found in ' + outFolder +
                      '). Check log: ' + logFile, outFolder)
+    if cacheKey != None:
+        converter_utils.storeInCache(cacheDir, cacheKey, outFolder)
+
+def updatePOTree(cursor, itemId, potreeDir, levels, engine = DEFAULT_ENGINE, numProcs = 1, workDir = octree_builder.DEFAULT_WORK_DIR):
+    """ Updates the POTree of the point cloud raw data item built with the 
+    native engine, only the octree nodes of the changed tiles are rebuilt. If 
+    it was not converted yet it is fully built with the engine. The POTrees 
+    that were not built with the native engine are only (fully) rebuilt if the
+    engine is the native one, otherwise they are not changed"""
+    data_items, num_items = utils.fetchDataFromDB(
+        cursor, "SELECT abs_path, item_id FROM RAW_DATA_ITEM WHERE " +
+        "raw_data_item_id = %s", (itemId,))
+    abspath, site_id = data_items[0]
+    
+    inType, inKind, outFolder = extract_inType(abspath, site_id,
+                                               potreeDir, levels, create = False)
+    if not os.path.isdir(outFolder):
+        createPOTree(cursor, itemId, potreeDir, levels, engine = engine, numProcs = numProcs, workDir = workDir)
+        return
+    
+    if not octree_builder.hasManifest(outFolder) and engine != ENGINE_NATIVE:
+        logging.warn('The POTree in ' + outFolder + ' was not built with the native engine and it can not be updated (use -e ' + ENGINE_NATIVE + ' to rebuild it)')
+        return
+    
+    inputFiles = las_utils.getLASFiles(abspath)
+    if len([f for f in inputFiles if las_utils.isLAZFile(f)]):
+        logging.warn('The native engine can not read the LAZ files in ' + abspath + ', the POTree in ' + outFolder + ' is not updated')
+        return
+    
+    logging.info('Updating octree of ' + abspath + ' in ' + outFolder)
+    if octree_builder.updateOctree(inputFiles, outFolder, levels, numProcs, workDir = workDir):
+        # The POTree data item is updated in place, its id does not change
+        utils.dbExecute(cursor, 'UPDATE POTREE_DATA_ITEM_PC SET last_mod=%s, last_check=%s WHERE abs_path=%s',
+            [utils.getCurrentTime(utils.getLastModification(outFolder)), utils.getCurrentTime(), outFolder])
+    else:
+        logging.info('None of the tiles of ' + abspath + ' changed')
+
+def updatePOTrees(cursor, opts, items):
+    """ Updates the POTrees of the items, a list of (raw_data_item_id, 
+    background). An error in an item does not stop the update of the others, 
+    the failed items are returned"""
+    failed = []
+    for (rawDataItemId, isBackground) in items:
+        levels = getNumLevels(opts, isBackground)
+        try:
+            updatePOTree(cursor, rawDataItemId, opts.potreeDir, levels, opts.engine, opts.processes, opts.workdir)
+        except Exception as e:
+            cursor.connection.rollback()
+            logging.error('Update of raw data item %d failed: %s' % (rawDataItemId, str(e)))
+            failed.append(rawDataItemId)
+    return failed
 
-def extract_inType(abspath, site_id, potreeDir, levels):
+def extract_inType(abspath, site_id, potreeDir, levels, create = True):
     '''
-    Checks the type of the input file using the file location
+    Checks the type of the input file using the file location. If create the
+    outFolder is created (it must not exist)
     '''
     if any(substring in abspath for substring in ['/PC/']):
         inType = utils.PC_FT
@@ -103,12 +182,13 @@ def extract_inType(abspath, site_id, potreeDir, levels):
         raise Exception("POTree converter should one be used on PC's")
         
     # create outFolder if it does not exist yet
-    if not os.path.isdir(outFolder):
-        os.makedirs(outFolder)
-    else:
-        raise IOError('Output folder ' + outFolder + ' already exists, ' +
-                      'please remove manually')
-        # shutil.rmtree(outFolder)  # if we won't to force remove it
+    if create:
+        if not os.path.isdir(outFolder):
+            os.makedirs(outFolder)
+        else:
+            raise IOError('Output folder ' + outFolder + ' already exists, ' +
+                          'please remove manually')
+            # shutil.rmtree(outFolder)  # if we won't to force remove it
     return inType, inKind, outFolder
 
 def error(errorMessage, outFolder):
@@ -127,6 +207,28 @@ def getNumLevels(opts, isBackground):
         levels = int(opts.levels)
     return levels
 
+def getPendingItems(cursor):
+    """ Gets the point cloud raw data items without related POTree data item 
+    as a list of (raw_data_item_id, abs_path, background)"""
+    query = """
+SELECT raw_data_item_id,abs_path,background 
+FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) JOIN RAW_DATA_ITEM_PC USING (raw_data_item_id) 
+WHERE raw_data_item_id NOT IN (
+          SELECT raw_data_item_id FROM POTREE_DATA_ITEM_PC)
+ORDER BY background DESC, raw_data_item_id"""
+    raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
+    return raw_data_items
+
+def getPCItems(cursor):
+    """ Gets all the point cloud raw data items as a list of 
+    (raw_data_item_id, abs_path, background)"""
+    query = """
+SELECT raw_data_item_id,abs_path,background 
+FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) JOIN RAW_DATA_ITEM_PC USING (raw_data_item_id) 
+ORDER BY background DESC, raw_data_item_id"""
+    raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
+    return raw_data_items
+
 def run(opts):
     # Start logging
     logname = os.path.splitext(os.path.basename(__file__))[0] + '.log'
@@ -141,35 +243,39 @@ def run(opts):
                                            opts.dbpass, opts.dbhost,
                                            opts.dbport)
     
+    failed = []
     if opts.itemid == '?':
         utils.listRawDataItems(cursor)
         return
+    elif opts.itemid == '' and opts.incremental:
+        # In incremental mode all the items are checked (the ones without POTree are converted)
+        failed = updatePOTrees(cursor, opts, [(rawDataItemId, isBackground) for (rawDataItemId,absPath,isBackground) in getPCItems(cursor)])
     elif opts.itemid == '' or opts.itemid == '!':
-        query = """
-SELECT raw_data_item_id,abs_path,background 
-FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) JOIN RAW_DATA_ITEM_PC USING (raw_data_item_id) 
-WHERE raw_data_item_id NOT IN (
-          SELECT raw_data_item_id FROM POTREE_DATA_ITEM_PC)"""
         # Get the list of items that are not converted yet (we sort by background to have the background converted first)
-        raw_data_items, num_raw_data_items = utils.fetchDataFromDB(cursor, query)
+        raw_data_items = getPendingItems(cursor)
         for (rawDataItemId,absPath,isBackground) in raw_data_items:
             if opts.itemid == '' :
                 levels = getNumLevels(opts, isBackground)
-                createPOTree(cursor, rawDataItemId, opts.potreeDir, levels)
+                createPOTree(cursor, rawDataItemId, opts.potreeDir, levels, opts.cache, opts.timeout, opts.memlimit, opts.engine, opts.processes, opts.workdir)
             else:
                 m = '\t'.join((str(rawDataItemId),absPath))
                 print m
                 logging.info(m)
                 
     else:
+        items = []
         for rawDataItemId in opts.itemid.split(','):
             rows,num_rows = utils.fetchDataFromDB(cursor, 'SELECT background FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) WHERE raw_data_item_id = %s', [int(rawDataItemId)])
             if num_rows == 0:
                 logging.error('There is not a raw data item with id %d' % int(rawDataItemId))
                 return
             isBackground = rows[0][0]
+            if opts.incremental:
+                items.append((int(rawDataItemId), isBackground))
+                continue
             levels = getNumLevels(opts, isBackground)    
-            createPOTree(cursor, int(rawDataItemId), opts.potreeDir, levels)
+            createPOTree(cursor, int(rawDataItemId), opts.potreeDir, levels, opts.cache, opts.timeout, opts.memlimit, opts.engine, opts.processes, opts.workdir)
+        failed = updatePOTrees(cursor, opts, items)
 
     # close DB connection
     utils.closeConnectionDB(connection, cursor)
@@ -178,6 +284,10 @@ WHERE raw_data_item_id NOT IN (
     msg = 'Finished. Total elapsed time: %.02f seconds. See %s' % (elapsed_time, logname)
     print(msg)
     logging.info(msg)
+    if len(failed):
+        msg = 'Update failed for raw data items: ' + ','.join(str(rawDataItemId) for rawDataItemId in failed)
+        logging.error(msg)
+        raise Exception(msg)
 
 def argument_parser():
 # define argument menu
@@ -202,6 +312,27 @@ def argument_parser():
                         utils.DEFAULT_POTREE_DATA_DIR + ']', action='store')
     parser.add_argument('--levels',default='',help='Number of levels of the Octree, parameter for PotreeConverter. [default is 4 for Sites and 8 for Backgrounds]',action='store', required=False)
     
+    parser.add_argument('--cache', default='',
+                        help='Folder of the conversions cache. The conversions of input files and converter options already in the cache are hardlinked from it instead of running the converter [default is not to use the cache, the suggested folder is ' +
+                        converter_utils.DEFAULT_CACHE_DIR + ']', action='store')
+    parser.add_argument('--timeout', default=0,
+                        help='Maximum time in seconds of a conversion, the converter is killed if it runs longer [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('--memlimit', default=0,
+                        help='Maximum memory in MB used by a converter, it is killed if it uses more [default 0, i.e. no limit]',
+                        type=int)
+    parser.add_argument('-e', '--engine', default=DEFAULT_ENGINE,
+                        help='Engine used to build the octrees. The native engine builds them in Python out-of-core, point clouds with LAZ files are always converted with ' + ENGINE_POTREECONVERTER + ' [default ' + DEFAULT_ENGINE + ']',
+                        choices=ENGINES)
+    parser.add_argument('--processes', default=1,
+                        help='Number of processes used by the native engine [default 1]',
+                        type=int)
+    parser.add_argument('--workdir', default=octree_builder.DEFAULT_WORK_DIR,
+                        help='Folder of the spill files of the native engine, they are kept (outside of the POTree data directory) to update the octrees incrementally and take about the size of the points of the converted point clouds [default ' + octree_builder.DEFAULT_WORK_DIR + ']',
+                        action='store')
+    parser.add_argument('--incremental', default=False,
+                        help='Updates the POTrees built with the native engine instead of converting the items. Only the octree nodes of the tiles that changed since the last build are rebuilt and the items without POTree are converted with the engine. The POTrees built with ' + ENGINE_POTREECONVERTER + ' are not changed unless the engine is ' + ENGINE_NATIVE + ' (then they are fully rebuilt) and the point clouds with LAZ files are skipped [default is to convert only the items without POTree]',
+                        action='store_true')
     parser.add_argument('-l', '--log', help='Log level',
                         choices=utils.LOG_LEVELS_LIST,
                         default=utils.DEFAULT_LOG_LEVEL)
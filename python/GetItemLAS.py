@@ -9,12 +9,148 @@
 # Changes:
 # Notes:
 ##############################################################################
-import os, argparse, psycopg2, time, re, subprocess, glob, logging, utils
+import os, argparse, psycopg2, time, re, subprocess, glob, logging, tempfile, utils, las_utils
 
 DEFAULT_CONCAVE = 0.9
 DEFAULT_BUFFER = 0
+# Cut-out engines: native reads the points with NumPy, lastools uses lasmerge and lasinfo
+ENGINE_NATIVE = 'native'
+ENGINE_LASTOOLS = 'lastools'
+ENGINES = [ENGINE_NATIVE, ENGINE_LASTOOLS]
+DEFAULT_ENGINE = ENGINE_NATIVE
 
-def create_cut_out(cursor, inputLAS, output, itemid, buffer, concave):
+def getIntersectingFiles(cursor, inputLAS, minx, miny, maxx, maxy):
+    """ Get the LAS/LAZ files of the folder whose 2D extent intersects the 
+    specified bounding box using the tiles registered in the DB by UpdateDB. 
+    Returns None if the tiles of the folder are not in the DB or if they are 
+    not the LAS/LAZ files currently in the folder"""
+    absPath = os.path.abspath(inputLAS)
+    query = """
+SELECT 
+    T.file_name, ST_MakeEnvelope(T.minx, T.miny, T.maxx, T.maxy) && ST_MakeEnvelope(%s, %s, %s, %s) 
+FROM 
+    RAW_DATA_ITEM_PC_TILE T, RAW_DATA_ITEM R 
+WHERE 
+    T.raw_data_item_id = R.raw_data_item_id AND R.abs_path = %s"""
+    rows,num = utils.fetchDataFromDB(cursor, query, [minx, miny, maxx, maxy, absPath])
+    if num == 0:
+        return None
+    registered = set([fileName for (fileName, intersects) in rows])
+    current = set([os.path.basename(f) for f in las_utils.getLASFiles(absPath)])
+    if registered != current:
+        # The DB is not up to date
+        for fileName in sorted(registered - current):
+            logging.warning('%s is registered in the DB but it does not exist' % (absPath + '/' + fileName))
+        for fileName in sorted(current - registered):
+            logging.warning('%s is not registered in the DB' % (absPath + '/' + fileName))
+        return None
+    return sorted([absPath + '/' + fileName for (fileName, intersects) in rows if intersects])
+
+def canUseNative(listPCFiles, output):
+    """ Check if the native engine can be used with the LAS/LAZ files: LAZ files 
+    can not be read or written and, if an output file is written, all the files 
+    must have the same point format, scale and offset"""
+    for f in listPCFiles + ([output,] if output else []):
+        if las_utils.isLAZFile(f):
+            return False
+    if output:
+        headers = [las_utils.readLASHeader(f) for f in listPCFiles]
+        for header in headers[1:]:
+            if (header.pointFormat, header.pointLength, header.scale, header.offset) != (headers[0].pointFormat, headers[0].pointLength, headers[0].scale, headers[0].offset):
+                return False
+    return True
+
+def cut_out_native(listPCFiles, output, minx, miny, maxx, maxy, hullRings = None, zStats = None):
+    """ Stream in chunks the points of the LAS files and select the ones in the 
+    bounding box (and in the polygon given by hullRings if provided). The 
+    selected points are written in output (if provided) and their Z is added 
+    to zStats (if provided, a las_utils.ZStats).
+    Returns (numpoints, minZ, maxZ, avgZ)"""
+    (numpoints, minZ, maxZ, sumZ) = (0, None, None, 0.)
+    writer = None
+    if output:
+        writer = las_utils.LASWriter(output, listPCFiles[0])
+    try:
+        for f in listPCFiles:
+            header = las_utils.readLASHeader(f)
+            if header.min[0] > maxx or header.max[0] < minx or header.min[1] > maxy or header.max[1] < miny:
+                continue
+            for (x, y, z, records) in las_utils.readLASPoints(f):
+                mask = (x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)
+                if hullRings != None:
+                    indexes = mask.nonzero()[0]
+                    if len(indexes):
+                        mask[indexes[~las_utils.pointsInPolygon(x[indexes], y[indexes], hullRings)]] = False
+                n = int(mask.sum())
+                if n == 0:
+                    continue
+                sz = z[mask]
+                numpoints += n
+                sumZ += float(sz.sum())
+                if minZ == None or sz.min() < minZ:
+                    minZ = float(sz.min())
+                if maxZ == None or sz.max() > maxZ:
+                    maxZ = float(sz.max())
+                if zStats != None:
+                    zStats.add(sz)
+                if writer != None:
+                    writer.write(records[mask], x[mask], y[mask], sz)
+    finally:
+        if writer != None:
+            writer.close()
+    avgZ = None
+    if numpoints:
+        avgZ = sumZ / numpoints
+    return (numpoints, minZ, maxZ, avgZ)
+
+def cut_out_lastools(listPCFiles, output, minx, miny, maxx, maxy):
+    """ Create the cut-out with lasmerge and get its statistics with lasinfo. 
+    If output is not provided a temporal file is used. 
+    Returns (numpoints, minZ, maxZ, avgZ) (numpoints is None if it failed)"""
+    (numpoints, minZ, maxZ, avgZ) = (None, None, None, None)
+    removeOutput = False
+    if not output:
+        (fd, output) = tempfile.mkstemp(suffix='.las')
+        os.close(fd)
+        os.remove(output)
+        removeOutput = True
+    
+    # Create list of files for lasmerge
+    tfilename = output + '.list' 
+    tfile = open(tfilename, 'w')
+    for f in listPCFiles:
+        tfile.write(f + '\n')
+    tfile.close()
+    command = 'lasmerge -lof ' + tfilename + ' -inside ' + str(minx) + ' ' + str(miny) + ' ' + str(maxx) + ' ' + str(maxy) + ' -o ' + output
+    logging.info(command)
+    os.system(command)
+    os.system('rm ' + tfilename)
+    if not os.path.isfile(output):
+        logging.error('Output file has not been generated. Is LAStools/lasmerge installed and in PATH?')
+        return (numpoints, minZ, maxZ, avgZ)
+    
+    logging.info('Getting average elevation and number of points from %s' % output)
+    statcommand = "lasinfo -i " + output + " -nv -nmm -histo z 10000000"
+    lines  = '\n'.join(subprocess.Popen(statcommand, shell = True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()).split('\n')
+    
+    for line in lines:
+        if line.count('average z'):
+            avgZ = float(line.split()[-1])
+        if line.count('number of point records:'):
+            numpoints = int(line.split()[-1])
+        if line.count('min x y z:'):
+            minZ = float(line.split()[-1])
+        if line.count('max x y z:'):
+            maxZ = float(line.split()[-1])
+    
+    if removeOutput:
+        os.remove(output)
+            
+    if numpoints == None:
+        logging.error("Could not extract average elevation and number of points. Is LAStools/lasinfo installed and in PATH? Check that lasinfo in PATH is from LAStools and not libLAS!")
+    return (numpoints, minZ, maxZ, avgZ)
+
+def create_cut_out(cursor, inputLAS, output, itemid, buffer, concave, engine = DEFAULT_ENGINE, hull = False, zStats = None):
     
     returnOk = False
     vertices = None
@@ -35,10 +171,13 @@ def create_cut_out(cursor, inputLAS, output, itemid, buffer, concave):
     queryDescr += 'concave hull of footprint of item %s' % itemid
     query = """
 SELECT 
-    st_astext(ch), st_xmin(ebch), st_xmax(ebch), st_ymin(ebch), st_ymax(ebch) 
+    st_astext(ch), st_astext(bch), st_xmin(ebch), st_xmax(ebch), st_ymin(ebch), st_ymax(ebch) 
 FROM (
     SELECT 
-        ch, ST_Envelope(""" + aux + """) as ebch 
+        ch, bch, ST_Envelope(bch) as ebch 
+    FROM (
+    SELECT 
+        ch, """ + aux + """ as bch 
     FROM (
         SELECT 
             ST_ConcaveHull(geom, %s) as ch 
@@ -46,14 +185,15 @@ FROM (
             ITEM 
         WHERE item_id = %s AND geom is NOT null 
         ) A
-    ) B"""
+    ) B
+    ) C"""
     queryArgs.extend([concave, itemid])
     logging.info(queryDescr)
     rows,num = utils.fetchDataFromDB(cursor, query, queryArgs)
     if num == 0:
         logging.error('Wrong item ID: No item is found with specified ID or the geometry is NULL!')
         return (returnOk, vertices, minZ, maxZ, avgZ, numpoints)
-    (concaveHull, minx, maxx, miny, maxy) = rows[0]
+    (concaveHull, bufferedConcaveHull, minx, maxx, miny, maxy) = rows[0]
  
     # If it is found we also extract the individual 2D points of the vertices of the concave hull
     logging.info('Extracting 2D points of concave hull of footprint')
@@ -62,43 +202,39 @@ FROM (
         c = re.findall("\d+.\d+ \d+.\d+",e)
         vertices.append(c[0].split(' '))
     
+    # Get the LAS/LAZ files that intersect the bounding box (from the tiles in the DB)
+    listPCFiles = getIntersectingFiles(cursor, inputLAS, minx, miny, maxx, maxy)
+    if listPCFiles == None:
+        # The tiles are not in the DB (or they are outdated), all the files must be checked
+        listPCFiles = glob.glob(inputLAS + '/*las') + glob.glob(inputLAS + '/*laz')
+    else:
+        logging.info('%d LAS/LAZ files of %s intersect the bounding box' % (len(listPCFiles), inputLAS))
     # Check there is some LAS/LAZ file in specified directory
-    listPCFiles = glob.glob(inputLAS + '/*las') + glob.glob(inputLAS + '/*laz')
     if len(listPCFiles) == 0:
-        logging.error('%s does not contain any LAS/LAZ file' % inputLAS)
+        logging.error('%s does not contain any LAS/LAZ file in the bounding box' % inputLAS)
         return (returnOk, vertices, minZ, maxZ, avgZ, numpoints)
     
-    # Create list of files for lasmerge
-    tfilename = output + '.list' 
-    tfile = open(tfilename, 'w')
-    for f in listPCFiles:
-        tfile.write(f + '\n')
-    tfile.close()
-    command = 'lasmerge -lof ' + tfilename + ' -inside ' + str(minx) + ' ' + str(miny) + ' ' + str(maxx) + ' ' + str(maxy) + ' -o ' + output
-    logging.info(command)
-    os.system(command)
-    os.system('rm ' + tfilename)
-    if not os.path.isfile(output):
-        logging.error('Output file has not been generated. Is LAStools/lasmerge installed and in PATH?')
-        return (returnOk, vertices, minZ, maxZ, avgZ, numpoints)
+    if engine == ENGINE_NATIVE and not canUseNative(listPCFiles, output):
+        logging.info('Native engine can not be used with the files in %s (LAZ files or different point formats). Using lastools' % inputLAS)
+        engine = ENGINE_LASTOOLS
     
-    logging.info('Getting average elevation and number of points from %s' % output)
-    statcommand = "lasinfo -i " + output + " -nv -nmm -histo z 10000000"
-    lines  = '\n'.join(subprocess.Popen(statcommand, shell = True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()).split('\n')
-    
-    for line in lines:
-        if line.count('average z'):
-            avgZ = float(line.split()[-1])
-        if line.count('number of point records:'):
-            numpoints = int(line.split()[-1])
-        if line.count('min x y z:'):
-            minZ = float(line.split()[-1])
-        if line.count('max x y z:'):
-            maxZ = float(line.split()[-1])
-            
-    if numpoints == None:
-        logging.error("Could not extract average elevation and number of points. Is LAStools/lasinfo installed and in PATH? Check that lasinfo in PATH is from LAStools and not libLAS!")
-        return (returnOk, vertices, minZ, maxZ, avgZ, numpoints)
+    if engine == ENGINE_NATIVE:
+        hullRings = None
+        if hull:
+            hullRings = las_utils.parsePolygonWKT(bufferedConcaveHull)
+        logging.info('Getting points in cutout for item %d' % itemid)
+        (numpoints, minZ, maxZ, avgZ) = cut_out_native(listPCFiles, output, minx, miny, maxx, maxy, hullRings, zStats)
+        if numpoints == 0:
+            logging.error('None point found in the cutout of item %d' % itemid)
+            return (returnOk, vertices, minZ, maxZ, avgZ, numpoints)
+    else:
+        if hull:
+            logging.warning('The cutout with lastools engine only uses the bounding box')
+        if zStats != None:
+            logging.warning('The Z histogram is not computed with lastools engine')
+        (numpoints, minZ, maxZ, avgZ) = cut_out_lastools(listPCFiles, output, minx, miny, maxx, maxy)
+        if numpoints == None:
+            return (returnOk, vertices, minZ, maxZ, avgZ, numpoints)
 
     logging.info('Extracted cutout for item %d has %d points with minimum z = %s, maximum z = %s, average z = %s' % (itemid, numpoints, str(minZ), str(maxZ), str(avgZ))) 
     returnOk = True
@@ -115,11 +251,14 @@ def run(args):
 
     connection, cursor = utils.connectToDB(args.dbname, args.dbuser, args.dbpass, args.dbhost, args.dbport) 
     
-    (returnOk, vertices, minZ, maxZ, avgZ, numpoints) = create_cut_out(cursor, args.las, args.output, args.itemid, args.buffer, args.concave)
+    (returnOk, vertices, minZ, maxZ, avgZ, numpoints) = create_cut_out(cursor, args.las, args.output, args.itemid, args.buffer, args.concave, args.engine, args.hull)
     
     if returnOk:
         # Create CSV with vertices of footprint
-        footoutput = args.output + '_footprint.csv'
+        if args.output:
+            footoutput = args.output + '_footprint.csv'
+        else:
+            footoutput = 'ITEM_%d_footprint.csv' % args.itemid
         logging.info('Creating CSV %s with vertices of concave hull of footprint' % footoutput)
         fpOutput = open(footoutput, 'w')
         for point in vertices:
@@ -139,7 +278,7 @@ def argument_parser():
     parser = argparse.ArgumentParser(
     description = "Creates a LAS/LAZ file containing the cutout of the points in the bounding box of an area delimited by the footprint of a item/site.\nIt is possible to specify a buffer around the footprint.\nIt also outputs an auxiliary ASCII file with the vertices of the footprint (for the z value we use the average of the z coordinates of the cutout LAS/LAZ file")
     parser.add_argument('-i','--itemid',help='Item ID',type=int, required=True)
-    parser.add_argument('-o','--output',default='',help='Output LAS/LAZ file',type=str, required=True)
+    parser.add_argument('-o','--output',default='',help='Output LAS/LAZ file. If not provided only the statistics of the cutout are computed (with native engine no file is written)',type=str, required=False)
     parser.add_argument('-l','--las',default=utils.DEFAULT_BACKGROUND_FOLDER,help='Folder that contains the LAS/LAZ files [default ' + utils.DEFAULT_BACKGROUND_FOLDER + ']',type=str, required=False)
     parser.add_argument('-c','--concave',default=DEFAULT_CONCAVE,help='Target percentage of concavity used by PostGIS when unifying the multipolygons [default ' + str(DEFAULT_CONCAVE) + ']. Must be between 0 and 1 (1 is a convex hull)',type=type(DEFAULT_CONCAVE), required=False)    
     parser.add_argument('-d','--dbname',default=utils.DEFAULT_DB, help='PostgreSQL DB [default ' + utils.DEFAULT_DB + ']',type=str , required=False)
@@ -148,6 +287,8 @@ def argument_parser():
     parser.add_argument('-t','--dbhost',default='',help='DB host',type=str, required=False)
     parser.add_argument('-r','--dbport',default='',help='DB port',type=str, required=False)
     parser.add_argument('-b','--buffer',default=DEFAULT_BUFFER,help='Buffer around the footprint [default ' + str(DEFAULT_BUFFER) + ']',type=type(DEFAULT_BUFFER), required=False)
+    parser.add_argument('-e','--engine',default=DEFAULT_ENGINE,help='Cut-out engine: native reads the LAS files with NumPy, lastools uses lasmerge and lasinfo. LAZ files are always processed with lastools [default ' + DEFAULT_ENGINE + ']',choices=ENGINES, required=False)
+    parser.add_argument('--hull',default=False,help='Only select the points inside the (buffered) concave hull of the footprint instead of its bounding box (only with native engine) [default False]',action='store_true')
     parser.add_argument('--log', help='Log level', choices=utils.LOG_LEVELS_LIST, default=utils.DEFAULT_LOG_LEVEL)
     return parser
 
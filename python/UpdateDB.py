@@ -3,9 +3,9 @@
 #    Created by Oscar Martinez                                                 #
 #    o.rubi@esciencecenter.nl                                                  #
 ################################################################################
-import os, argparse, time, logging, glob, json
+import os, argparse, time, logging, glob, json, multiprocessing
 from utils import *
-import liblas
+import las_utils
 #from osgeo import osr
 
 # TODO: Checking for addRawDataItem:
@@ -18,11 +18,36 @@ import liblas
 
 TYPES = 'ropn'
 DATA_ITEM_TYPES_CHARS = 'pmi'
+DEFAULT_WORKERS = 1
+MANIFEST_FILE_NAME = '.updatedb_manifest.json'
+# Id column of the tables of the data items
+ID_COLUMNS = {'RAW_DATA_ITEM': 'raw_data_item_id', 
+              'OSG_DATA_ITEM': 'osg_data_item_id', 
+              'OSG_DATA_ITEM_PC_BACKGROUND': 'osg_data_item_pc_background_id', 
+              'POTREE_DATA_ITEM_PC': 'potree_data_item_pc_id', 
+              'NEXUS_DATA_ITEM_MESH': 'nexus_data_item_mesh_id'}
 
 # Get time when we start the update process
 initialTime = getCurrentTime()
 #Declare variable for global cursor to DB
 cursor = None
+# Number of worker processes and DB connection arguments (each worker opens its own connection)
+numWorkers = DEFAULT_WORKERS
+connectionArgs = None
+# Unit of work where the DB writes are collected and the ids of the items known to be in the DB
+uow = None
+itemIds = set()
+# In-memory index of the data items in the DB (table -> {absPath: (id, lastMod[, srid])}) 
+# It is used instead of querying the DB for each visited data item 
+dbIndex = {}
+# Manifest with the stat and DB ids of the visited folders and data items 
+# (folderAbsPath -> record). Used in incremental mode to skip unchanged data items
+manifest = {}
+incremental = False
+dryRun = False
+scanThreads = las_utils.DEFAULT_SCAN_THREADS
+# Raw point clouds whose tiles are in RAW_DATA_ITEM_PC_TILE
+tiledRawDataItemIds = set()
 
 def getDataItemTypes(ditypes):
     dataItemtypes = []
@@ -35,62 +60,21 @@ def getDataItemTypes(ditypes):
     return dataItemtypes
         
 def readLASInfo(absPath):
-    """ Gets information of the LAS/LAZ files in the asbPath"""
-    (srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz) =  (None, 0, None, None, None, None, None, None, None)
-    if os.path.isdir(absPath):
-        lasfiles = glob.glob(absPath + '/*las')
-        lazfiles = glob.glob(absPath + '/*laz')
-        
-        if len(lasfiles) >= len(lazfiles):
-            extension = 'las'
-        else:
-            extension = 'laz'
-
-        for lfile in lasfiles + lazfiles:
-            lasHeader = liblas.file.File(lfile, mode='r').header
-            lsrid = readSRID(lasHeader)
-            if srid == None:
-                srid = lsrid
-            elif srid != lsrid:
-                srid = -1
-            
-            numberPoints += lasHeader.get_pointrecordscount()
-            
-            if lasHeader.get_pointrecordscount():
-            
-                [lminx, lminy, lminz] = lasHeader.get_min()
-                if minx == None or lminx < minx:
-                    minx = lminx 
-                if miny == None or lminy < miny:
-                    miny = lminy
-                if minz == None or lminz < minz:
-                    minz = lminz
-                
-                [lmaxx, lmaxy, lmaxz] = lasHeader.get_max()
-                if maxx == None or lmaxx > maxx:
-                    maxx = lmaxx
-                if maxy == None or lmaxy > maxy:
-                    maxy = lmaxy
-                if maxz == None or lmaxz > maxz:
-                    maxz = lmaxz
-        
-    else: #It is a single file
-        if asbPath.lower.endswith('las'):
-            extension = 'las'
-        elif asbPath.lower.endswith('laz'):
-            extension = 'laz'
-        lasHeader = liblas.file.File(absPath, mode='r').header
-        srid = readSRID(lasHeader)
-        numberPoints = lasHeader.get_pointrecordscount()
-        [minx, miny, minz] = lasHeader.get_min()
-        [maxx, maxy, maxz] = lasHeader.get_max()
-    
+    """ Gets information of the LAS/LAZ files in the absPath and the statistics of each file"""
+    ((srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz), tiles) = las_utils.scanLAS(absPath, scanThreads)
     if srid == None:
         logging.info('SRID is not set in ' + absPath)
     elif srid == -1:
         logging.error('SRID is not the same in all files in ' + absPath)
         srid = None
-    return (srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz)
+    return ((srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz), tiles)
+
+def addTiles(rawDataItemId, tiles):
+    """ Add the statistics of the LAS/LAZ files of a raw point cloud"""
+    for tile in tiles:
+        uow.insert('RAW_DATA_ITEM_PC_TILE', ('raw_data_item_id', 'file_name', 'number_points', 'minx', 'miny', 'minz', 'maxx', 'maxy', 'maxz', 'srid', 'mtime', 'size'), 
+                   [rawDataItemId, ] + list(tile))
+    tiledRawDataItemIds.add(rawDataItemId)
 
 def readPictureInfo(absPath):
     if os.path.isfile(absPath + '.json'):
@@ -177,8 +161,13 @@ def run(opts):
     logname = os.path.splitext(os.path.basename(__file__))[0] + '.log'
     start_logging(filename=logname, level=opts.log)
     # Establish connection with DB
-    global cursor
-    connection, cursor = connectToDB(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport) 
+    global cursor, numWorkers, connectionArgs, uow, incremental, dryRun, scanThreads
+    connectionArgs = (opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport)
+    connection, cursor = connectToDB(*connectionArgs)
+    numWorkers = max(1, opts.workers)
+    uow = DBUnitOfWork(cursor, opts.batch)
+    dryRun = opts.dryrun
+    scanThreads = max(1, opts.scanthreads)
 
     dataItemTypes = getDataItemTypes(opts.ditypes)
     
@@ -190,6 +179,12 @@ def run(opts):
     potDataAbsPath = dataAbsPath + '/' + POT_FT
     nexDataAbsPath = dataAbsPath + '/' + NEX_FT
     
+    manifestAbsPath = opts.manifest
+    if manifestAbsPath == '':
+        manifestAbsPath = dataAbsPath + '/' + MANIFEST_FILE_NAME
+    loadManifest(manifestAbsPath)
+    incremental = opts.incremental and checkManifest()
+    loadDBIndex()
 
     localtime = getCurrentTimeAsAscii()
     t0 = time.time()
@@ -222,6 +217,8 @@ def run(opts):
 
     if 'o' in opts.types:
         os.system('touch ' + osgDataAbsPath + '/LAST_MOD')
+    
+    saveManifest(manifestAbsPath)
 
     cursor.close()
     connection.close()
@@ -255,9 +252,8 @@ def processBackgrounds(absPath, addMethod, dataItemType):
         return
     t0 = time.time()
     logging.info('Processing ' + absPath)
-    backgrounds = os.listdir(absPath)
-    for background in backgrounds:
-        addMethod(absPath + '/' + background, ITEM_ID_BACKGROUND, dataItemType)
+    # All the backgrounds share the same item so they go in a single job
+    runJobs([(absPath, ITEM_ID_BACKGROUND, dataItemType),], addMethod)
     logging.info('Processing ' + absPath + ' finished in %.2f' % (time.time() - t0))
 
 def processSites(absPath, addMethod, dataItemType):
@@ -266,190 +262,328 @@ def processSites(absPath, addMethod, dataItemType):
         return
     t0 = time.time()
     logging.info('Processing ' + absPath)
-    sites = os.listdir(absPath)
-    for site in sites:
+    # One job per site (the data items of a site are processed by the same worker)
+    jobs = []
+    for site in sorted(os.listdir(absPath)):
         siteId = int(site.replace('S',''))
-        siteAbsPath = absPath + '/' + site
-        sitePCs = os.listdir(siteAbsPath)
-        for sitePC in sitePCs:
-            addMethod(siteAbsPath + '/' + sitePC, siteId, dataItemType)
+        jobs.append((absPath + '/' + site, siteId, dataItemType))
+    # Forget the removed sites
+    for folderAbsPath in manifest.keys():
+        if os.path.dirname(folderAbsPath) == absPath and not os.path.isdir(folderAbsPath):
+            del manifest[folderAbsPath]
+    runJobs(jobs, addMethod)
     logging.info('Processing ' + absPath + ' finished in %.2f' % (time.time() - t0))
 
+def sameStat(record, stat):
+    """ Check if a manifest record (of a folder or a data item) matches the stat of the path"""
+    return record['mtime'] == stat.st_mtime and record['inode'] == stat.st_ino and record['size'] == stat.st_size
+
+def runJob(jobAbsPath, itemId, dataItemType, addMethod):
+    """ Run the addMethod for all the data items in the jobAbsPath folder. 
+    In incremental mode the folder is not listed if its stat has not changed 
+    since the last run and the data items whose stat has not changed are not 
+    visited (only their last_check is updated using the DB ids in the manifest).
+    Returns the number of visited data items and the new manifest record of the folder"""
+    oldRecord = None
+    if incremental:
+        oldRecord = manifest.get(jobAbsPath)
+    stat = os.stat(jobAbsPath)
+    if oldRecord != None and sameStat(oldRecord, stat):
+        # No data item has been added/removed in this folder
+        names = sorted(oldRecord['items'])
+    else:
+        names = sorted(os.listdir(jobAbsPath))
+    record = {'mtime': stat.st_mtime, 'size': stat.st_size, 'inode': stat.st_ino, 'items': {}}
+    numDataItems = 0
+    for name in names:
+        dataItemAbsPath = jobAbsPath + '/' + name
+        dataItemStat = os.stat(dataItemAbsPath)
+        dataItemRecord = None
+        if oldRecord != None:
+            dataItemRecord = oldRecord['items'].get(name)
+        if dataItemRecord != None and len(dataItemRecord['ids']) and sameStat(dataItemRecord, dataItemStat):
+            for (table, rowId) in dataItemRecord['ids']:
+                uow.touch(table, ID_COLUMNS[table], rowId, initialTime)
+        else:
+            dataItemIds = addMethod(dataItemAbsPath, itemId, dataItemType)
+            dataItemRecord = {'mtime': dataItemStat.st_mtime, 'size': dataItemStat.st_size, 'inode': dataItemStat.st_ino, 'ids': dataItemIds or []}
+            numDataItems += 1
+        record['items'][name] = dataItemRecord
+        uow.dataItemDone()
+    return (numDataItems, record)
+
+def runChild(procIndex, jobsQueue, resultsQueue, addMethod):
+    """ Worker process: it opens its own DB connection and processes jobs until it receives a None job"""
+    global cursor, uow
+    connection, cursor = connectToDB(*connectionArgs)
+    uow = DBUnitOfWork(cursor, uow.batchSize)
+    kill_received = False
+    while not kill_received:
+        job = None
+        try:
+            # This call will patiently wait until new job is available
+            job = jobsQueue.get()
+        except:
+            # if there is an error we will quit
+            kill_received = True
+        if job == None:
+            # If we receive a None job, it means we can stop this worker
+            kill_received = True
+        else:
+            (jobIndex, jobAbsPath, itemId, dataItemType) = job
+            t0 = time.time()
+            try:
+                (numDataItems, record) = runJob(jobAbsPath, itemId, dataItemType, addMethod)
+                uow.flush()
+                errorMsg = None
+            except Exception, e:
+                # The pending writes of the failed job must not be committed 
+                # with the next job and the index may contain its data items
+                uow.discard()
+                connection.rollback()
+                loadDBIndex()
+                (numDataItems, record) = (0, None)
+                errorMsg = str(e)
+            resultsQueue.put((jobIndex, procIndex, numDataItems, record, time.time() - t0, errorMsg))
+    closeConnectionDB(connection, cursor)
+
+def runJobs(jobs, addMethod):
+    """ Run the jobs, i.e. (folderAbsPath, itemId, dataItemType) tuples. If more 
+    than one worker is requested the jobs are distributed in a pool of processes. 
+    The results are merged in the order of the jobs independently of the order 
+    in which they are finished"""
+    if numWorkers == 1 or len(jobs) < 2:
+        for (jobAbsPath, itemId, dataItemType) in jobs:
+            (numDataItems, manifest[jobAbsPath]) = runJob(jobAbsPath, itemId, dataItemType, addMethod)
+        uow.flush()
+        return
+    
+    # Pending writes must be in the DB before the workers start
+    uow.flush()
+    # Create queues
+    jobsQueue = multiprocessing.Queue() # The queue of jobs
+    resultsQueue = multiprocessing.Queue() # The queue of results
+    for jobIndex in range(len(jobs)):
+        (jobAbsPath, itemId, dataItemType) = jobs[jobIndex]
+        jobsQueue.put((jobIndex, jobAbsPath, itemId, dataItemType))
+    numProcs = min(numWorkers, len(jobs))
+    for i in range(numProcs): #we add as many None jobs as workers to tell them to terminate (queue is FIFO)
+        jobsQueue.put(None)
+    
+    procs = []
+    for i in range(numProcs):
+        procs.append(multiprocessing.Process(target=runChild, 
+            args=(i, jobsQueue, resultsQueue, addMethod)))
+        procs[-1].start()
+    
+    results = [None] * len(jobs)
+    for i in range(len(jobs)):
+        result = resultsQueue.get()
+        results[result[0]] = result
+    # wait for all workers to finish their execution
+    for i in range(numProcs):
+        procs[i].join()
+    
+    # Merge the results in the order of the jobs
+    # The rows added by the workers are not in the index of this process
+    loadDBIndex()
+    for (jobIndex, procIndex, numDataItems, record, elapsed, errorMsg) in results:
+        jobAbsPath = jobs[jobIndex][0]
+        if errorMsg == None:
+            manifest[jobAbsPath] = record
+            logging.info('PROC%d: Processed %d data items in %s in %.2f' % (procIndex, numDataItems, jobAbsPath, elapsed))
+        else:
+            # The folder will be fully visited in the next run
+            manifest.pop(jobAbsPath, None)
+            logging.error('PROC%d: Processing of %s failed: %s' % (procIndex, jobAbsPath, errorMsg))
+
+def loadDBIndex():
+    """ Bulk load the abs_path, id and last_mod (and srid for RAW data items) of all 
+    the data items in the DB, and the ids of all the items"""
+    global itemIds, tiledRawDataItemIds
+    for table in ID_COLUMNS:
+        columns = 'abs_path, ' + ID_COLUMNS[table] + ', last_mod'
+        if table == 'RAW_DATA_ITEM':
+            columns += ', srid'
+        rows, num = fetchDataFromDB(cursor, 'SELECT ' + columns + ' FROM ' + table)
+        dbIndex[table] = dict((row[0], tuple(row[1:])) for row in rows)
+    rows, num = fetchDataFromDB(cursor, 'SELECT item_id FROM ITEM')
+    itemIds = set(row[0] for row in rows)
+    rows, num = fetchDataFromDB(cursor, 'SELECT DISTINCT raw_data_item_id FROM RAW_DATA_ITEM_PC_TILE')
+    tiledRawDataItemIds = set(row[0] for row in rows)
+
+def loadManifest(manifestAbsPath):
+    """ Load the manifest of a previous run (if available)"""
+    global manifest
+    manifest = {}
+    if os.path.isfile(manifestAbsPath):
+        try:
+            manifest = json.load(open(manifestAbsPath, 'r'))
+        except Exception, e:
+            logging.warn('Ignoring manifest ' + manifestAbsPath + ': ' + str(e))
+            manifest = {}
+
+def checkManifest():
+    """ Check that all the DB ids in the manifest are still in the DB. Returns False otherwise 
+    (for example if the DB has been recreated)"""
+    tablesIds = {}
+    for record in manifest.values():
+        for dataItemRecord in record['items'].values():
+            for (table, rowId) in dataItemRecord['ids']:
+                tablesIds.setdefault(table, set()).add(rowId)
+    for table in tablesIds:
+        rowIds = list(tablesIds[table])
+        rows, num = fetchDataFromDB(cursor, 'SELECT count(*) FROM ' + table + ' WHERE ' + ID_COLUMNS[table] + ' = ANY(%s)', [rowIds,], mogrify = False)
+        if rows[0][0] != len(rowIds):
+            logging.warn('Manifest does not match the content of ' + table + '. Incremental mode is disabled')
+            return False
+    return True
+
+def saveManifest(manifestAbsPath):
+    """ Save the manifest for the next runs"""
+    tempAbsPath = manifestAbsPath + '_TEMP'
+    json.dump(manifest, open(tempAbsPath, 'w'))
+    os.rename(tempAbsPath, manifestAbsPath)
+
+def cleanDataItems(label, table, idColumn, subTable = None, dependencies = ()):
+    """ Remove from the DB the data items of table (and subTable) that have not been 
+    checked in this run and that are not in the file system anymore. A single query 
+    gets the stale data items and whether other data items still depend on them 
+    (dependencies are the tables referencing idColumn) and the removable ones are 
+    deleted in bulk in a single transaction. Returns the number of removed data items"""
+    if len(dependencies):
+        deletable = ' AND '.join(['NOT EXISTS (SELECT 1 FROM ' + dependency + ' D WHERE D.' + idColumn + ' = A.' + idColumn + ')' for dependency in dependencies])
+    else:
+        deletable = 'TRUE'
+    query = 'SELECT A.' + idColumn + ', A.abs_path, ' + deletable + ' FROM ' + table + ' A'
+    if subTable != None:
+        query += ', ' + subTable + ' B WHERE A.' + idColumn + ' = B.' + idColumn + ' AND'
+    else:
+        query += ' WHERE'
+    query += ' A.last_check < %s'
+    rows, num = fetchDataFromDB(cursor, query, [initialTime,])
+    
+    deleteIds = []
+    for (rowId, absPath, isDeletable) in rows:
+        if os.path.isfile(absPath) or os.path.isdir(absPath):
+            logging.error(label + ' data item in ' + absPath + ' has not been checked!')
+        elif not isDeletable:
+            logging.warning('Can not delete entry for removed ' + absPath + '. Related data items still there!')
+        else: # There is not any file or folder in that location -> we can delete this entry
+            deleteIds.append(rowId)
+            if dryRun:
+                logging.info('Entry for removed ' + absPath + ' would be deleted')
+    
+    if dryRun:
+        msg = '%s: %d entries not checked, %d would be deleted' % (table if subTable == None else subTable, num, len(deleteIds))
+        print msg
+        logging.info(msg)
+    elif len(deleteIds):
+        tables = [table,]
+        if subTable != None:
+            tables.insert(0, subTable)
+        try:
+            for t in tables:
+                cursor.execute('DELETE FROM ' + t + ' WHERE ' + idColumn + ' = ANY(%s)', [deleteIds,])
+            cursor.connection.commit()
+        except:
+            cursor.connection.rollback()
+            raise
+    return len(deleteIds)
+
 def cleanRaw(dataItemTypes):
     logging.info('Cleaning raw data items...') 
     if PC_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT A.raw_data_item_id, A.item_id, abs_path FROM RAW_DATA_ITEM A, RAW_DATA_ITEM_PC B WHERE A.raw_data_item_id = B.raw_data_item_id AND A.last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (rawDataItemId, itemId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('Raw data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we try to delete all references of this one
-                num_dependancies = 0
-                cursor.execute('SELECT count(*) FROM POTREE_DATA_ITEM_PC WHERE raw_data_item_id = %s', [rawDataItemId,])
-                num_dependancies += cursor.fetchone()[0]
-                cursor.execute('SELECT count(*) FROM OSG_DATA_ITEM_PC_SITE WHERE raw_data_item_id = %s', [rawDataItemId,])
-                num_dependancies += cursor.fetchone()[0]
-                cursor.execute('SELECT count(*) FROM OSG_DATA_ITEM_PC_BACKGROUND WHERE raw_data_item_id = %s', [rawDataItemId,])
-                num_dependancies += cursor.fetchone()[0]
-                
-                if num_dependancies == 0:
-                    dbExecute(cursor, 'DELETE FROM RAW_DATA_ITEM_PC WHERE raw_data_item_id = %s', [rawDataItemId,])
-                    dbExecute(cursor, 'DELETE FROM RAW_DATA_ITEM WHERE raw_data_item_id = %s', [rawDataItemId,])
-                else:
-                    logging.warning('Can not delete entry for removed ' + absPath + '. Related data items still there!')
+        cleanDataItems('Raw', 'RAW_DATA_ITEM', 'raw_data_item_id', 'RAW_DATA_ITEM_PC', ('POTREE_DATA_ITEM_PC', 'OSG_DATA_ITEM_PC_SITE', 'OSG_DATA_ITEM_PC_BACKGROUND'))
     if MESH_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT A.raw_data_item_id, A.item_id, abs_path FROM RAW_DATA_ITEM A, RAW_DATA_ITEM_MESH B WHERE A.raw_data_item_id = B.raw_data_item_id AND A.last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (rawDataItemId, itemId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('Raw data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we try to delete all references of this one
-                num_dependancies = 0
-                cursor.execute('SELECT count(*) FROM OSG_DATA_ITEM_MESH WHERE raw_data_item_id = %s', [rawDataItemId,])
-                num_dependancies += cursor.fetchone()[0]
-                cursor.execute('SELECT count(*) FROM NEXUS_DATA_ITEM_MESH WHERE raw_data_item_id = %s', [rawDataItemId,])
-                num_dependancies += cursor.fetchone()[0]
-                if num_dependancies == 0:
-                    dbExecute(cursor, 'DELETE FROM RAW_DATA_ITEM_MESH WHERE raw_data_item_id = %s', [rawDataItemId,])
-                    dbExecute(cursor, 'DELETE FROM RAW_DATA_ITEM WHERE raw_data_item_id = %s', [rawDataItemId,])
-                else:
-                    logging.warning('Can not delete entry for removed ' + absPath + '. Related data items still there!')
-        
+        cleanDataItems('Raw', 'RAW_DATA_ITEM', 'raw_data_item_id', 'RAW_DATA_ITEM_MESH', ('OSG_DATA_ITEM_MESH', 'NEXUS_DATA_ITEM_MESH'))
     if PIC_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT A.raw_data_item_id, A.item_id, abs_path FROM RAW_DATA_ITEM A, RAW_DATA_ITEM_PICTURE B WHERE A.raw_data_item_id = B.raw_data_item_id AND A.last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (rawDataItemId, itemId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('Raw data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we try to delete all references of this one
-                cursor.execute('SELECT count(*) FROM OSG_DATA_ITEM_PICTURE WHERE raw_data_item_id = %s', [rawDataItemId,])
-                num_dependancies = cursor.fetchone()[0]
-                if num_dependancies == 0:
-                    dbExecute(cursor, 'DELETE FROM RAW_DATA_ITEM_PICTURE WHERE raw_data_item_id = %s', [rawDataItemId,])
-                    dbExecute(cursor, 'DELETE FROM RAW_DATA_ITEM WHERE raw_data_item_id = %s', [rawDataItemId,])
-                else:
-                    logging.warning('Can not delete entry for removed ' + absPath + '. Related data items still there!') 
+        cleanDataItems('Raw', 'RAW_DATA_ITEM', 'raw_data_item_id', 'RAW_DATA_ITEM_PICTURE', ('OSG_DATA_ITEM_PICTURE',))
 
 def cleanOSG(dataItemTypes):
     logging.info('Cleaning OSG data items...') 
     if PC_FT in dataItemTypes:
-        # Background
-        dbExecute(cursor, 'SELECT osg_data_item_pc_background_id, abs_path FROM OSG_DATA_ITEM_PC_BACKGROUND WHERE last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (osgDataItemPCBackgroundId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('OSG data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we can delete this entry
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM_PC_BACKGROUND WHERE osg_data_item_pc_background_id = %s', [osgDataItemPCBackgroundId,])
-        # Sites
-        dbExecute(cursor, 'SELECT A.osg_data_item_id, A.abs_path FROM OSG_DATA_ITEM A,OSG_DATA_ITEM_PC_SITE B WHERE A.osg_data_item_id = B.osg_data_item_id AND last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (osgDataItemId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('OSG data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we can delete this entry
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM_PC_SITE WHERE osg_data_item_id = %s', [osgDataItemId,])
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM WHERE osg_data_item_id = %s', [osgDataItemId,])
+        cleanDataItems('OSG', 'OSG_DATA_ITEM_PC_BACKGROUND', 'osg_data_item_pc_background_id')
+        cleanDataItems('OSG', 'OSG_DATA_ITEM', 'osg_data_item_id', 'OSG_DATA_ITEM_PC_SITE')
     if MESH_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT A.osg_data_item_id, A.abs_path FROM OSG_DATA_ITEM A,OSG_DATA_ITEM_MESH B WHERE A.osg_data_item_id = B.osg_data_item_id AND last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (osgDataItemId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('OSG data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we can delete this entry
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM_MESH WHERE osg_data_item_id = %s', [osgDataItemId,])
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM WHERE osg_data_item_id = %s', [osgDataItemId,])
+        cleanDataItems('OSG', 'OSG_DATA_ITEM', 'osg_data_item_id', 'OSG_DATA_ITEM_MESH')
     if PIC_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT A.osg_data_item_id, A.abs_path FROM OSG_DATA_ITEM A,OSG_DATA_ITEM_PICTURE B WHERE A.osg_data_item_id = B.osg_data_item_id AND last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (osgDataItemId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('OSG data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we can delete this entry
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM_PICTURE WHERE osg_data_item_id = %s', [osgDataItemId,])
-                dbExecute(cursor, 'DELETE FROM OSG_DATA_ITEM WHERE osg_data_item_id = %s', [osgDataItemId,])
+        cleanDataItems('OSG', 'OSG_DATA_ITEM', 'osg_data_item_id', 'OSG_DATA_ITEM_PICTURE')
 
 def cleanPOT(dataItemTypes):
     logging.info('Cleaning POTREE data items...') 
     if PC_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT potree_data_item_pc_id, abs_path FROM POTREE_DATA_ITEM_PC WHERE last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (potreeDataItemPCId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('POTREE data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we can delete this entry
-                dbExecute(cursor, 'DELETE FROM POTREE_DATA_ITEM_PC WHERE potree_data_item_pc_id = %s', [potreeDataItemPCId,])
-
+        cleanDataItems('POTREE', 'POTREE_DATA_ITEM_PC', 'potree_data_item_pc_id')
 
 def cleanNEX(dataItemTypes):
     logging.info('Cleaning NEXUS data items...') 
     if MESH_FT in dataItemTypes:
-        dbExecute(cursor, 'SELECT nexus_data_item_mesh_id, abs_path FROM NEXUS_DATA_ITEM_MESH WHERE last_check < %s', [initialTime,])
-        rows = cursor.fetchall()
-        for (necusDataItemMeshId, absPath) in rows:
-            if os.path.isfile(absPath) or os.path.isdir(absPath):
-                logging.error('NEXUS data item in ' + absPath + ' has not been checked!')
-            else: # There is not any file or folder in that location -> we can delete this entry
-                dbExecute(cursor, 'DELETE FROM NEXUS_DATA_ITEM_MESH WHERE nexus_data_item_mesh_id = %s', [necusDataItemMeshId,])
+        cleanDataItems('NEXUS', 'NEXUS_DATA_ITEM_MESH', 'nexus_data_item_mesh_id')
                 
+def addItem(itemId):
+    """ Add the item (and its item object) if it is not in the DB yet"""
+    if itemId not in itemIds:
+        isBack = (itemId < 0)
+        uow.insert('ITEM', ('item_id', 'background'), [itemId, isBack])
+        if not isBack: 
+            uow.insert('ITEM_OBJECT', ('item_id', 'object_number'), [itemId, ITEM_OBJECT_NUMBER_ITEM])
+        itemIds.add(itemId)
+
 def addRawDataItem(absPath, itemId, dataItemType):
     if os.path.isdir(absPath) and len(os.listdir(absPath)) == 0:
         logging.warn('Skipping ' + absPath + '. Empty directory')
         return
     modTime = getCurrentTime(getLastModification(absPath))
-    dbExecute(cursor, 'SELECT raw_data_item_id, last_mod FROM RAW_DATA_ITEM WHERE abs_path = %s', [absPath,])
-    row = cursor.fetchone()
+    row = dbIndex['RAW_DATA_ITEM'].get(absPath)
     if row == None: #This folder has been added recently
-        dbExecute(cursor, 'SELECT item_id FROM ITEM WHERE item_id = %s', [itemId,])
-        row = cursor.fetchone()
-        if row == None:
-            isBack = (itemId < 0)
-            dbExecute(cursor, "INSERT INTO ITEM (item_id, background) VALUES (%s,%s)", [itemId, isBack])
-            if not isBack: 
-                dbExecute(cursor, "INSERT INTO ITEM_OBJECT (item_id, object_number) VALUES (%s,%s)", [itemId, ITEM_OBJECT_NUMBER_ITEM])
-        dbExecute(cursor, "INSERT INTO RAW_DATA_ITEM (raw_data_item_id, item_id, abs_path, last_mod, last_check) VALUES (DEFAULT,%s,%s,%s,%s) RETURNING raw_data_item_id", 
-                        [itemId, absPath, modTime, initialTime])
-        rawDataItemId = cursor.fetchone()[0]
+        addItem(itemId)
+        rawDataItemId = uow.nextId('RAW_DATA_ITEM', 'raw_data_item_id')
         srid = None
+        current = isCurrent(absPath)
         if dataItemType == PC_FT:
-            current = isCurrent(absPath)
             color8bit = is8BitColor(absPath)
-            (srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz) = readLASInfo(absPath)  
-            dbExecute(cursor, "INSERT INTO RAW_DATA_ITEM_PC (raw_data_item_id, number_points, extension, minx, miny, minz, maxx, maxy, maxz, color_8bit) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", 
-                            [rawDataItemId, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz, color8bit])
+            ((srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz), tiles) = readLASInfo(absPath)  
+            (table, names, values) = ('RAW_DATA_ITEM_PC', ('raw_data_item_id', 'number_points', 'extension', 'minx', 'miny', 'minz', 'maxx', 'maxy', 'maxz', 'color_8bit'), 
+                                      [rawDataItemId, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz, color8bit])
         elif dataItemType == MESH_FT:
-            current = isCurrent(absPath)
             srid = getMeshSRID(absPath)
             objAbsPath = getFileWithExtensionAbsPath(absPath, 'obj')
             mtlAbsPath = getFileWithExtensionAbsPath(absPath, 'mtl')
             plyAbsPath = getFileWithExtensionAbsPath(absPath, 'ply')
             color8bit = is8BitColor(absPath)
-            dbExecute(cursor, "INSERT INTO RAW_DATA_ITEM_MESH (raw_data_item_id, current_mesh, obj_abs_path, ply_abs_path, mtl_abs_path, color_8bit) VALUES (%s,%s,%s,%s,%s,%s)", 
-                            [rawDataItemId, current, objAbsPath, plyAbsPath, mtlAbsPath, color8bit])
+            (table, names, values) = ('RAW_DATA_ITEM_MESH', ('raw_data_item_id', 'current_mesh', 'obj_abs_path', 'ply_abs_path', 'mtl_abs_path', 'color_8bit'), 
+                                      [rawDataItemId, current, objAbsPath, plyAbsPath, mtlAbsPath, color8bit])
         else:
-            current = isCurrent(absPath)
             thumbnail = isThumbnail(absPath)
             (srid, x, y, z, dx, dy, dz, ux, uy, uz) = readPictureInfo(absPath)
-            dbExecute(cursor, "INSERT INTO RAW_DATA_ITEM_PICTURE (raw_data_item_id, current_picture, thumbnail, x, y, z, dx, dy, dz, ux, uy, uz) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", 
-                            [rawDataItemId, current, thumbnail, x, y, z, dx, dy, dz, ux, uy, uz])
-        if srid != None:
-            dbExecute(cursor, 'UPDATE RAW_DATA_ITEM SET srid=%s WHERE raw_data_item_id = %s', [srid, rawDataItemId])
+            (table, names, values) = ('RAW_DATA_ITEM_PICTURE', ('raw_data_item_id', 'current_picture', 'thumbnail', 'x', 'y', 'z', 'dx', 'dy', 'dz', 'ux', 'uy', 'uz'), 
+                                      [rawDataItemId, current, thumbnail, x, y, z, dx, dy, dz, ux, uy, uz])
+        uow.insert('RAW_DATA_ITEM', ('raw_data_item_id', 'item_id', 'abs_path', 'srid', 'last_mod', 'last_check'), 
+                   [rawDataItemId, itemId, absPath, srid, modTime, initialTime])
+        uow.insert(table, names, values)
+        if dataItemType == PC_FT:
+            addTiles(rawDataItemId, tiles)
+        dbIndex['RAW_DATA_ITEM'][absPath] = (rawDataItemId, modTime, srid)
     else:
-        (rawDataItemId, lastModDB) = row
+        (rawDataItemId, lastModDB, srid) = row
         if modTime > lastModDB: #Data has changed
             logging.warn('Raw data item in ' + absPath + ' may have been updated and it may not be reflected in the DB. Please use AddRawDataItem and RemoveRawDataItem scripts')
-        dbExecute(cursor, 'UPDATE RAW_DATA_ITEM SET last_check=%s WHERE raw_data_item_id = %s', [initialTime, rawDataItemId])
+        uow.touch('RAW_DATA_ITEM', 'raw_data_item_id', rawDataItemId, initialTime)
+        if dataItemType == PC_FT and rawDataItemId not in tiledRawDataItemIds:
+            # Raw point cloud added before the tiles were stored
+            (info, tiles) = readLASInfo(absPath)
+            addTiles(rawDataItemId, tiles)
+    return [('RAW_DATA_ITEM', rawDataItemId),]
 
 def addOSGDataItem(absPath, itemId, dataItemType):
     modTime = getCurrentTime(getLastModification(absPath))
     
     rawAbsPath = absPath.replace(OSG_FT, RAW_FT)
-    dbExecute(cursor, 'SELECT raw_data_item_id, srid FROM RAW_DATA_ITEM WHERE abs_path = %s', [rawAbsPath,])
-    row = cursor.fetchone()
+    row = dbIndex['RAW_DATA_ITEM'].get(rawAbsPath)
     if row == None:
         logging.error('Skipping ' + absPath + '. None related RAW data item found in ' + rawAbsPath)
         return
-    (rawDataItemId, rawSRID) = row
+    (rawDataItemId, rawLastMod, rawSRID) = row
     
     if not checkOSG(absPath):
         logging.error('Skipping ' + absPath + '. None .osgb file found')
@@ -457,19 +591,20 @@ def addOSGDataItem(absPath, itemId, dataItemType):
 
     isPCBackground = isBackground(absPath) and (dataItemType == PC_FT)
     if isPCBackground:
-        dbExecute(cursor, 'SELECT osg_data_item_pc_background_id, last_mod FROM OSG_DATA_ITEM_PC_BACKGROUND WHERE abs_path = %s', [absPath,])
+        row = dbIndex['OSG_DATA_ITEM_PC_BACKGROUND'].get(absPath)
     else:
-        dbExecute(cursor, 'SELECT osg_data_item_id, last_mod FROM OSG_DATA_ITEM WHERE abs_path = %s', [absPath,])
+        row = dbIndex['OSG_DATA_ITEM'].get(absPath)
     
-    row = cursor.fetchone()  
     if row == None: #This folder has been added recently
         if isPCBackground:
             (offsetX, offsetY, offsetZ) = readOffsets(absPath)
             if offsetX == None:
                 logging.error('Skipping ' + absPath + '. None offsets found')
                 return
-            dbExecute(cursor, "INSERT INTO OSG_DATA_ITEM_PC_BACKGROUND (osg_data_item_pc_background_id, raw_data_item_id, abs_path, last_mod, last_check, offset_x, offset_y, offset_z) VALUES (DEFAULT,%s,%s,%s,%s,%s,%s,%s)", 
-                        [rawDataItemId, absPath, modTime, initialTime, offsetX, offsetY, offsetZ])
+            osgDataItemPCBackgroundId = uow.nextId('OSG_DATA_ITEM_PC_BACKGROUND', 'osg_data_item_pc_background_id')
+            uow.insert('OSG_DATA_ITEM_PC_BACKGROUND', ('osg_data_item_pc_background_id', 'raw_data_item_id', 'abs_path', 'last_mod', 'last_check', 'offset_x', 'offset_y', 'offset_z'), 
+                       [osgDataItemPCBackgroundId, rawDataItemId, absPath, modTime, initialTime, offsetX, offsetY, offsetZ])
+            dbIndex['OSG_DATA_ITEM_PC_BACKGROUND'][absPath] = (osgDataItemPCBackgroundId, modTime)
         else:
             xmlAbsPath = getFileWithExtensionAbsPath(absPath, 'xml')
             if xmlAbsPath == None:
@@ -510,86 +645,94 @@ def addOSGDataItem(absPath, itemId, dataItemType):
                     logging.error(e)
                     cursor.connection.rollback()
     
-            dbExecute(cursor, "INSERT INTO OSG_LOCATION (osg_location_id, srid, x, y, z) VALUES (DEFAULT,%s,%s,%s,%s) RETURNING osg_location_id", 
-                    [srid, x, y, z])
-            osgLocationId = cursor.fetchone()[0]
+            osgLocationId = uow.nextId('OSG_LOCATION', 'osg_location_id')
+            uow.insert('OSG_LOCATION', ('osg_location_id', 'srid', 'x', 'y', 'z'), 
+                       [osgLocationId, srid, x, y, z])
             
-            dbExecute(cursor, "INSERT INTO OSG_DATA_ITEM (osg_data_item_id, osg_location_id, abs_path, xml_abs_path, last_mod, last_check) VALUES (DEFAULT,%s,%s,%s,%s,%s) RETURNING osg_data_item_id", 
-                    [osgLocationId, absPath, xmlAbsPath, modTime, initialTime])
-            osgDataItemId = cursor.fetchone()[0]
+            osgDataItemId = uow.nextId('OSG_DATA_ITEM', 'osg_data_item_id')
+            uow.insert('OSG_DATA_ITEM', ('osg_data_item_id', 'osg_location_id', 'abs_path', 'xml_abs_path', 'last_mod', 'last_check'), 
+                       [osgDataItemId, osgLocationId, absPath, xmlAbsPath, modTime, initialTime])
             if dataItemType == PC_FT:
                 table = 'OSG_DATA_ITEM_PC_SITE' 
             elif dataItemType == MESH_FT:
                 table = 'OSG_DATA_ITEM_MESH'
             else: # PIC_FT
                 table = 'OSG_DATA_ITEM_PICTURE'
-            dbExecute(cursor, "INSERT INTO " + table + " (osg_data_item_id, raw_data_item_id) VALUES (%s,%s)", 
-                    [osgDataItemId, rawDataItemId])
+            uow.insert(table, ('osg_data_item_id', 'raw_data_item_id'), 
+                       [osgDataItemId, rawDataItemId])
+            dbIndex['OSG_DATA_ITEM'][absPath] = (osgDataItemId, modTime)
     else:
         if isPCBackground:
             (osgDataItemPCBackgroundId, lastModDB) = row
             if modTime > lastModDB: #Data has changed
                 logging.warn('OSG data item pc background in ' + absPath + ' may have been updated and it may not be reflected in the DB.')
-            dbExecute(cursor, 'UPDATE OSG_DATA_ITEM_PC_BACKGROUND SET last_check=%s WHERE osg_data_item_pc_background_id = %s', [initialTime, osgDataItemPCBackgroundId])
+            uow.touch('OSG_DATA_ITEM_PC_BACKGROUND', 'osg_data_item_pc_background_id', osgDataItemPCBackgroundId, initialTime)
         else:
             (osgDataItemId, lastModDB) = row
             if modTime > lastModDB: #Data has changed
                 logging.warn('OSG data item in ' + absPath + ' may have been updated and it may not be reflected in the DB.')
-            dbExecute(cursor, 'UPDATE OSG_DATA_ITEM SET last_check=%s WHERE osg_data_item_id = %s', [initialTime, osgDataItemId])
+            uow.touch('OSG_DATA_ITEM', 'osg_data_item_id', osgDataItemId, initialTime)
+    if isPCBackground:
+        return [('OSG_DATA_ITEM_PC_BACKGROUND', osgDataItemPCBackgroundId),]
+    return [('OSG_DATA_ITEM', osgDataItemId),]
 
 def addPOTDataItem(absPath, itemId, dataItemType):
     if dataItemType != PC_FT:
-        logging.error('Skipping ' + sAbsPath + '. Only POTREE point clouds are added')
+        logging.error('Skipping ' + absPath + '. Only POTREE point clouds are added')
         return
     
     rawAbsPath = absPath.replace(POT_FT, RAW_FT)
-    dbExecute(cursor, 'SELECT raw_data_item_id FROM RAW_DATA_ITEM WHERE abs_path = %s', [rawAbsPath,])
-    row = cursor.fetchone()
+    row = dbIndex['RAW_DATA_ITEM'].get(rawAbsPath)
     if row == None:
         logging.error('Skipping ' + absPath + '. None related RAW data item found in ' + rawAbsPath)
         return
     rawDataItemId = row[0]
     
     #  POTree can have multiple conversion per raw data item
+    ids = []
     for sPath in os.listdir(absPath):
         sAbsPath = absPath + '/' + sPath
         modTime = getCurrentTime(getLastModification(sAbsPath))
-        dbExecute(cursor, 'SELECT potree_data_item_pc_id, last_mod FROM POTREE_DATA_ITEM_PC WHERE abs_path = %s', [sAbsPath,])
-        row = cursor.fetchone()
+        row = dbIndex['POTREE_DATA_ITEM_PC'].get(sAbsPath)
         if row == None: #This folder has been added recently
             numLevels = getPOTNumberLevels(sAbsPath)
-            dbExecute(cursor, "INSERT INTO POTREE_DATA_ITEM_PC (potree_data_item_pc_id, raw_data_item_id, abs_path, last_mod, last_check, number_levels) VALUES (DEFAULT,%s,%s,%s,%s,%s)", 
-                    [rawDataItemId, sAbsPath, modTime, initialTime, numLevels])
+            potreeDataItemId = uow.nextId('POTREE_DATA_ITEM_PC', 'potree_data_item_pc_id')
+            uow.insert('POTREE_DATA_ITEM_PC', ('potree_data_item_pc_id', 'raw_data_item_id', 'abs_path', 'last_mod', 'last_check', 'number_levels'), 
+                       [potreeDataItemId, rawDataItemId, sAbsPath, modTime, initialTime, numLevels])
+            dbIndex['POTREE_DATA_ITEM_PC'][sAbsPath] = (potreeDataItemId, modTime)
         else:
             (potreeDataItemId, lastModDB) = row
             if modTime > lastModDB: #Data has changed
                 logging.warn('POTREE data item in ' + sAbsPath + ' may have been updated and it may not be reflected in the DB.')
-            dbExecute(cursor, 'UPDATE POTREE_DATA_ITEM_PC SET last_check=%s WHERE potree_data_item_pc_id = %s', [initialTime, potreeDataItemId])
+            uow.touch('POTREE_DATA_ITEM_PC', 'potree_data_item_pc_id', potreeDataItemId, initialTime)
+        ids.append(('POTREE_DATA_ITEM_PC', potreeDataItemId))
+    return ids
 
 def addNEXDataItem(absPath, itemId, dataItemType):
     if dataItemType != MESH_FT:
-        logging.error('Skipping ' + sAbsPath + '. Only Nexus meshes are added')
+        logging.error('Skipping ' + absPath + '. Only Nexus meshes are added')
         return
     
     rawAbsPath = absPath.replace(NEX_FT, RAW_FT)
-    dbExecute(cursor, 'SELECT raw_data_item_id FROM RAW_DATA_ITEM WHERE abs_path = %s', [rawAbsPath,])
-    row = cursor.fetchone()
+    row = dbIndex['RAW_DATA_ITEM'].get(rawAbsPath)
     if row == None:
         logging.error('Skipping ' + absPath + '. None related RAW data item found in ' + rawAbsPath)
         return
     rawDataItemId = row[0]
     
     modTime = getCurrentTime(getLastModification(absPath))
-    dbExecute(cursor, 'SELECT nexus_data_item_mesh_id, last_mod FROM NEXUS_DATA_ITEM_MESH WHERE abs_path = %s', [absPath,])
-    row = cursor.fetchone()
+    row = dbIndex['NEXUS_DATA_ITEM_MESH'].get(absPath)
     if row == None: #This folder has been added recently
-        dbExecute(cursor, "INSERT INTO NEXUS_DATA_ITEM_MESH (nexus_data_item_mesh_id, raw_data_item_id, abs_path, last_mod, last_check) VALUES (DEFAULT,%s,%s,%s,%s)", 
-                [rawDataItemId, absPath, modTime, initialTime])
+        nexusDataItemId = uow.nextId('NEXUS_DATA_ITEM_MESH', 'nexus_data_item_mesh_id')
+        uow.insert('NEXUS_DATA_ITEM_MESH', ('nexus_data_item_mesh_id', 'raw_data_item_id', 'abs_path', 'last_mod', 'last_check'), 
+                   [nexusDataItemId, rawDataItemId, absPath, modTime, initialTime])
+        dbIndex['NEXUS_DATA_ITEM_MESH'][absPath] = (nexusDataItemId, modTime)
     else:
         (nexusDataItemId, lastModDB) = row
         if modTime > lastModDB: #Data has changed
             logging.warn('NEXUS data item in ' + absPath + ' may have been updated and it may not be reflected in the DB.')
-        dbExecute(cursor, 'UPDATE NEXUS_DATA_ITEM_MESH SET last_check=%s WHERE nexus_data_item_mesh_id = %s', [initialTime, nexusDataItemId])
+        uow.touch('NEXUS_DATA_ITEM_MESH', 'nexus_data_item_mesh_id', nexusDataItemId, initialTime)
+    return [('NEXUS_DATA_ITEM_MESH', nexusDataItemId),]
 
 
 def argument_parser():
@@ -603,6 +746,12 @@ def argument_parser():
     parser.add_argument('-p','--dbpass',default='',help='DB pass',type=str)
     parser.add_argument('-b','--dbhost',default='',help='DB host',type=str)
     parser.add_argument('-r','--dbport',default='',help='DB port',type=str)
+    parser.add_argument('-w','--workers',default=DEFAULT_WORKERS,help='Number of worker processes used to process the sites folders in parallel, each with its own DB connection [default ' + str(DEFAULT_WORKERS) + ']',type=int)
+    parser.add_argument('--batch',default=DEFAULT_BATCH_SIZE,help='Number of data items whose DB changes are written in a single transaction [default ' + str(DEFAULT_BATCH_SIZE) + ']',type=int)
+    parser.add_argument('--incremental',default=False,help='Incremental mode: only the folders and data items whose modification time, size or inode have changed since the previous run (as recorded in the manifest) are visited [default False]',action='store_true')
+    parser.add_argument('--manifest',default='',help='Manifest file used in incremental mode [default is ' + MANIFEST_FILE_NAME + ' in the data folder]',type=str)
+    parser.add_argument('--dryrun',default=False,help='Only report the DB entries of removed data items that would be deleted in the cleaning, without deleting them [default False]',action='store_true')
+    parser.add_argument('--scanthreads',default=las_utils.DEFAULT_SCAN_THREADS,help='Number of threads used to read the headers of the LAS/LAZ files of a point cloud [default ' + str(las_utils.DEFAULT_SCAN_THREADS) + ']',type=int)
     parser.add_argument('--log', help='Log level', choices=LOG_LEVELS_LIST, default=DEFAULT_LOG_LEVEL)
     return parser
 
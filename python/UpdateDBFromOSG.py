@@ -7,70 +7,154 @@
 # Last modified:
 # Changes:
 # Notes:            Based on updateconfigxml.py from ViaAppia project
+#                   * The XML is read with iterparse (only the background, 
+#                     the active objects with status and the cameras)
+#                   * The changes are compared in memory with the OSG
+#                     locations in the DB and only the modified rows are
+#                     written, in a single transaction
+#                   * The hashes of the imported active objects and cameras
+#                     are stored and in diff mode the ones that did not 
+#                     change since the last import are skipped
 ##############################################################################
 
-import os, time, argparse, psycopg2, utils, logging
+import os, time, argparse, psycopg2, utils, logging, hashlib, collections
 from lxml import etree as ET
 from numpy import array as nparray
 
-def insertDB(cursor, tableName, names, values, returnColumn = None):
-    """ Generic method to insert a row in a table"""
-    try:
-        auxs = []
-        for i in range(len(names)):
-            auxs.append('%s')
-        insertStatement = 'INSERT INTO ' + tableName + ' (' + ','.join(names) +') VALUES (' + ','.join(auxs) + ')'
-        insertValues = values[:]
-        if returnColumn != None:
-            insertStatement += ' RETURNING ' + returnColumn
-        utils.dbExecute(cursor, insertStatement, insertValues)
-        if returnColumn != None:
-            return cursor.fetchone()[0]
-        else:
-            return None
-    except Exception as e:
-        cursor.connection.rollback()
-        msg = 'Could not do insert in table ' + tableName + ' ' + str(names) + ' = ' + str(values)
-        print msg
-        logging.error(msg)
-        return None
+# Tolerance used to compare the coordinates and angles of the XML and the DB
+LOCATION_TOLERANCE = 1e-4
+# Columns of OSG_LABEL and the related attributes of the label active objects
+LABEL_COLUMNS = ('text', 'red', 'green', 'blue', 'rotate_screen', 'outline', 'font')
+LABEL_ATTRIBUTES = ('labelText', 'labelColorRed', 'labelColorGreen', 'labelColorBlue', 'labelRotateScreen', 'outline', 'Font')
+# Kinds of the entries of the snapshot of the last imported configuration
+SNAPSHOT_ACTIVE_OBJECT = 'activeObject'
+SNAPSHOT_CAMERA = 'camera'
+# Counters of the changeset summary
+CHANGESET_KEYS = ('new active objects', 'updated active objects', 'deleted active objects', 'ignored active objects', 'unchanged active objects', 
+                  'new cameras', 'updated cameras', 'deleted cameras', 'unchanged cameras')
+
+def getHash(attributes, settingAttributes = None):
+    """ Get the hash of the attributes of an active object (including its 
+    status and the attributes of its setting) or of a camera"""
+    h = hashlib.md5()
+    for element in (attributes, settingAttributes or {}):
+        for name in sorted(element):
+            h.update(name + '=' + element[name].encode('utf-8') + ';')
+        h.update('|')
+    return h.hexdigest()
+
+def getSnapshot(cursor):
+    """ Get the hashes of the last imported configuration as a dictionary 
+    (kind, uniqueName) -> hash"""
+    rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT kind, unique_name, hash FROM OSG_CONFIG_SNAPSHOT')
+    return dict([((kind, uniqueName), h) for (kind, uniqueName, h) in rows])
 
-def getBackgroundOffset(data, cursor):
+def updateSnapshot(uow, snapshot, hashes):
+    """ Replace the snapshot in the DB by the hashes of the imported 
+    configuration, only the entries that differ are written"""
+    for key in snapshot:
+        if snapshot[key] != hashes.get(key):
+            uow.delete('OSG_CONFIG_SNAPSHOT', ('kind', 'unique_name'), key)
+    for key in hashes:
+        if snapshot.get(key) != hashes[key]:
+            uow.insert('OSG_CONFIG_SNAPSHOT', ('kind', 'unique_name', 'hash'), key + (hashes[key],))
+
+def readConfig(configPath):
+    """ Reads the XML configuration file with iterparse and gets only the URLs
+    of the static objects, the active objects with status (as tuples
+    (status, uniqueName, attributes, settingAttributes)) and the attributes of
+    the not default cameras. The parsed elements are freed as they are read"""
+    staticObjectsUrls = []
+    activeObjects = []
+    cameras = []
+    for (event, element) in ET.iterparse(configPath, events=('end',), tag=('staticObject', 'camera', 'activeObject')):
+        if element.tag == 'staticObject':
+            staticObjectsUrls.append(element.get('url'))
+        elif element.tag == 'camera':
+            if not element.get('name').startswith(utils.DEFAULT_CAMERA_PREFIX):
+                cameras.append(dict(element.attrib))
+        elif element.get('status') != None:
+            settingAttributes = None
+            if len(element):
+                settingAttributes = dict(element[0].attrib)
+            activeObjects.append((element.get('status'), element.get('uniqueName'), dict(element.attrib), settingAttributes))
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return (staticObjectsUrls, activeObjects, cameras)
+
+def getBackgroundOffset(cursor, staticObjectsUrls):
     ''' Get the offset and srid for the background used in the conf.xml file  '''
-    staticobj = [os.path.dirname(x.get('url')) for x in
-                 data.xpath('//staticObject')]
+    staticobj = [os.path.dirname(x) for x in staticObjectsUrls]
     matching = [s for s in staticobj if 'PC/BACK/' in s]
     if len(matching) != 1:
         raise Exception('More than 1 background detected in xml file')
     else:
         rows, numitems = utils.fetchDataFromDB(cursor, """
-SELECT offset_x, offset_y, offset_z, srid 
+SELECT offset_x, offset_y, offset_z, srid
 FROM OSG_DATA_ITEM_PC_BACKGROUND INNER JOIN RAW_DATA_ITEM USING (raw_data_item_id)
-WHERE OSG_DATA_ITEM_PC_BACKGROUND.abs_path=%s""", 
+WHERE OSG_DATA_ITEM_PC_BACKGROUND.abs_path=%s""",
 [os.path.join(utils.DEFAULT_DATA_DIR,utils.DEFAULT_OSG_DATA_DIR,matching[0])])
     return rows[0]
 
-def getOSGLocationId(cursor, aoType, labelName = None, itemId = None, objectId = None, rawDataItemId = None):
-    ''' Function to get OSG location id of an Active Object related DB entry '''
-    if aoType == utils.AO_TYPE_OBJ:
-        if (itemId == None) or (objectId == None):
-            raise Exception ('Item Object operations require not null itemId and objectId')
-        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT osg_location_id FROM OSG_ITEM_OBJECT WHERE item_id = %s AND object_number = %s', [itemId, objectId])
-    elif aoType == utils.AO_TYPE_LAB:
-        if labelName == None:
-            raise Exception ('Label operations require not null labelName')
-        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT osg_location_id FROM OSG_LABEL WHERE osg_label_name = %s', [labelName,])
-    else:
-        if rawDataItemId == None:
-            raise Exception ('Raw data item operations require not null rawDataItemId')
-        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT osg_location_id FROM ((SELECT * FROM OSG_DATA_ITEM_PC_SITE) UNION (SELECT * FROM OSG_DATA_ITEM_MESH) UNION (SELECT * FROM OSG_DATA_ITEM_PICTURE)) A JOIN OSG_DATA_ITEM USING (osg_data_item_id) WHERE raw_data_item_id = %s', [rawDataItemId, ])
-    if num_rows == 0:
+class DBState(object):
+    """ In-memory copy of the OSG locations of the active objects and cameras
+    in the DB. It is loaded with a few queries and it is kept up to date with
+    the changes added to the unit of work"""
+    def __init__(self, cursor):
+        # OSG locations by osg_location_id as dictionaries column -> value
+        self.locations = {}
+        columns = ('srid', 'x', 'y', 'z', 'xs', 'ys', 'zs', 'h', 'p', 'r', 'cast_shadow')
+        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT osg_location_id, ' + ','.join(columns) + ' FROM OSG_LOCATION')
+        for row in rows:
+            self.locations[row[0]] = dict(zip(columns, row[1:]))
+        # Type, item_id, raw_data_item_id and osg_location_id of the PCs,
+        # meshes and pictures by unique name
+        self.dataItems = {}
+        for (aoType, tableName) in ((utils.AO_TYPE_PC, 'OSG_DATA_ITEM_PC_SITE'), (utils.AO_TYPE_MESH, 'OSG_DATA_ITEM_MESH'), (utils.AO_TYPE_PIC, 'OSG_DATA_ITEM_PICTURE')):
+            rows, num_rows = utils.fetchDataFromDB(cursor, """
+SELECT raw_data_item_id, item_id, RAW_DATA_ITEM.abs_path, osg_location_id
+FROM """ + tableName + """ JOIN OSG_DATA_ITEM USING (osg_data_item_id) JOIN RAW_DATA_ITEM USING (raw_data_item_id)""")
+            for (rawDataItemId, itemId, absPath, osgLocationId) in rows:
+                uniqueName = utils.codeOSGActiveObjectUniqueName(cursor, aoType, rawDataItemId, itemId = itemId, absPath = absPath)
+                self.dataItems[uniqueName] = (aoType, itemId, rawDataItemId, osgLocationId)
+        # osg_location_id of the item objects (boundings) by (item_id, object_number)
+        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT item_id, object_number, osg_location_id FROM OSG_ITEM_OBJECT')
+        self.osgItemObjects = dict([((itemId, objectNumber), osgLocationId) for (itemId, objectNumber, osgLocationId) in rows])
+        # osg_location_id and values (in LABEL_COLUMNS order) of the labels by name
+        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT osg_label_name, osg_location_id, ' + ','.join(LABEL_COLUMNS) + ' FROM OSG_LABEL')
+        self.labels = dict([(row[0], (row[1], row[2:])) for row in rows])
+        # osg_location_id of the cameras by name
+        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT osg_camera_name, osg_location_id FROM OSG_CAMERA')
+        self.cameras = dict(rows)
+        # Items and item objects
+        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT item_id FROM ITEM')
+        self.items = set([row[0] for row in rows])
+        rows, num_rows = utils.fetchDataFromDB(cursor, 'SELECT item_id, object_number FROM ITEM_OBJECT')
+        self.itemObjects = set([tuple(row) for row in rows])
+
+    def decodeUniqueName(self, cursor, uniqueName):
+        """ Decodes the unique name, the DB is not queried if it is a PC, mesh
+        or picture in the DB"""
+        if uniqueName in self.dataItems:
+            (aoType, itemId, rawDataItemId, osgLocationId) = self.dataItems[uniqueName]
+            return (aoType, itemId, rawDataItemId, None, None)
+        return utils.decodeOSGActiveObjectUniqueName(cursor, uniqueName)
+
+    def getOSGLocationId(self, aoType, uniqueName, labelName = None, itemId = None, objectId = None):
+        ''' Get OSG location id of an Active Object related DB entry '''
+        if aoType == utils.AO_TYPE_OBJ:
+            return self.osgItemObjects.get((itemId, objectId))
+        elif aoType == utils.AO_TYPE_LAB:
+            if labelName in self.labels:
+                return self.labels[labelName][0]
+            return None
+        elif uniqueName in self.dataItems:
+            return self.dataItems[uniqueName][3]
         return None
-    else:
-        return rows[0][0]
-    
-def parseLocation(cursor, xml_element, bgSRID, bgOffset):
-    """ Get the names and values for a DB insert/update statement from a xml_element with location info (camera or setting)"""
+
+def parseLocation(xml_element, bgSRID, bgOffset):
+    """ Get the names and values for a DB insert/update statement from the attributes of a xml_element with location info (camera or setting)"""
     names = []
     values = []
     # Add srid
@@ -85,7 +169,7 @@ def parseLocation(cursor, xml_element, bgSRID, bgOffset):
     if 'castShadow' in xml_element.keys():
         names.append('cast_shadow')
         values.append(False if (xml_element.get('castShadow') == '0') else 1)
-    # Add the offset of the background in order to store absolute coordinates in the DB   
+    # Add the offset of the background in order to store absolute coordinates in the DB
     try:
         values[names.index('x')] += bgOffset[0]
         values[names.index('y')] += bgOffset[1]
@@ -94,44 +178,86 @@ def parseLocation(cursor, xml_element, bgSRID, bgOffset):
         logging.error('No location x,y,z found')
     return (names, values)
 
-def updateOSGLocation(cursor, osgLocationId, xml_element, bgSRID, bgOffset):
-    """ Update an OSG location by its osgLocationId"""
-    (names, values) = parseLocation(cursor, xml_element, bgSRID, bgOffset)
-    auxs = []
-    for i in range(len(values)):
-        auxs.append('%s')
-    utils.dbExecute(cursor, 'UPDATE OSG_LOCATION SET (' + ','.join(names) + ') = (' + ','.join(auxs) + ') WHERE osg_location_id = %s', values + [osgLocationId,]) 
+def isSameLocation(location, names, values):
+    """ Checks if the location in the DB (dictionary column -> value) has the
+    values in the columns names"""
+    for (name, value) in zip(names, values):
+        dbValue = location.get(name)
+        if name == 'cast_shadow':
+            if bool(dbValue) != bool(value):
+                return False
+        elif name == 'srid':
+            if dbValue != value:
+                return False
+        elif dbValue == None or abs(float(dbValue) - value) > LOCATION_TOLERANCE:
+            return False
+    return True
+
+def toBoolean(value):
+    if value == None or isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 't')
+
+def toFloat(value):
+    if value == None:
+        return value
+    return float(value)
+
+def normalizeLabel(values):
+    """ Normalize the label values (in LABEL_COLUMNS order) from the DB or the
+    XML to compare them"""
+    (text, red, green, blue, rotateScreen, outline, font) = values
+    return (text, toFloat(red), toFloat(green), toFloat(blue), toBoolean(rotateScreen), toBoolean(outline), font)
+
+def getLabelValues(ao):
+    """ Get the values of the OSG_LABEL columns from the label attributes"""
+    return [ao.get(attribute) for attribute in LABEL_ATTRIBUTES]
+
+def updateOSGLocation(uow, state, osgLocationId, xml_element, bgSRID, bgOffset):
+    """ Update an OSG location by its osgLocationId if it differs from the one
+    in the DB. Returns True if it is updated"""
+    (names, values) = parseLocation(xml_element, bgSRID, bgOffset)
+    location = state.locations.get(osgLocationId, {})
+    if isSameLocation(location, names, values):
+        return False
+    uow.update('OSG_LOCATION', 'osg_location_id', osgLocationId, names, values)
+    location.update(zip(names, values))
+    state.locations[osgLocationId] = location
+    return True
 
-def insertOSGLocation(cursor, xml_element, bgSRID, bgOffset):
+def insertOSGLocation(uow, state, xml_element, bgSRID, bgOffset):
     """Inserts a OSG location and returns a osgLocationId"""
-    (names, values) = parseLocation(cursor, xml_element, bgSRID, bgOffset)
-    return insertDB(cursor, 'OSG_LOCATION', names, values, returnColumn = 'osg_location_id')
-    
-def deleteOSG(cursor, aoType, labelName = None, itemId = None, objectId = None, rawDataItemId = None):
+    (names, values) = parseLocation(xml_element, bgSRID, bgOffset)
+    osgLocationId = uow.nextId('OSG_LOCATION', 'osg_location_id')
+    uow.insert('OSG_LOCATION', ['osg_location_id',] + names, [osgLocationId,] + values)
+    state.locations[osgLocationId] = dict(zip(names, values))
+    return osgLocationId
+
+def deleteOSG(uow, state, aoType, osgLocationId, labelName = None, itemId = None, objectId = None):
     ''' Function to delete a and OSG item objects or an OSG label (and their related OSG location entries) '''
     if aoType == utils.AO_TYPE_OBJ:
         if (itemId == None) or (objectId == None):
             raise Exception ('Item Object operations require not null itemId and objectId')
-        # extract osg_location_id of the object
-        data,rows = utils.fetchDataFromDB(cursor, 'SELECT osg_location_id FROM OSG_ITEM_OBJECT WHERE item_id = %s AND object_number = %s', [itemId, objectId])
-        utils.dbExecute(cursor, 'DELETE FROM OSG_ITEM_OBJECT WHERE item_id = %s AND object_number = %s', [itemId, objectId])
-        # delete from OSG_LOCATION
-        utils.dbExecute(cursor, 'DELETE FROM OSG_LOCATION WHERE osg_location_id = %s', [data[0][0],])
+        uow.delete('OSG_ITEM_OBJECT', ('item_id', 'object_number'), (itemId, objectId))
+        del state.osgItemObjects[(itemId, objectId)]
     elif aoType == utils.AO_TYPE_LAB:
         if labelName == None:
             raise Exception ('Label operations require not null labelName')
-        # extract osg_location_id of the label
-        data, rows = utils.fetchDataFromDB(cursor, 'SELECT osg_location_id FROM OSG_LABEL WHERE osg_label_name = %s', [labelName,])
-        # delete from OSG_LABEL
-        utils.dbExecute(cursor,'DELETE FROM OSG_LABEL WHERE osg_label_name = %s', [labelName,])
-        # delete from OSG_LOCATION
-        utils.dbExecute(cursor, 'DELETE FROM OSG_LOCATION WHERE osg_location_id = %s', [data[0][0],])
+        uow.delete('OSG_LABEL', ('osg_label_name',), (labelName,))
+        del state.labels[labelName]
     else:
         raise Exception('Not possible to delete object ' + labelName)
+    # delete from OSG_LOCATION
+    uow.delete('OSG_LOCATION', ('osg_location_id',), (osgLocationId,))
+    state.locations.pop(osgLocationId, None)
 
-def deleteCameras(cursor):
-    utils.dbExecute(cursor, 'DELETE FROM OSG_ITEM_CAMERA CASCADE')
-    utils.dbExecute(cursor, 'DELETE FROM OSG_CAMERA CASCADE')
+def deleteCamera(uow, state, name):
+    """ Deletes a camera (and its related OSG_ITEM_CAMERA and OSG location entries)"""
+    osgLocationId = state.cameras.pop(name)
+    uow.delete('OSG_ITEM_CAMERA', ('osg_camera_name',), (name,))
+    uow.delete('OSG_CAMERA', ('osg_camera_name',), (name,))
+    uow.delete('OSG_LOCATION', ('osg_location_id',), (osgLocationId,))
+    state.locations.pop(osgLocationId, None)
 
 def run(opts):
     # Define logging and start logging
@@ -143,148 +269,230 @@ def run(opts):
     print msg
     logging.info(msg)
 
-    # Parse xml configuration file
-    data = ET.parse(opts.config).getroot()
+    # Read the xml configuration file (only the background, the active objects with status and the cameras)
+    (staticObjectsUrls, activeObjects, cameras) = readConfig(opts.config)
 
     # Database connection
     connection, cursor = utils.connectToDB(opts.dbname, opts.dbuser, opts.dbpass, opts.dbhost, opts.dbport)
 
     # get offset and srid of the background defined in the conf file
-    (bgOffsetX, bgOffsetY, bgOffsetZ, bgSRID) = getBackgroundOffset(data, cursor)
+    (bgOffsetX, bgOffsetY, bgOffsetZ, bgSRID) = getBackgroundOffset(cursor, staticObjectsUrls)
     bgOffset = (bgOffsetX, bgOffsetY, bgOffsetZ)
+
+    # Get the current OSG locations from the DB. The changes are compared with
+    # them in memory and only the modified rows are written at the end in a
+    # single transaction
+    state = DBState(cursor)
+    # The ids of the new OSG locations are reserved as they are needed (not 
+    # in blocks) so the sequence values are not wasted
+    uow = utils.DBUnitOfWork(cursor, idsBlockSize = 1)
+    changeset = collections.Counter()
+
+    # Hashes of the active objects with status and of the cameras. In diff 
+    # mode the ones that did not change since the last imported configuration
+    # are skipped. Only the hashes of the applied (or unchanged) ones are 
+    # stored in the new snapshot, the ignored ones are processed again
+    snapshot = getSnapshot(cursor)
+    hashes = {}
+    applied = set()
+    for (status, uniqueName, ao, setting) in activeObjects:
+        hashes[(SNAPSHOT_ACTIVE_OBJECT, uniqueName)] = getHash(ao, setting)
+    for camera in cameras:
+        hashes[(SNAPSHOT_CAMERA, camera.get('name'))] = getHash(camera)
+    if opts.diff:
+        numActiveObjects = len(activeObjects)
+        applied.update(key for key in hashes if key[0] == SNAPSHOT_ACTIVE_OBJECT and hashes[key] == snapshot.get(key))
+        activeObjects = [(status, uniqueName, ao, setting) for (status, uniqueName, ao, setting) in activeObjects 
+                         if (SNAPSHOT_ACTIVE_OBJECT, uniqueName) not in applied]
+        changeset['unchanged active objects'] = numActiveObjects - len(activeObjects)
+
+    # Reserve at once the ids of the OSG locations of the new active objects 
+    # and cameras
+    uow.reserveIds('OSG_LOCATION', 'osg_location_id', 
+                   len([status for (status, uniqueName, ao, setting) in activeObjects if status == 'new']) + 
+                   len([camera for camera in cameras if camera.get('name') not in state.cameras]))
+
     # Process updates
-    updateAOS = data.xpath('//*[@status="updated"]')
     # loop over all updates found in the xml config file
-    for ao in updateAOS:
-        #(aoType, proto, uniqueName, siteId, activeobjectId, objectNumber) = \
-        #getDetails(ao)
-        uniqueName = ao.get('uniqueName')
-        (aoType, itemId, rawDataItemId, objectId, labelName) = utils.decodeOSGActiveObjectUniqueName(cursor, uniqueName)
+    for (status, uniqueName, ao, setting) in activeObjects:
+        if status != 'updated':
+            continue
+        (aoType, itemId, rawDataItemId, objectId, labelName) = state.decodeUniqueName(cursor, uniqueName)
         if aoType == None:
             msg = 'Ignoring operation on %s. Could not decode uniqueName' % uniqueName
             print msg
             logging.warning(msg)
+            changeset['ignored active objects'] += 1
         else:
             # check if the object is in the DB
-            osgLocationId = getOSGLocationId(cursor, aoType, labelName, itemId, objectId, rawDataItemId)
+            osgLocationId = state.getOSGLocationId(aoType, uniqueName, labelName, itemId, objectId)
             if osgLocationId != None:
                 # update the DB with the information in the xml config file
                 if aoType == utils.AO_TYPE_LAB:
                     # Some other params may have changed in the label
-                    msg = 'Updating label %s' % labelName
+                    updated = updateOSGLocation(uow, state, osgLocationId, setting, bgSRID, bgOffset)
+                    labelValues = getLabelValues(ao)
+                    if normalizeLabel(labelValues) != normalizeLabel(state.labels[labelName][1]):
+                        uow.update('OSG_LABEL', 'osg_label_name', labelName, LABEL_COLUMNS, labelValues)
+                        state.labels[labelName] = (osgLocationId, labelValues)
+                        updated = True
+                    if updated:
+                        msg = 'Updating label %s' % labelName
+                        print msg
+                        logging.info(msg)
+                        changeset['updated active objects'] += 1
+                    else:
+                        changeset['unchanged active objects'] += 1
+                elif updateOSGLocation(uow, state, osgLocationId, setting, bgSRID, bgOffset):
+                    msg = 'Updating OSG location %d from %s' % (osgLocationId, uniqueName)
                     print msg
                     logging.info(msg)
-                    deleteOSG(cursor, aoType, labelName)
-                    osgLocationId = insertOSGLocation(cursor, ao.getchildren()[0], bgSRID, bgOffset)
-                    insertDB(cursor, 'OSG_LABEL', ('osg_label_name', 'osg_location_id', 'text', 'red', 'green', 'blue', 'rotate_screen', 'outline', 'font'),
-                                 (labelName, osgLocationId, ao.get('labelText'),
-                                  ao.get('labelColorRed'), ao.get('labelColorGreen'), ao.get('labelColorBlue'),
-                                  ao.get('labelRotateScreen'), ao.get('outline'), ao.get('Font')))
+                    changeset['updated active objects'] += 1
                 else:
-                     msg = 'Updating OSG location %d from %s' % (osgLocationId, uniqueName)
-                     print msg
-                     logging.info(msg)
-                     updateOSGLocation(cursor, osgLocationId, ao.getchildren()[0], bgSRID, bgOffset)
+                    changeset['unchanged active objects'] += 1
+                applied.add((SNAPSHOT_ACTIVE_OBJECT, uniqueName))
             else:
-                if aoType == utils.AO_TYPE_OBJ:
+                if aoType == utils.AO_TYPE_OBJ and (itemId, objectId) in state.itemObjects:
                     # It is a bounding that has been moved and it is not currently in the DB. Let's insert it!
                     msg = 'Insert missing OSG_ITEM_OBJECT (%s,%s)' % (itemId, objectId)
                     print msg
                     logging.info(msg)
-                    osgLocationId = insertOSGLocation(cursor, ao.getchildren()[0], bgSRID, bgOffset)
-                    insertDB(cursor, 'OSG_ITEM_OBJECT', ('item_id', 'object_number', 'osg_location_id'), (itemId, objectId, osgLocationId))
+                    changeset['updated active objects'] += 1
+                    osgLocationId = insertOSGLocation(uow, state, setting, bgSRID, bgOffset)
+                    uow.insert('OSG_ITEM_OBJECT', ('item_id', 'object_number', 'osg_location_id'), (itemId, objectId, osgLocationId))
+                    state.osgItemObjects[(itemId, objectId)] = osgLocationId
+                    applied.add((SNAPSHOT_ACTIVE_OBJECT, uniqueName))
                 else:
                     # log error if object is not found in DB
                     msg = 'Update not possible. OSG_ITEM_OBJECT from %s not found in DB' % uniqueName
                     print msg
                     logging.error(msg)
+                    changeset['ignored active objects'] += 1
 
     # Process deletes (only possible for site objects)
-    deleteAOS = data.xpath('//*[@status="deleted"]')
     # loop over all deletes found in the xml config file
-    for ao in deleteAOS:
-        uniqueName = ao.get('uniqueName')
-        (aoType, itemId, rawDataItemId, objectId, labelName) =  utils.decodeOSGActiveObjectUniqueName(cursor, uniqueName)
+    for (status, uniqueName, ao, setting) in activeObjects:
+        if status != 'deleted':
+            continue
+        (aoType, itemId, rawDataItemId, objectId, labelName) = state.decodeUniqueName(cursor, uniqueName)
         if aoType==None:
             msg = 'Ignoring operation on %s. Could not decode uniqueName' % uniqueName
             print msg
             logging.warning(msg)
+            changeset['ignored active objects'] += 1
         else:
             if aoType in (utils.AO_TYPE_OBJ, utils.AO_TYPE_LAB):
                 # check if the object is in the DB
-                osgLocationId = getOSGLocationId(cursor, aoType, labelName, itemId, objectId)
+                osgLocationId = state.getOSGLocationId(aoType, uniqueName, labelName, itemId, objectId)
                 if osgLocationId != None:
                     # Delete the OSG-related entries from the DB
                     msg = 'Deleting OSG related entries for %s' % uniqueName
                     print msg
                     logging.info(msg)
-                    deleteOSG(cursor, aoType, labelName, itemId, objectId)
+                    changeset['deleted active objects'] += 1
+                    deleteOSG(uow, state, aoType, osgLocationId, labelName, itemId, objectId)
+                    applied.add((SNAPSHOT_ACTIVE_OBJECT, uniqueName))
                 else:
                     # log error if object is not found in DB
                     msg = 'Not possible to delete. OSG_ITEM_OBJECT from %s not found in DB. Maybe already deleted?' % uniqueName
                     print msg
                     logging.warning(msg)
+                    changeset['ignored active objects'] += 1
             else:
                 # log error if trying to delete a non-site object
                 msg = 'Ignoring delete in %s: Meshes, pictures and PCs can not be deleted' % uniqueName
                 print msg
                 logging.error(msg)
+                changeset['ignored active objects'] += 1
 
     # Process new objects (only possible for site objects)
-    newAOS = data.xpath('//*[@status="new"]')
     # loop over all new objects found in the xml config file
-    for ao in newAOS:
-        uniqueName = ao.get('uniqueName')
-        (aoType, itemId, rawDataItemId, objectId, labelName) = utils.decodeOSGActiveObjectUniqueName(cursor, uniqueName)
+    for (status, uniqueName, ao, setting) in activeObjects:
+        if status != 'new':
+            continue
+        (aoType, itemId, rawDataItemId, objectId, labelName) = state.decodeUniqueName(cursor, uniqueName)
         if aoType==None:
             msg = 'Ignoring operation on %s. Could not decode uniqueName' % uniqueName
             print msg
             logging.warning(msg)
+            changeset['ignored active objects'] += 1
         else:
             if aoType in (utils.AO_TYPE_OBJ, utils.AO_TYPE_LAB):
-                # check if the object is in the DBbesafe i
-                osgLocationId = getOSGLocationId(cursor, aoType, labelName, itemId, objectId)
+                # check if the object is in the DB
+                osgLocationId = state.getOSGLocationId(aoType, uniqueName, labelName, itemId, objectId)
                 if osgLocationId != None:
                     # log error if the new object is already in the DB
                     msg = 'OSG_ITEM_OBJECT from %s already in DB. Ignoring add' % uniqueName
                     print msg
                     logging.warning(msg)
+                    changeset['ignored active objects'] += 1
+                elif aoType == utils.AO_TYPE_OBJ and itemId not in state.items and objectId != utils.ITEM_OBJECT_NUMBER_ITEM:
+                    # log error if the object is of an item that is not in the DB
+                    msg = 'ITEM %s of %s not in DB. Ignoring add' % (itemId, uniqueName)
+                    print msg
+                    logging.error(msg)
+                    changeset['ignored active objects'] += 1
                 else:
-                    osgLocationId = insertOSGLocation(cursor, ao.getchildren()[0], bgSRID, bgOffset)
+                    osgLocationId = insertOSGLocation(uow, state, setting, bgSRID, bgOffset)
+                    changeset['new active objects'] += 1
                     if aoType == utils.AO_TYPE_OBJ:
                         # add object to the DB
-                        if objectId == utils.ITEM_OBJECT_NUMBER_ITEM:
-                            msg = 'Adding missing ITEM %s' % objectId
+                        if objectId == utils.ITEM_OBJECT_NUMBER_ITEM and itemId not in state.items:
+                            msg = 'Adding missing ITEM %s' % itemId
                             print msg
                             logging.info(msg)
-                            insertDB(cursor, 'ITEM', ('item_id', 'background'), (itemId, False))
-                        msg = 'Adding ITEM_OBJECT (%d,%d)' % (itemId, objectId)
-                        print msg
-                        logging.info(msg)
-                        insertDB(cursor, 'ITEM_OBJECT', ('item_id', 'object_number'), (itemId, objectId))
-                        insertDB(cursor, 'OSG_ITEM_OBJECT', ('item_id', 'object_number', 'osg_location_id'), (itemId, objectId, osgLocationId))
-                    else:                        
+                            uow.insert('ITEM', ('item_id', 'background'), (itemId, False))
+                            state.items.add(itemId)
+                        if (itemId, objectId) not in state.itemObjects:
+                            msg = 'Adding ITEM_OBJECT (%d,%d)' % (itemId, objectId)
+                            print msg
+                            logging.info(msg)
+                            uow.insert('ITEM_OBJECT', ('item_id', 'object_number'), (itemId, objectId))
+                            state.itemObjects.add((itemId, objectId))
+                        uow.insert('OSG_ITEM_OBJECT', ('item_id', 'object_number', 'osg_location_id'), (itemId, objectId, osgLocationId))
+                        state.osgItemObjects[(itemId, objectId)] = osgLocationId
+                    else:
                         # add label to the DB
                         msg = 'Adding label %s' % uniqueName
                         print msg
                         logging.info(msg)
-                        insertDB(cursor, 'OSG_LABEL', ('osg_label_name', 'osg_location_id', 'text', 'red', 'green', 'blue', 'rotate_screen', 'outline', 'font'), 
-                                 (labelName, osgLocationId, ao.get('labelText'), 
-                                  ao.get('labelColorRed'), ao.get('labelColorGreen'), ao.get('labelColorBlue'), 
-                                  ao.get('labelRotateScreen'), ao.get('outline'), ao.get('Font')))
+                        labelValues = getLabelValues(ao)
+                        uow.insert('OSG_LABEL', ('osg_label_name', 'osg_location_id') + LABEL_COLUMNS, [labelName, osgLocationId] + labelValues)
+                        state.labels[labelName] = (osgLocationId, labelValues)
+                    applied.add((SNAPSHOT_ACTIVE_OBJECT, uniqueName))
             else:
                 # log error if trying to add a non-site object
                 msg = 'Ignoring new in %s: Meshes, pictures and PCs can not be added' % uniqueName
                 print msg
                 logging.error(msg)
+                changeset['ignored active objects'] += 1
 
     # Process the cameras (the DEF CAMs are added for all objects and can not be deleted or updated)
-    cameras = data.xpath('//camera[not(starts-with(@name,"' + utils.DEFAULT_CAMERA_PREFIX + '"))]')
-    # Delete all previous cameras and related entries
-    deleteCameras(cursor)
-    # add all cameras
+    # Delete the cameras that are not in the xml config file anymore
+    cameraNames = set([camera.get('name') for camera in cameras])
+    for name in sorted(state.cameras):
+        if name not in cameraNames:
+            msg = 'Deleting camera %s' % name
+            print msg
+            logging.info(msg)
+            changeset['deleted cameras'] += 1
+            deleteCamera(uow, state, name)
+    # add the new cameras and update the moved ones
     for camera in cameras:
         name = camera.get('name')
+        applied.add((SNAPSHOT_CAMERA, name))
+        if opts.diff and name in state.cameras and hashes[(SNAPSHOT_CAMERA, name)] == snapshot.get((SNAPSHOT_CAMERA, name)):
+            changeset['unchanged cameras'] += 1
+            continue
+        if name in state.cameras:
+            if updateOSGLocation(uow, state, state.cameras[name], camera, bgSRID, bgOffset):
+                msg = 'Updating camera %s' % name
+                print msg
+                logging.info(msg)
+                changeset['updated cameras'] += 1
+            else:
+                changeset['unchanged cameras'] += 1
+            continue
         itemId = None
         if name.count(utils.USER_CAMERA):
             try:
@@ -297,13 +505,25 @@ def run(opts):
         msg = 'Adding camera %s' % name
         print msg
         logging.info(msg)
-        osgLocationId = insertOSGLocation(cursor, camera, bgSRID, bgOffset)
-        insertDB(cursor, 'OSG_CAMERA', ('osg_camera_name', 'osg_location_id'), (name, osgLocationId))
-        if itemId != None:
-            insertDB(cursor, 'OSG_ITEM_CAMERA', ('item_id', 'osg_camera_name'), (itemId, name))
+        changeset['new cameras'] += 1
+        osgLocationId = insertOSGLocation(uow, state, camera, bgSRID, bgOffset)
+        uow.insert('OSG_CAMERA', ('osg_camera_name', 'osg_location_id'), (name, osgLocationId))
+        state.cameras[name] = osgLocationId
+        if itemId != None and itemId in state.items:
+            uow.insert('OSG_ITEM_CAMERA', ('item_id', 'osg_camera_name'), (itemId, name))
+
+    # Write all the changes (and the new snapshot) in a single transaction
+    updateSnapshot(uow, snapshot, dict((key, hashes[key]) for key in hashes if key in applied))
+    uow.flush()
+    
+    # Changeset summary
+    msg = 'Changeset: ' + ', '.join(['%d %s' % (changeset[key], key) for key in CHANGESET_KEYS])
+    print msg
+    logging.info(msg)
+
     # close DB connection
     utils.closeConnectionDB(connection, cursor)
-    
+
     elapsed_time = time.time() - t0
     msg = 'Finished. Total elapsed time: %.02f seconds. See %s' % (elapsed_time, logname)
     print(msg)
@@ -329,6 +549,9 @@ def argument_parser():
                         action='store')
     parser.add_argument('-r', '--dbport', default='', help='DB port',
                         action='store')
+    parser.add_argument('--diff', default=False,
+                        help='Only process the active objects and cameras that changed since the last imported configuration (their hashes are stored in the OSG_CONFIG_SNAPSHOT table) [default is to process all the active objects with status and all the cameras]',
+                        action='store_true')
     parser.add_argument('-l', '--log', help='Log level',
                         choices=utils.LOG_LEVELS_LIST,
                         default=utils.DEFAULT_LOG_LEVEL)
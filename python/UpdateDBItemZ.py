@@ -8,13 +8,72 @@
 # Modifications:   
 # Notes:            
 ################################################################################
-import os, argparse, utils, time, logging, multiprocessing
+import os, argparse, utils, las_utils, time, logging, multiprocessing
 import GetItemLAS
 
 BUFFER = 2
 CONCAVE = 0.9
+# Percentiles of the Z of the points stored in ITEM_Z_STATS
+LOW_PERCENTILE = 1
+MEDIAN_PERCENTILE = 50
+HIGH_PERCENTILE = 99
+# Status of the jobs in ITEM_Z_JOB
+STATUS_OK = 'OK'
+STATUS_NODATA = 'NODATA'
+STATUS_ERROR = 'ERROR'
 
-def runChild(procIndex, itemsQueue, resultsQueue, lasFolder, dbname, dbuser, dbpass, dbhost, dbport):
+def getItemsCosts(cursor, itemIds, lasFolder):
+    """ Get the estimated cost of the job of each item, i.e. the estimated 
+    number of points in its footprint (from the tiles of the LAS folder in 
+    RAW_DATA_ITEM_PC_TILE, assuming uniform density in each tile) and the area 
+    of its footprint (used if the tiles are not in the DB). 
+    Returns a dictionary itemId -> (numPoints, area)"""
+    query = """
+SELECT 
+    I.item_id, 
+    COALESCE(SUM(T.number_points * 
+        (LEAST(T.maxx, ST_XMax(I.geom)) - GREATEST(T.minx, ST_XMin(I.geom))) * 
+        (LEAST(T.maxy, ST_YMax(I.geom)) - GREATEST(T.miny, ST_YMin(I.geom))) / 
+        NULLIF((T.maxx - T.minx) * (T.maxy - T.miny), 0)), 0), 
+    COALESCE(ST_Area(I.geom), 0) 
+FROM 
+    ITEM I LEFT JOIN (RAW_DATA_ITEM_PC_TILE T JOIN RAW_DATA_ITEM R ON T.raw_data_item_id = R.raw_data_item_id AND R.abs_path = %s) 
+    ON I.geom IS NOT NULL AND ST_MakeEnvelope(T.minx, T.miny, T.maxx, T.maxy) && ST_MakeEnvelope(ST_XMin(I.geom), ST_YMin(I.geom), ST_XMax(I.geom), ST_YMax(I.geom)) 
+WHERE I.item_id = ANY(%s) 
+GROUP BY I.item_id"""
+    rows, num = utils.fetchDataFromDB(cursor, query, [os.path.abspath(lasFolder), itemIds])
+    costs = {}
+    for (itemId, numPoints, area) in rows:
+        costs[itemId] = (float(numPoints), float(area))
+    return costs
+
+def getCompletedItems(cursor, lasFolder):
+    """ Get the items whose last job with the LAS folder was successful"""
+    rows, num = utils.fetchDataFromDB(cursor, 'SELECT item_id FROM ITEM_Z_JOB WHERE status = %s AND las_folder = %s', [STATUS_OK, os.path.abspath(lasFolder)])
+    return set([row[0] for row in rows])
+
+def updateItemZJob(cursor, itemId, lasFolder, status, cost, numPoints, elapsed, message):
+    """ Update the summary of the job of an item"""
+    cursor.execute('DELETE FROM ITEM_Z_JOB WHERE item_id = %s', [itemId,])
+    cursor.execute('INSERT INTO ITEM_Z_JOB (item_id, las_folder, status, cost, number_points, elapsed, message, last_run) VALUES (%s,%s,%s,%s,%s,%s,%s,%s)', 
+                   [itemId, os.path.abspath(lasFolder), status, cost, numPoints, elapsed, message, utils.getCurrentTime()])
+    cursor.connection.commit()
+
+def updateItemZ(cursor, itemId, minZ, maxZ, zStats):
+    """ Update the minimum and maximum Z of the item and its robust Z 
+    statistics (if they have been computed) in a single transaction. The 
+    previous statistics are always removed, they would not match the new 
+    minimum and maximum Z"""
+    cursor.execute("UPDATE ITEM SET (min_z,max_z) = (%s,%s) WHERE item_id = %s", [minZ, maxZ, itemId])
+    cursor.execute('DELETE FROM ITEM_Z_STATS WHERE item_id = %s', [itemId,])
+    if zStats.numberPoints:
+        (histogramMinZ, histogramBinSize, histogram) = zStats.compactHistogram()
+        cursor.execute('INSERT INTO ITEM_Z_STATS (item_id, number_points, min_z, max_z, avg_z, p1_z, p50_z, p99_z, histogram_min_z, histogram_bin_size, histogram) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)', 
+                       [itemId, zStats.numberPoints, zStats.min, zStats.max, zStats.average(), zStats.percentile(LOW_PERCENTILE), 
+                        zStats.percentile(MEDIAN_PERCENTILE), zStats.percentile(HIGH_PERCENTILE), histogramMinZ, histogramBinSize, histogram])
+    cursor.connection.commit()
+
+def runChild(procIndex, itemsQueue, resultsQueue, lasFolder, engine, dbname, dbuser, dbpass, dbhost, dbport):
     connection, cursor = utils.connectToDB(dbname, dbuser, dbpass, dbhost, dbport) 
     kill_received = False
     while not kill_received:
@@ -31,23 +90,25 @@ def runChild(procIndex, itemsQueue, resultsQueue, lasFolder, dbname, dbuser, dbp
             kill_received = True
         else:            
             logging.info('PROC%d: Getting minimum and maximum Z for item %d' % (procIndex,itemId))
-            outputFile = 'temp_%03d.las' % itemId 
+            t0 = time.time()
+            zStats = las_utils.ZStats()
+            (status, numpoints, message) = (STATUS_NODATA, None, None)
             try:
-                (returnOk, vertices, minZ, maxZ, avgZ, numpoints) = GetItemLAS.create_cut_out(cursor, lasFolder, outputFile, itemId, BUFFER, CONCAVE)
-            
-                # We do not need the cutout
-                if os.path.isfile(outputFile):
-                    os.remove(outputFile)
-            
+                # The statistics are computed directly from the LAS files (we do not need the cutout)
+                (returnOk, vertices, minZ, maxZ, avgZ, numpoints) = GetItemLAS.create_cut_out(cursor, lasFolder, None, itemId, BUFFER, CONCAVE, engine, zStats = zStats)
+                
                 if returnOk:
                     logging.info('PROC%d: Updating DB minimum and maximum Z for item %d' % (procIndex,itemId))
-                    utils.dbExecute(cursor, "UPDATE ITEM SET (min_z,max_z) = (%s,%s) WHERE item_id = %s", 
-                                    [minZ, maxZ, itemId])
+                    updateItemZ(cursor, itemId, minZ, maxZ, zStats)
+                    status = STATUS_OK
+                else:
+                    message = 'Cutout could not be extracted (see log)'
             except Exception, e:
                 connection.rollback()
                 logging.error('PROC%d: Can not update minimum and maximum Z for item %d' % (procIndex,itemId))
                 logging.error(e)
-            resultsQueue.put((procIndex, itemId))   
+                (status, message) = (STATUS_ERROR, str(e))
+            resultsQueue.put((procIndex, itemId, status, numpoints, time.time() - t0, message))
     utils.closeConnectionDB(connection, cursor)
 
 def run(args): 
@@ -70,9 +131,18 @@ def run(args):
         for (itemId,) in data:
             itemIds.append(itemId)
     else:
-        itemIds = args.itemid.split(',')
-        
-    # close the conection to the DB
+        itemIds = [int(itemId) for itemId in args.itemid.split(',')]
+    
+    if args.resume:
+        completedItemIds = getCompletedItems(cursor, args.las)
+        itemIds = [itemId for itemId in itemIds if itemId not in completedItemIds]
+        logging.info('Resuming: %d items were already completed' % len(completedItemIds))
+    
+    # The largest jobs go first so they do not leave the other cores idle at the end
+    costs = getItemsCosts(cursor, itemIds, args.las)
+    itemIds.sort(key = lambda itemId: costs.get(itemId, (0., 0.)), reverse = True)
+    
+    # close the conection to the DB (the workers are forked)
     utils.closeConnectionDB(connection, cursor)
     
     # Create queues
@@ -80,7 +150,7 @@ def run(args):
     resultsQueue = multiprocessing.Queue() # The queue of results
     
     for itemId in itemIds:
-        itemsQueue.put(int(itemId))
+        itemsQueue.put(itemId)
     for i in range(args.cores): #we add as many None jobs as numUsers to tell them to terminate (queue is FIFO)
         itemsQueue.put(None)
     
@@ -88,15 +158,28 @@ def run(args):
     # We start numUsers users processes
     for i in range(args.cores):
         procs.append(multiprocessing.Process(target=runChild, 
-            args=(i, itemsQueue, resultsQueue, args.las, args.dbname, args.dbuser, args.dbpass, args.dbhost, args.dbport)))
+            args=(i, itemsQueue, resultsQueue, args.las, args.engine, args.dbname, args.dbuser, args.dbpass, args.dbhost, args.dbport)))
         procs[-1].start()
     
+    # Collect the results in the summary table as they arrive
+    connection, cursor = utils.connectToDB(args.dbname, args.dbuser, args.dbpass, args.dbhost, args.dbport) 
+    statusCounts = {}
     for i in range(len(itemIds)):
-        [procIndex, itemId] = resultsQueue.get()
+        (procIndex, itemId, status, numpoints, elapsed, message) = resultsQueue.get()
+        logging.info('PROC%d: Item %d finished with status %s in %.2f seconds' % (procIndex, itemId, status, elapsed))
+        updateItemZJob(cursor, itemId, args.las, status, costs.get(itemId, (None,))[0], numpoints, elapsed, message)
+        statusCounts[status] = statusCounts.get(status, 0) + 1
     # wait for all users to finish their execution
     for i in range(args.cores):
         procs[i].join()
     
+    # close the conection to the DB
+    utils.closeConnectionDB(connection, cursor)
+    
+    msg = 'Processed %d items: ' % len(itemIds) + ', '.join(['%d %s' % (statusCounts[status], status) for status in sorted(statusCounts)])
+    print msg
+    logging.info(msg)
+    
     # measure elapsed time
     elapsed_time = time.time() - t0    
     msg = 'Finished. Total elapsed time: %.02f seconds. See %s' % (elapsed_time, logname)
@@ -115,6 +198,8 @@ def argument_parser():
     parser.add_argument('-t','--dbhost',default='',help='DB host',type=str, required=False)
     parser.add_argument('-r','--dbport',default='',help='DB port',type=str, required=False)
     parser.add_argument('-c','--cores',default=1,help='Number of cores to use [default 1]',type=int, required=False)    
+    parser.add_argument('--resume',default=False,help='Skip the items whose last job with the same LAS folder was successful (see ITEM_Z_JOB table) [default False]',action='store_true')
+    parser.add_argument('-e','--engine',default=GetItemLAS.DEFAULT_ENGINE,help='Cut-out engine. With native engine the Z statistics (including the percentiles and histograms stored in ITEM_Z_STATS) are computed from the LAS files without writing the cutouts, LAZ files are always processed with lastools [default ' + GetItemLAS.DEFAULT_ENGINE + ']',choices=GetItemLAS.ENGINES, required=False)
     return parser
 
 if __name__ == '__main__':
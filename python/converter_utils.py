@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Utilities shared by the converters (GenerateOSG,
+#                   GeneratePOTree and GenerateNexus)
+# Notes:            * Content-hash based cache of the converted outputs. The
+#                     key of a conversion is the hash of the content of the
+#                     input files and of the converter command line (without
+#                     the paths of the input and output folders)
+#                   * The outputs are hardlinked (or copied if not possible)
+#                     from/to the cache folder
+#                   * Supervised execution of the converters: the output is
+#                     streamed to the log file, the progress is reported and
+#                     wall-clock and memory limits are enforced
+#                   * Admission control of concurrent conversions from their
+#                     estimated memory and CPU cost
+##############################################################################
+
+import os, re, time, shutil, hashlib, logging, tempfile, subprocess, threading, signal
+import utils
+
+DEFAULT_CACHE_DIR = utils.DEFAULT_DATA_DIR + '/CACHE'
+# Sub-folders of the cache folder
+CACHE_OUTPUTS_DIR = 'OUTPUTS'
+CACHE_HASHES_DIR = 'HASHES'
+HASH_BLOCK_SIZE = 1024 * 1024
+# Converter supervision: the lines of the converters output with a percentage
+# are progress lines and the memory of the converters is checked every 
+# POLL_INTERVAL seconds
+DEFAULT_PROGRESS_REGEX = r'(\d+(?:\.\d+)?)\s*%'
+POLL_INTERVAL = 1.
+
+def hashFile(absPath):
+    """ Get the SHA1 hash of the content of a file"""
+    h = hashlib.sha1()
+    f = open(absPath, 'rb')
+    try:
+        block = f.read(HASH_BLOCK_SIZE)
+        while block:
+            h.update(block)
+            block = f.read(HASH_BLOCK_SIZE)
+    finally:
+        f.close()
+    return h.hexdigest()
+
+def getFileHash(cacheDir, absPath):
+    """ Get the SHA1 hash of the content of a file. The hash is stored in the
+    cache folder together with the size, modification time and inode of the
+    file, so it is only recomputed when the file changes"""
+    st = os.stat(absPath)
+    stamp = '%d %d %d' % (st.st_size, int(st.st_mtime), st.st_ino)
+    hashAbsPath = os.path.join(cacheDir, CACHE_HASHES_DIR, hashlib.sha1(os.path.abspath(absPath)).hexdigest())
+    if os.path.isfile(hashAbsPath):
+        (storedStamp, storedHash) = open(hashAbsPath, 'r').read().strip().rsplit(' ', 1)
+        if storedStamp == stamp:
+            return storedHash
+    fileHash = hashFile(absPath)
+    if not os.path.isdir(os.path.dirname(hashAbsPath)):
+        try:
+            os.makedirs(os.path.dirname(hashAbsPath))
+        except OSError:
+            pass # created by another converter
+    (fd, tempAbsPath) = tempfile.mkstemp(dir = os.path.dirname(hashAbsPath))
+    os.write(fd, stamp + ' ' + fileHash + '\n')
+    os.close(fd)
+    os.rename(tempAbsPath, hashAbsPath)
+    return fileHash
+
+def getCacheKey(cacheDir, inputFiles, command):
+    """ Get the cache key of a conversion from the content of its input files
+    and the converter command line (which must not contain the paths of the
+    input and output folders)"""
+    h = hashlib.sha1(command)
+    for inputFile in sorted(inputFiles, key = os.path.basename):
+        h.update('\n' + os.path.basename(inputFile) + ' ' + getFileHash(cacheDir, inputFile))
+    return h.hexdigest()
+
+def linkTree(srcAbsPath, dstAbsPath):
+    """ Replicate the content of the srcAbsPath folder into the dstAbsPath
+    folder (which must exist) using hardlinks (or copies if hardlinks are not
+    possible, i.e. in different file systems)"""
+    for name in os.listdir(srcAbsPath):
+        src = os.path.join(srcAbsPath, name)
+        dst = os.path.join(dstAbsPath, name)
+        if os.path.isdir(src):
+            os.mkdir(dst)
+            linkTree(src, dst)
+        else:
+            try:
+                os.link(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+
+def getCacheOutputAbsPath(cacheDir, cacheKey):
+    return os.path.join(cacheDir, CACHE_OUTPUTS_DIR, cacheKey[:2], cacheKey)
+
+def fetchFromCache(cacheDir, cacheKey, outFolder):
+    """ If the conversion is in the cache its output is replicated in outFolder.
+    Returns True if it was found in the cache"""
+    cacheAbsPath = getCacheOutputAbsPath(cacheDir, cacheKey)
+    if not os.path.isdir(cacheAbsPath):
+        return False
+    logging.info('Using cached conversion ' + cacheKey + ' for ' + outFolder)
+    linkTree(cacheAbsPath, outFolder)
+    return True
+
+def storeInCache(cacheDir, cacheKey, outFolder):
+    """ Stores the output of a conversion (the content of outFolder) in the
+    cache. It is first replicated in a temporal folder which is then renamed
+    so the cache never contains partial outputs"""
+    cacheAbsPath = getCacheOutputAbsPath(cacheDir, cacheKey)
+    if os.path.isdir(cacheAbsPath):
+        return
+    parentAbsPath = os.path.dirname(cacheAbsPath)
+    if not os.path.isdir(parentAbsPath):
+        try:
+            os.makedirs(parentAbsPath)
+        except OSError:
+            pass # created by another converter
+    tempAbsPath = tempfile.mkdtemp(dir = parentAbsPath)
+    try:
+        linkTree(outFolder, tempAbsPath)
+        os.rename(tempAbsPath, cacheAbsPath)
+        logging.info('Stored conversion ' + cacheKey + ' of ' + outFolder + ' in the cache')
+    except OSError as e:
+        # The same conversion was stored by another converter
+        logging.warn('Could not store conversion of ' + outFolder + ' in the cache: ' + str(e))
+        shutil.rmtree(tempAbsPath, ignore_errors = True)
+
+def getProcessTree(pid):
+    """ Get the pids of a process and all its descendants (from /proc)"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                # the parent pid is the 4th field, after the command in brackets
+                ppid = int(open('/proc/' + name + '/stat', 'r').read().rsplit(')', 1)[1].split()[1])
+            except (IOError, IndexError, ValueError):
+                continue # the process finished
+            children.setdefault(ppid, []).append(int(name))
+    pids = [pid, ]
+    for p in pids:
+        pids.extend(children.get(p, []))
+    return pids
+
+def getMemoryUsage(pid):
+    """ Get the resident memory (in MB) used by a process and its descendants"""
+    memory = 0
+    for p in getProcessTree(pid):
+        try:
+            for line in open('/proc/%d/status' % p, 'r'):
+                if line.startswith('VmRSS:'):
+                    memory += int(line.split()[1]) # in kB
+                    break
+        except IOError:
+            pass # the process finished
+    return memory / 1024.
+
+def logProgress(progress):
+    logging.debug('Converter progress: %.1f%%' % progress)
+
+def readOutput(stream, logFileObject, progressCallback, progressRegex):
+    """ Write the lines of the output of a converter in the log file as they
+    arrive. The lines matching progressRegex are passed to progressCallback"""
+    for line in iter(stream.readline, ''):
+        logFileObject.write(line)
+        logFileObject.flush()
+        if progressCallback != None:
+            m = progressRegex.search(line)
+            if m:
+                progressCallback(float(m.group(1)))
+    stream.close()
+
+def runConverter(args, logFile, cwd = None, timeout = None, memLimit = None, progressCallback = logProgress, progressRegex = DEFAULT_PROGRESS_REGEX):
+    """ Run a converter. Its stdout and stderr are streamed to logFile and the 
+    progress lines (with a percentage matched by progressRegex) are passed to 
+    progressCallback. If the converter (including its child processes) runs 
+    more than timeout seconds or uses more than memLimit MB it is killed and
+    an exception is raised. Returns the return code of the converter"""
+    logging.info(' '.join(args) + ' &> ' + logFile)
+    if isinstance(progressRegex, basestring):
+        progressRegex = re.compile(progressRegex)
+    logFileObject = open(logFile, 'a')
+    # The converter runs in its own process group so its children can also be killed
+    process = subprocess.Popen(args, stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                               cwd = cwd, preexec_fn = os.setsid)
+    reader = threading.Thread(target = readOutput, args = (process.stdout, logFileObject, progressCallback, progressRegex))
+    reader.daemon = True
+    reader.start()
+    t0 = time.time()
+    errorMsg = None
+    while process.poll() == None:
+        if timeout and (time.time() - t0) > timeout:
+            errorMsg = '%s was killed after %d seconds (timeout)' % (args[0], int(time.time() - t0))
+        elif memLimit:
+            memory = getMemoryUsage(process.pid)
+            if memory > memLimit:
+                errorMsg = '%s was killed using %.0f MB (memory limit is %d MB)' % (args[0], memory, memLimit)
+        if errorMsg != None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass # it has just finished
+            process.wait()
+            break
+        time.sleep(POLL_INTERVAL)
+    reader.join()
+    logFileObject.close()
+    if errorMsg != None:
+        logging.error(errorMsg)
+        raise Exception(errorMsg + '. Check log: ' + logFile)
+    if process.returncode != 0:
+        logging.warn('%s finished with return code %d. Check log: %s' % (args[0], process.returncode, logFile))
+    return process.returncode
+
+# Rough cost model of the conversions used by the admission control. For each
+# converter and data item type: (base memory in MB, memory in MB per million 
+# points, memory in MB per MB of input file, number of CPUs)
+COST_MODEL = {
+    (utils.OSG_FT, utils.PC_FT, utils.SITE_FT): (200, 60, 0, 1),
+    (utils.OSG_FT, utils.PC_FT, utils.BG_FT): (200, 120, 0, 1),
+    (utils.OSG_FT, utils.MESH_FT, None): (200, 0, 8, 1),
+    (utils.OSG_FT, utils.PIC_FT, None): (100, 0, 4, 1),
+    (utils.POT_FT, utils.PC_FT, None): (300, 40, 0, 1),
+    (utils.NEX_FT, utils.MESH_FT, None): (200, 0, 3, 1),
+}
+
+def getFolderSize(absPath):
+    """ Get the size in bytes of the files in a folder (not recursive)"""
+    size = 0
+    if os.path.isdir(absPath):
+        for name in os.listdir(absPath):
+            fileAbsPath = os.path.join(absPath, name)
+            if os.path.isfile(fileAbsPath):
+                size += os.path.getsize(fileAbsPath)
+    return size
+
+def getConversionsCosts(cursor, converter, rawDataItemIds):
+    """ Get the estimated cost of converting each of the raw data items with
+    the converter (utils.OSG_FT, utils.POT_FT or utils.NEX_FT) from the number 
+    of points of the point clouds and the size of the mesh and picture files. 
+    Returns a dictionary rawDataItemId -> (memory in MB, number of CPUs)"""
+    rows, numRows = utils.fetchDataFromDB(cursor, """
+SELECT raw_data_item_id, abs_path, background, number_points, obj_abs_path, ply_abs_path 
+FROM RAW_DATA_ITEM JOIN ITEM USING (item_id) 
+     LEFT JOIN RAW_DATA_ITEM_PC USING (raw_data_item_id) 
+     LEFT JOIN RAW_DATA_ITEM_MESH USING (raw_data_item_id) 
+WHERE raw_data_item_id = ANY(%s)""", [list(rawDataItemIds),])
+    costs = {}
+    for (rawDataItemId, absPath, isBackground, numberPoints, objAbsPath, plyAbsPath) in rows:
+        (fileSize, kind) = (0, None)
+        if '/PC/' in absPath:
+            itemType = utils.PC_FT
+            if converter == utils.OSG_FT:
+                kind = utils.BG_FT if isBackground else utils.SITE_FT
+        elif '/MESH/' in absPath:
+            itemType = utils.MESH_FT
+            meshAbsPath = plyAbsPath if converter == utils.NEX_FT else objAbsPath
+            if meshAbsPath and os.path.isfile(meshAbsPath):
+                fileSize = os.path.getsize(meshAbsPath)
+        else:
+            itemType = utils.PIC_FT
+            fileSize = getFolderSize(absPath)
+        (baseMemory, pointsMemory, fileMemory, cpus) = COST_MODEL.get((converter, itemType, kind), (0, 0, 0, 1))
+        costs[rawDataItemId] = (baseMemory + pointsMemory * (numberPoints or 0) / 1e6 + fileMemory * fileSize / 1e6, cpus)
+    return costs
+
+class AdmissionControl:
+    """ Admits conversions while the total estimated cost of the running
+    conversions fits in the memory (MB) and CPU limits (0 means no limit). A 
+    conversion is always admitted if none is running, so conversions that 
+    alone exceed the limits run on their own. It can be used from several 
+    threads (with acquire and release) or from a single scheduler (with 
+    canAdmit, admit and release)"""
+    def __init__(self, maxMemory = 0, maxCpus = 0):
+        self.maxMemory = maxMemory
+        self.maxCpus = maxCpus
+        self.memory = 0
+        self.cpus = 0
+        self.numRunning = 0
+        self.condition = threading.Condition()
+        
+    def canAdmit(self, cost):
+        (memory, cpus) = cost
+        if self.numRunning == 0:
+            return True
+        if self.maxMemory and (self.memory + memory) > self.maxMemory:
+            return False
+        if self.maxCpus and (self.cpus + cpus) > self.maxCpus:
+            return False
+        return True
+    
+    def admit(self, cost):
+        self.memory += cost[0]
+        self.cpus += cost[1]
+        self.numRunning += 1
+    
+    def acquire(self, cost):
+        """ Blocks until the conversion can be admitted"""
+        self.condition.acquire()
+        try:
+            while not self.canAdmit(cost):
+                self.condition.wait()
+            self.admit(cost)
+        finally:
+            self.condition.release()
+            
+    def release(self, cost):
+        self.condition.acquire()
+        try:
+            self.memory -= cost[0]
+            self.cpus -= cost[1]
+            self.numRunning -= 1
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Lightweight reader of the headers of LAS/LAZ files. Only
+#                   the public header block and the VLRs with the spatial
+#                   reference (GeoKeyDirectory and OGC WKT) are parsed with
+#                   struct from a memory-mapped file (liblas is not required).
+#                   LAZ files have the same uncompressed header as LAS files.
+#                   It also contains a NumPy reader that streams the points of
+#                   (uncompressed) LAS files in chunks and a writer of LAS
+#                   files with a subset of the points of other LAS files.
+# Notes:            The parsed headers are cached by path, modification time
+#                   and size
+##############################################################################
+import os, re, mmap, struct, collections
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+LAS_EXTENSIONS = ('las', 'laz')
+# Default number of threads used to scan the headers of the tiles of a folder
+DEFAULT_SCAN_THREADS = 4
+# Number of points read at once when streaming the points of a LAS file
+DEFAULT_CHUNK_SIZE = 1000000
+# Default size of the bins of the Z histograms (in the units of the files, i.e. meters)
+DEFAULT_Z_BIN_SIZE = 0.01
+# Maximum number of bins of the Z histograms (the bins are made coarser if needed)
+MAX_Z_BINS = 1000000
+# Number of bins of the compact Z histograms (stored in the DB)
+DEFAULT_COMPACT_Z_BINS = 64
+
+# Public header block fields up to the min/max (common to all LAS versions)
+HEADER_FORMAT = '<4sHH16sBB32s32sHHHIIBHI5I3d3d6d'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# Start of the 64 bits number of point records in LAS 1.4 headers
+HEADER_14_NUMBER_POINTS_OFFSET = 247
+# Start of the start of first EVLR and number of EVLRs in LAS 1.4 headers
+HEADER_14_EVLR_OFFSET = 235
+# Offsets of the header fields updated by LASWriter
+HEADER_LEGACY_NUMBER_POINTS_OFFSET = 107
+HEADER_BOUNDS_OFFSET = 179
+HEADER_14_RETURNS_OFFSET = 255
+# Offset of the return number in the point records
+RETURN_NUMBER_OFFSET = 14
+VLR_HEADER_FORMAT = '<H16sHH32s'
+VLR_HEADER_SIZE = struct.calcsize(VLR_HEADER_FORMAT)
+EVLR_HEADER_FORMAT = '<H16sHQ32s'
+EVLR_HEADER_SIZE = struct.calcsize(EVLR_HEADER_FORMAT)
+
+PROJECTION_USER_ID = 'LASF_Projection'
+GEOKEY_DIRECTORY_RECORD_ID = 34735
+OGC_WKT_RECORD_ID = 2112
+PROJECTED_CS_GEOKEY = 3072
+GEOGRAPHIC_TYPE_GEOKEY = 2048
+USER_DEFINED_GEOKEY_VALUE = 32767
+
+LASHeader = collections.namedtuple('LASHeader', ['version', 'pointFormat', 'pointLength', 'offsetToPoints',
+                                                 'numberPoints', 'scale', 'offset', 'min', 'max', 'srid'])
+
+# Statistics of a LAS/LAZ file (tile) of a point cloud folder
+LASTile = collections.namedtuple('LASTile', ['fileName', 'numberPoints', 'minx', 'miny', 'minz',
+                                             'maxx', 'maxy', 'maxz', 'srid', 'mtime', 'size'])
+
+# Cache of parsed headers: absPath -> ((mtime, size), LASHeader)
+headersCache = {}
+
+def isLASFile(absPath):
+    """ Check if the path has a LAS/LAZ extension"""
+    return os.path.splitext(absPath)[1][1:].lower() in LAS_EXTENSIONS
+
+def isLAZFile(absPath):
+    """ Check if the path has a LAZ (compressed) extension"""
+    return absPath.lower().endswith('laz')
+
+def readSRIDFromGeoKeys(data):
+    """ Get the EPSG code from the content of a GeoKeyDirectory VLR"""
+    numShorts = len(data) // 2
+    if numShorts < 4:
+        return None
+    shorts = struct.unpack('<%dH' % numShorts, data[:numShorts * 2])
+    numKeys = shorts[3]
+    keys = {}
+    for i in range(numKeys):
+        entry = shorts[4 + (4 * i): 8 + (4 * i)]
+        if len(entry) < 4:
+            break
+        (keyId, location, count, value) = entry
+        if location == 0: # the value is directly in the entry
+            keys[keyId] = value
+    for keyId in (PROJECTED_CS_GEOKEY, GEOGRAPHIC_TYPE_GEOKEY):
+        if keyId in keys and keys[keyId] not in (0, USER_DEFINED_GEOKEY_VALUE):
+            return str(keys[keyId])
+    return None
+
+def readSRIDFromWKT(data):
+    """ Get the EPSG code from the content of a OGC WKT VLR (the authority of
+    the root element, i.e. the last one in the WKT)"""
+    authorities = re.findall(r'AUTHORITY\[\s*"EPSG"\s*,\s*"?(\d+)"?\s*\]', data.rstrip('\x00'))
+    if len(authorities):
+        return authorities[-1]
+    return None
+
+def readSRIDFromVLRs(data, start, end, numVLRs, extended = False):
+    """ Get the EPSG code from the VLRs (or EVLRs if extended) starting in start.
+    The WKT has precedence over the GeoKeys like in GDAL"""
+    (geoKeysSRID, wktSRID) = (None, None)
+    (headerFormat, headerSize) = (VLR_HEADER_FORMAT, VLR_HEADER_SIZE)
+    if extended:
+        (headerFormat, headerSize) = (EVLR_HEADER_FORMAT, EVLR_HEADER_SIZE)
+    position = start
+    for i in range(numVLRs):
+        if position + headerSize > end:
+            break
+        (reserved, userId, recordId, length, description) = struct.unpack(headerFormat, data[position:position + headerSize])
+        position += headerSize
+        if userId.rstrip('\x00') == PROJECTION_USER_ID:
+            content = data[position:min(position + length, end)]
+            if recordId == GEOKEY_DIRECTORY_RECORD_ID:
+                geoKeysSRID = readSRIDFromGeoKeys(content)
+            elif recordId == OGC_WKT_RECORD_ID:
+                wktSRID = readSRIDFromWKT(content)
+        position += length
+    if wktSRID != None:
+        return wktSRID
+    return geoKeysSRID
+
+def parseLASHeader(data):
+    """ Parse the header (and the spatial reference VLRs) of a LAS/LAZ file from its content"""
+    if len(data) < HEADER_SIZE:
+        raise Exception('Invalid LAS/LAZ file: header is truncated')
+    fields = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+    if fields[0] != 'LASF':
+        raise Exception('Invalid LAS/LAZ file: LASF signature not found')
+    (versionMajor, versionMinor) = fields[4:6]
+    (headerSize, offsetToPoints, numVLRs, pointFormat, pointLength, numberPoints) = fields[10:16]
+    scale = fields[21:24]
+    offset = fields[24:27]
+    (maxx, minx, maxy, miny, maxz, minz) = fields[27:33]
+
+    srid = readSRIDFromVLRs(data, headerSize, min(offsetToPoints, len(data)), numVLRs)
+    if (versionMajor, versionMinor) >= (1, 4) and headerSize >= HEADER_14_NUMBER_POINTS_OFFSET + 8:
+        numberPoints14 = struct.unpack('<Q', data[HEADER_14_NUMBER_POINTS_OFFSET:HEADER_14_NUMBER_POINTS_OFFSET + 8])[0]
+        if numberPoints14:
+            numberPoints = numberPoints14
+        (startEVLR, numEVLRs) = struct.unpack('<QI', data[HEADER_14_EVLR_OFFSET:HEADER_14_EVLR_OFFSET + 12])
+        if srid == None and numEVLRs and startEVLR:
+            srid = readSRIDFromVLRs(data, startEVLR, len(data), numEVLRs, extended = True)
+
+    # The bit 7 of the point format is set in LAZ files
+    return LASHeader('%d.%d' % (versionMajor, versionMinor), pointFormat & 0x3F, pointLength, offsetToPoints,
+                     numberPoints, scale, offset, (minx, miny, minz), (maxx, maxy, maxz), srid)
+
+def readLASHeader(absPath):
+    """ Read the header of a LAS/LAZ file. The file is memory mapped so only the
+    pages of the header and the VLRs are actually read. The parsed headers are
+    cached and reused while the modification time and size of the file do not change"""
+    stat = os.stat(absPath)
+    key = (stat.st_mtime, stat.st_size)
+    cached = headersCache.get(absPath)
+    if cached != None and cached[0] == key:
+        return cached[1]
+    f = open(absPath, 'rb')
+    try:
+        if stat.st_size == 0:
+            raise Exception('Invalid LAS/LAZ file: ' + absPath + ' is empty')
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = parseLASHeader(data)
+        finally:
+            data.close()
+    finally:
+        f.close()
+    headersCache[absPath] = (key, header)
+    return header
+
+def readSRID(absPath):
+    """ Get the EPSG code (as string) of a LAS/LAZ file or None if it is not defined"""
+    return readLASHeader(absPath).srid
+
+def getLASFiles(absPath):
+    """ Get the sorted list of LAS/LAZ files in a folder (or the file itself if absPath is a file)"""
+    if os.path.isdir(absPath):
+        return [absPath + '/' + fileName for fileName in sorted(os.listdir(absPath)) if isLASFile(fileName)]
+    return [absPath,]
+
+def readLASTile(absPath):
+    """ Get the statistics of a LAS/LAZ file"""
+    stat = os.stat(absPath)
+    header = readLASHeader(absPath)
+    return LASTile(os.path.basename(absPath), header.numberPoints, header.min[0], header.min[1], header.min[2],
+                   header.max[0], header.max[1], header.max[2], header.srid, stat.st_mtime, stat.st_size)
+
+def scanLAS(absPath, numThreads = DEFAULT_SCAN_THREADS):
+    """ Scan the headers of the LAS/LAZ files in absPath (a folder or a single 
+    file) with a pool of numThreads threads (reading headers is I/O bound).
+    Returns the aggregated (srid, numberPoints, extension, minx, miny, minz, 
+    maxx, maxy, maxz) and the list of LASTile. The aggregated srid is -1 if 
+    it is not the same in all the files"""
+    lfiles = getLASFiles(absPath)
+    
+    if os.path.isdir(absPath):
+        numLAZ = len([lfile for lfile in lfiles if lfile.lower().endswith('laz')])
+        if len(lfiles) - numLAZ >= numLAZ:
+            extension = 'las'
+        else:
+            extension = 'laz'
+    else:
+        extension = None
+        for lasExtension in LAS_EXTENSIONS:
+            if absPath.lower().endswith(lasExtension):
+                extension = lasExtension
+    
+    if numThreads > 1 and len(lfiles) > 1:
+        pool = ThreadPool(min(numThreads, len(lfiles)))
+        try:
+            tiles = pool.map(readLASTile, lfiles)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        tiles = map(readLASTile, lfiles)
+    
+    (srid, numberPoints, minx, miny, minz, maxx, maxy, maxz) = (None, 0, None, None, None, None, None, None)
+    for tile in tiles:
+        if srid == None:
+            srid = tile.srid
+        elif srid != tile.srid:
+            srid = -1
+        numberPoints += tile.numberPoints
+        if tile.numberPoints:
+            if minx == None or tile.minx < minx:
+                minx = tile.minx
+            if miny == None or tile.miny < miny:
+                miny = tile.miny
+            if minz == None or tile.minz < minz:
+                minz = tile.minz
+            if maxx == None or tile.maxx > maxx:
+                maxx = tile.maxx
+            if maxy == None or tile.maxy > maxy:
+                maxy = tile.maxy
+            if maxz == None or tile.maxz > maxz:
+                maxz = tile.maxz
+    return ((srid, numberPoints, extension, minx, miny, minz, maxx, maxy, maxz), tiles)
+
+def readLASPoints(absPath, chunkSize = DEFAULT_CHUNK_SIZE):
+    """ Generator of the points of a LAS file in chunks of chunkSize points. 
+    The file is memory mapped and each chunk is a tuple (x, y, z, records) with 
+    the scaled coordinates (float64 arrays) and the raw point records (a 2D 
+    uint8 array with one row per point). Compressed LAZ files are not supported"""
+    if isLAZFile(absPath):
+        raise Exception('LAZ files can not be read natively: ' + absPath)
+    header = readLASHeader(absPath)
+    # Truncated files: only the complete records are read
+    numberPoints = min(header.numberPoints, (os.path.getsize(absPath) - header.offsetToPoints) // header.pointLength)
+    if numberPoints <= 0:
+        return
+    records = np.memmap(absPath, dtype=np.uint8, mode='r', offset=header.offsetToPoints, shape=(numberPoints, header.pointLength))
+    for start in range(0, numberPoints, chunkSize):
+        chunk = records[start:start + chunkSize]
+        # X, Y and Z are the first 3 fields (int32) in all the point formats
+        xyz = np.ascontiguousarray(chunk[:, :12]).view('<i4')
+        x = xyz[:, 0] * header.scale[0] + header.offset[0]
+        y = xyz[:, 1] * header.scale[1] + header.offset[1]
+        z = xyz[:, 2] * header.scale[2] + header.offset[2]
+        yield (x, y, z, chunk)
+
+def parsePolygonWKT(wkt):
+    """ Get the rings (lists of (x, y)) of a (multi)polygon in WKT"""
+    rings = []
+    for ringText in re.findall(r'\(([^()]+)\)', wkt):
+        ring = []
+        for pointText in ringText.split(','):
+            coordinates = pointText.split()
+            if len(coordinates) >= 2:
+                ring.append((float(coordinates[0]), float(coordinates[1])))
+        if len(ring):
+            rings.append(ring)
+    return rings
+
+def pointsInPolygon(x, y, rings):
+    """ Vectorized even-odd test of the points (x, y arrays) in a polygon given 
+    by its rings (this also handles holes and multipolygons). Returns a boolean array"""
+    inside = np.zeros(len(x), dtype=bool)
+    for ring in rings:
+        (px, py) = ring[-1]
+        for (qx, qy) in ring:
+            if qy != py:
+                crosses = (qy > y) != (py > y)
+                xCross = (px - qx) * (y - qy) / (py - qy) + qx
+                inside ^= crosses & (x < xCross)
+            (px, py) = (qx, qy)
+    return inside
+
+class LASWriter(object):
+    """ Writes a LAS file with points (raw records) of other LAS files. The 
+    header and VLRs are copied from the template file (all the written records 
+    must have its point format, scale and offset) and the number of points, 
+    points by return and bounds are updated when the writer is closed"""
+    def __init__(self, absPath, templateAbsPath):
+        self.header = readLASHeader(templateAbsPath)
+        template = open(templateAbsPath, 'rb')
+        self.headerData = template.read(self.header.offsetToPoints)
+        template.close()
+        self.output = open(absPath, 'wb')
+        self.output.write(self.headerData)
+        self.numberPoints = 0
+        self.returns = np.zeros(16, dtype=np.int64)
+        self.mins = None
+        self.maxs = None
+        
+    def write(self, records, x, y, z):
+        """ Write the point records (with scaled coordinates x, y and z)"""
+        if len(records) == 0:
+            return
+        self.output.write(np.ascontiguousarray(records).tostring())
+        self.numberPoints += len(records)
+        if self.header.pointFormat < 6:
+            returnNumbers = records[:, RETURN_NUMBER_OFFSET] & 0x07
+        else:
+            returnNumbers = records[:, RETURN_NUMBER_OFFSET] & 0x0F
+        self.returns += np.bincount(returnNumbers, minlength=16)[:16]
+        mins = (x.min(), y.min(), z.min())
+        maxs = (x.max(), y.max(), z.max())
+        if self.mins == None:
+            (self.mins, self.maxs) = (mins, maxs)
+        else:
+            self.mins = tuple([min(a, b) for (a, b) in zip(self.mins, mins)])
+            self.maxs = tuple([max(a, b) for (a, b) in zip(self.maxs, maxs)])
+
+    def close(self):
+        """ Update the header and close the file"""
+        (mins, maxs) = (self.mins, self.maxs)
+        if mins == None:
+            (mins, maxs) = ((0., 0., 0.), (0., 0., 0.))
+        legacyNumberPoints = 0
+        legacyReturns = [0, 0, 0, 0, 0]
+        if self.header.pointFormat < 6 and self.numberPoints < 2 ** 32:
+            legacyNumberPoints = self.numberPoints
+            legacyReturns = [int(r) for r in self.returns[1:6]]
+        self.output.seek(HEADER_LEGACY_NUMBER_POINTS_OFFSET)
+        self.output.write(struct.pack('<I5I', legacyNumberPoints, *legacyReturns))
+        self.output.seek(HEADER_BOUNDS_OFFSET)
+        self.output.write(struct.pack('<6d', maxs[0], mins[0], maxs[1], mins[1], maxs[2], mins[2]))
+        if self.header.version >= '1.4' and len(self.headerData) >= HEADER_14_RETURNS_OFFSET + (15 * 8):
+            # The EVLRs of the template are not copied
+            self.output.seek(HEADER_14_EVLR_OFFSET)
+            self.output.write(struct.pack('<QIQ15Q', 0, 0, self.numberPoints, *[int(r) for r in self.returns[1:16]]))
+        self.output.close()
+
+class ZStats(object):
+    """ Streaming accumulator of the statistics of the Z coordinates of a set of 
+    points: number of points, minimum, maximum, average and a histogram (with 
+    bins of binSize) used to estimate percentiles. If the range of Z values 
+    requires more than maxBins bins the bins are made coarser"""
+    def __init__(self, binSize = DEFAULT_Z_BIN_SIZE, maxBins = MAX_Z_BINS):
+        self.binSize = binSize
+        self.maxBins = maxBins
+        self.numberPoints = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.
+        self.firstBin = None
+        self.counts = np.zeros(0, dtype=np.int64)
+    
+    def add(self, z):
+        """ Add the Z coordinates (array) of some points"""
+        if len(z) == 0:
+            return
+        self.numberPoints += len(z)
+        self.sum += float(z.sum())
+        (zMin, zMax) = (float(z.min()), float(z.max()))
+        if self.min == None or zMin < self.min:
+            self.min = zMin
+        if self.max == None or zMax > self.max:
+            self.max = zMax
+        # Enlarge the histogram to include the bins of all the points seen so far
+        while (int(np.floor(self.max / self.binSize)) - int(np.floor(self.min / self.binSize)) + 1) > self.maxBins:
+            self.coarsen()
+        firstBin = int(np.floor(self.min / self.binSize))
+        lastBin = int(np.floor(self.max / self.binSize))
+        if self.firstBin == None:
+            self.firstBin = firstBin
+            self.counts = np.zeros(lastBin - firstBin + 1, dtype=np.int64)
+        else:
+            if firstBin < self.firstBin:
+                self.counts = np.concatenate((np.zeros(self.firstBin - firstBin, dtype=np.int64), self.counts))
+                self.firstBin = firstBin
+            if lastBin - self.firstBin + 1 > len(self.counts):
+                self.counts = np.concatenate((self.counts, np.zeros(lastBin - self.firstBin + 1 - len(self.counts), dtype=np.int64)))
+        bins = np.floor(z / self.binSize).astype(np.int64) - self.firstBin
+        self.counts += np.bincount(bins, minlength=len(self.counts))[:len(self.counts)]
+    
+    def coarsen(self):
+        """ Double the size of the bins of the histogram"""
+        self.binSize *= 2
+        if self.firstBin != None:
+            firstBin = self.firstBin // 2
+            bins = ((self.firstBin + np.arange(len(self.counts))) // 2) - firstBin
+            self.counts = np.bincount(bins, weights=self.counts).astype(np.int64)
+            self.firstBin = firstBin
+    
+    def average(self):
+        """ Get the average Z (None if there are not points)"""
+        if self.numberPoints == 0:
+            return None
+        return self.sum / self.numberPoints
+    
+    def percentile(self, percentage):
+        """ Get an estimation (center of the bin) of a percentile of the Z values 
+        (None if there are not points)"""
+        if self.numberPoints == 0:
+            return None
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, (percentage / 100.) * self.numberPoints))
+        index = min(index, len(self.counts) - 1)
+        value = (self.firstBin + index + 0.5) * self.binSize
+        return min(max(value, self.min), self.max)
+    
+    def compactHistogram(self, numBins = DEFAULT_COMPACT_Z_BINS):
+        """ Get a histogram with numBins bins between the minimum and the maximum Z. 
+        Returns (start, binSize, counts), i.e. the bin i contains the points with 
+        Z in [start + (i * binSize), start + ((i + 1) * binSize))"""
+        if self.numberPoints == 0:
+            return (None, None, [])
+        binSize = (self.max - self.min) / numBins
+        if binSize == 0:
+            return (self.min, 0., [self.numberPoints,] + ([0,] * (numBins - 1)))
+        centers = (self.firstBin + np.arange(len(self.counts)) + 0.5) * self.binSize
+        indexes = np.clip(np.floor((centers - self.min) / binSize).astype(np.int64), 0, numBins - 1)
+        counts = np.bincount(indexes, weights=self.counts, minlength=numBins)
+        return (self.min, binSize, [int(c) for c in counts])
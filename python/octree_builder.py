@@ -0,0 +1,550 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Out-of-core builder of Potree (1.7) octrees from LAS
+#                   files, alternative to PotreeConverter. The output has the
+#                   same layout as PotreeConverter with LAS output format:
+#                   cloud.js and the data folder with a LAS file per node and
+#                   the hierarchy (.hrc) files
+# Notes:            * The points are assigned to the octree levels with a grid
+#                     subsampling: a point is in level l if it is the first
+#                     point in its cell of the level l grid (each node has
+#                     gridSize^3 cells), the remaining points are in the
+#                     deepest level
+#                   * The nodes of the points are given by NumPy-vectorized
+#                     Morton codes
+#                   * The points are never all in memory. The tiles are read
+#                     in chunks and spilled to disk per partition (the nodes
+#                     of level PARTITION_LEVEL). The partitions are then
+#                     processed independently and spilled to disk per node.
+#                     Finally the node files are written. The tiles, the
+#                     partitions and the nodes are processed in parallel
+#                   * Only uncompressed LAS files are supported. All of them
+#                     must have the same point format
+#                   * The spill files of the partitions and of the nodes
+#                     shared by several partitions are kept in a work folder
+#                     outside of the output folder (so they are not published
+#                     nor cached with the octree), they take about the size of
+#                     the points of the tiles. Only a small manifest of the
+#                     tiles is kept with the octree. When some tiles change
+#                     only the partitions where they have points (and the
+#                     shared nodes) are rebuilt
+##############################################################################
+import os, shutil, struct, json, logging, multiprocessing, tempfile
+import numpy as np
+import utils, las_utils, converter_utils
+
+POTREE_VERSION = '1.7'
+CLOUD_JS = 'cloud.js'
+OCTREE_DIR = 'data'
+HIERARCHY_STEP_SIZE = 5
+# Number of cells per axis of the subsampling grid of each node
+DEFAULT_GRID_SIZE = 128
+# Margin of the cube of the octree around the points (fraction of its size)
+CUBE_MARGIN = 0.01
+# Level of the nodes used as partitions (processed independently)
+PARTITION_LEVEL = 2
+# The Morton codes have 21 bits per axis
+MAX_MORTON_BITS = 21
+# Root of the work folders with the spill files of the octrees
+DEFAULT_WORK_DIR = utils.DEFAULT_DATA_DIR + '/POTREE_WORK'
+SPILL_PARTITIONS_DIR = 'partitions'
+SPILL_NODES_DIR = 'nodes'
+SPILL_EXTENSION = '.bin'
+MANIFEST_FILE_NAME = '.tiles.json'
+
+def part1by2(v):
+    """ Spread the (21) lower bits of the integers in v, leaving two zero bits
+    between consecutive bits"""
+    v = v.astype(np.uint64) & np.uint64(0x1fffff)
+    v = (v | (v << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    v = (v | (v << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    v = (v | (v << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+    v = (v | (v << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | (v << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return v
+
+def mortonCodes(ix, iy, iz):
+    """ Get the Morton codes of the integer coordinates. Each group of 3 bits
+    is a Potree child index (x is the highest bit and z the lowest)"""
+    return (part1by2(ix) << np.uint64(2)) | (part1by2(iy) << np.uint64(1)) | part1by2(iz)
+
+def getNodeName(nodeCode, level):
+    """ Get the Potree name of the node with the Morton code nodeCode of the
+    given level (r followed by the child index in each level)"""
+    if level == 0:
+        return 'r'
+    return 'r' + ('%o' % nodeCode).zfill(level)
+
+def getHierarchyPath(nodeName):
+    """ Get the folder (relative to the octree folder) of a node, as in Potree
+    there is a sub-folder every HIERARCHY_STEP_SIZE levels"""
+    indices = nodeName[1:]
+    parts = ['r', ] + [indices[i * HIERARCHY_STEP_SIZE:(i + 1) * HIERARCHY_STEP_SIZE] for i in range(len(indices) // HIERARCHY_STEP_SIZE)]
+    return os.path.join(*parts)
+
+def getNodeAbsPath(outFolder, nodeName, extension = 'las'):
+    return os.path.join(outFolder, OCTREE_DIR, getHierarchyPath(nodeName), nodeName + '.' + extension)
+
+class OctreeSpec(object):
+    """ The geometry of an octree: cubic bounding box, depth and subsampling
+    grid, and the point format, scale and offset of the output LAS files
+    (those of the template, i.e. the first input file). The cube is by default
+    the smallest one containing the input files. A previous cube (min, size) 
+    can be reused if it contains them"""
+    def __init__(self, inputFiles, levels, gridSize = DEFAULT_GRID_SIZE, cube = None):
+        headers = [las_utils.readLASHeader(inputFile) for inputFile in inputFiles]
+        self.templateAbsPath = inputFiles[0]
+        self.template = headers[0]
+        for (inputFile, header) in zip(inputFiles, headers):
+            if las_utils.isLAZFile(inputFile):
+                raise Exception('LAZ files are not supported: ' + inputFile)
+            if (header.pointFormat, header.pointLength) != (self.template.pointFormat, self.template.pointLength):
+                raise Exception('All the LAS files must have the same point format: ' + inputFile)
+        self.tightMin = tuple([min(h.min[i] for h in headers) for i in range(3)])
+        self.tightMax = tuple([max(h.max[i] for h in headers) for i in range(3)])
+        if cube != None:
+            (self.min, self.size) = (tuple(cube[0]), cube[1])
+            for i in range(3):
+                if self.tightMin[i] < self.min[i] or self.tightMax[i] > self.min[i] + self.size:
+                    raise Exception('The LAS files are not contained in the cube of the octree')
+        else:
+            # The cube has a margin so the octree can be updated with tiles 
+            # slightly larger than the current ones
+            size = max(self.tightMax[i] - self.tightMin[i] for i in range(3))
+            if size <= 0:
+                size = 1.
+            self.size = size * (1 + 2 * CUBE_MARGIN)
+            self.min = tuple([m - size * CUBE_MARGIN for m in self.tightMin])
+        self.gridBits = int(np.log2(gridSize))
+        if 2 ** self.gridBits != gridSize:
+            raise Exception('The grid size must be a power of 2')
+        # The Morton codes of the finest grid must fit in MAX_MORTON_BITS per axis
+        self.levels = min(levels, MAX_MORTON_BITS - self.gridBits)
+        if self.levels != levels:
+            logging.warn('The number of levels is limited to %d' % self.levels)
+        self.gridSize = gridSize
+        self.spacing = self.size / gridSize
+        self.partitionLevel = min(PARTITION_LEVEL, self.levels)
+        # Bits of the integer coordinates in the finest grid
+        self.bits = self.levels + self.gridBits
+
+    def getKey(self):
+        """ Get the parameters that must not change to update the octree"""
+        return {'min': list(self.min), 'size': self.size, 'levels': self.levels, 'gridSize': self.gridSize,
+                'pointFormat': self.template.pointFormat, 'pointLength': self.template.pointLength,
+                'scale': list(self.template.scale), 'offset': list(self.template.offset)}
+
+    def getIntegerCoordinates(self, x, y, z):
+        """ Get the integer coordinates of the points in the finest grid"""
+        n = 2 ** self.bits
+        coordinates = []
+        for (c, m) in zip((x, y, z), self.min):
+            coordinates.append(np.clip(((c - m) * (n / self.size)).astype(np.int64), 0, n - 1))
+        return coordinates
+
+    def decode(self, records):
+        """ Get the scaled coordinates of the points (with the scale and offset
+        of the template)"""
+        xyz = np.ascontiguousarray(records[:, :12]).view('<i4')
+        return [xyz[:, i] * self.template.scale[i] + self.template.offset[i] for i in range(3)]
+
+    def encode(self, records, x, y, z, header):
+        """ Get the point records with the coordinates encoded with the scale
+        and offset of the template (a copy is done only if they are different
+        from the ones in header)"""
+        if (header.scale, header.offset) == (self.template.scale, self.template.offset):
+            return records
+        records = np.array(records)
+        xyz = np.empty((len(records), 3), dtype = '<i4')
+        for (i, c) in enumerate((x, y, z)):
+            values = np.round((c - self.template.offset[i]) / self.template.scale[i])
+            if len(values) and (values.min() < -2 ** 31 or values.max() >= 2 ** 31):
+                raise Exception('The coordinates can not be encoded with the scale and offset of ' + self.templateAbsPath)
+            xyz[:, i] = values
+        records[:, :12] = xyz.view(np.uint8).reshape(len(records), 12)
+        return records
+
+def removeFile(absPath):
+    """ Remove a file before writing it again. The files are never overwritten
+    in place since they may be hardlinked from the conversions cache"""
+    if os.path.isfile(absPath):
+        os.remove(absPath)
+
+def appendRecords(absPath, records):
+    f = open(absPath, 'ab')
+    f.write(np.ascontiguousarray(records).tostring())
+    f.close()
+
+def readRecords(absPath, pointLength):
+    return np.fromfile(absPath, dtype = np.uint8).reshape(-1, pointLength)
+
+def spillTile(args):
+    """ Reads a tile in chunks and appends its points to the spill file of the
+    partition where they are"""
+    (spec, tileIndex, inputFile, spillAbsPath, chunkSize) = args
+    header = las_utils.readLASHeader(inputFile)
+    shift = np.int64(spec.bits - spec.partitionLevel)
+    partitionsNames = set()
+    for (x, y, z, records) in las_utils.readLASPoints(inputFile, chunkSize):
+        records = spec.encode(records, x, y, z, header)
+        (ix, iy, iz) = spec.getIntegerCoordinates(x, y, z)
+        partitions = mortonCodes(ix >> shift, iy >> shift, iz >> shift)
+        order = np.argsort(partitions, kind = 'mergesort')
+        (codes, starts) = np.unique(partitions[order], return_index = True)
+        ends = list(starts[1:]) + [len(order), ]
+        for (code, start, end) in zip(codes, starts, ends):
+            partitionAbsPath = os.path.join(spillAbsPath, getNodeName(int(code), spec.partitionLevel))
+            if not os.path.isdir(partitionAbsPath):
+                try:
+                    os.makedirs(partitionAbsPath)
+                except OSError:
+                    pass # created by other process
+            appendRecords(os.path.join(partitionAbsPath, '%d' % tileIndex + SPILL_EXTENSION), records[order[start:end]])
+            partitionsNames.add(getNodeName(int(code), spec.partitionLevel))
+    return sorted(partitionsNames)
+
+def buildPartition(args):
+    """ Assigns the points of a partition to the octree levels and nodes and
+    appends them to the spill files of their nodes. The nodes of levels lower
+    than the partition level are shared by several partitions so each
+    partition writes its own spill file of each node. Returns the number of
+    points of the partition in each node"""
+    (spec, partitionName, spillAbsPath, nodesAbsPath, chunkSize) = args
+    partitionAbsPath = os.path.join(spillAbsPath, partitionName)
+    occupied = [np.empty(0, dtype = np.int64) for level in range(spec.levels)]
+    counts = {}
+    for fileName in sorted(os.listdir(partitionAbsPath)):
+        allRecords = np.memmap(os.path.join(partitionAbsPath, fileName), dtype = np.uint8, mode = 'r').reshape(-1, spec.template.pointLength)
+        for start in range(0, len(allRecords), chunkSize):
+            records = allRecords[start:start + chunkSize]
+            (ix, iy, iz) = spec.getIntegerCoordinates(*spec.decode(records))
+            pointsLevels = np.empty(len(records), dtype = np.int8)
+            pointsLevels.fill(spec.levels)
+            for level in range(spec.levels):
+                candidates = np.nonzero(pointsLevels == spec.levels)[0]
+                if len(candidates) == 0:
+                    break
+                # cells of the level l grid: (gridSize * 2^l)^3
+                shift = np.int64(spec.levels - level)
+                n = np.int64(2 ** (spec.gridBits + level))
+                keys = ((ix[candidates] >> shift) * n + (iy[candidates] >> shift)) * n + (iz[candidates] >> shift)
+                (cellKeys, first) = np.unique(keys, return_index = True)
+                positions = np.searchsorted(occupied[level], cellKeys)
+                isNew = (positions == len(occupied[level]))
+                isNew[~isNew] = occupied[level][positions[~isNew]] != cellKeys[~isNew]
+                pointsLevels[candidates[first[isNew]]] = level
+                occupied[level] = np.union1d(occupied[level], cellKeys[isNew])
+            codes = mortonCodes(ix, iy, iz)
+            for level in range(spec.levels + 1):
+                indexes = np.nonzero(pointsLevels == level)[0]
+                if len(indexes) == 0:
+                    continue
+                nodeCodes = codes[indexes] >> np.uint64(3 * (spec.bits - level))
+                order = np.argsort(nodeCodes, kind = 'mergesort')
+                (uniqueCodes, starts) = np.unique(nodeCodes[order], return_index = True)
+                ends = list(starts[1:]) + [len(order), ]
+                for (code, s, e) in zip(uniqueCodes, starts, ends):
+                    nodeName = getNodeName(int(code), level)
+                    nodeAbsPath = os.path.join(nodesAbsPath, nodeName)
+                    if not os.path.isdir(nodeAbsPath):
+                        try:
+                            os.makedirs(nodeAbsPath)
+                        except OSError:
+                            pass # created by other process
+                    appendRecords(os.path.join(nodeAbsPath, partitionName + SPILL_EXTENSION), records[indexes[order[s:e]]])
+                    counts[nodeName] = counts.get(nodeName, 0) + (e - s)
+        del allRecords
+    return counts
+
+def isSharedNode(spec, nodeName):
+    """ The nodes with lower level than the partitions have points of several partitions"""
+    return (len(nodeName) - 1) < spec.partitionLevel
+
+def writeNode(args):
+    """ Writes the LAS file of a node from its spill files. The spill files of
+    the shared nodes are kept (to update them when some partitions change)"""
+    (spec, nodeName, nodesAbsPath, outFolder) = args
+    nodeAbsPath = os.path.join(nodesAbsPath, nodeName)
+    outAbsPath = getNodeAbsPath(outFolder, nodeName)
+    if not os.path.isdir(os.path.dirname(outAbsPath)):
+        try:
+            os.makedirs(os.path.dirname(outAbsPath))
+        except OSError:
+            pass # created by other process
+    removeFile(outAbsPath)
+    writer = las_utils.LASWriter(outAbsPath, spec.templateAbsPath)
+    for fileName in sorted(os.listdir(nodeAbsPath)):
+        records = readRecords(os.path.join(nodeAbsPath, fileName), spec.template.pointLength)
+        (x, y, z) = spec.decode(records)
+        writer.write(records, x, y, z)
+    writer.close()
+    if not isSharedNode(spec, nodeName):
+        shutil.rmtree(nodeAbsPath)
+
+def writeHierarchy(outFolder, counts):
+    """ Writes the hierarchy files. There is one for each node with a level
+    multiple of HIERARCHY_STEP_SIZE, with (in breadth-first order) the children
+    mask (1 byte) and the number of points (4 bytes) of the node and its
+    descendants up to HIERARCHY_STEP_SIZE levels deeper"""
+    for rootName in counts:
+        level = len(rootName) - 1
+        if level % HIERARCHY_STEP_SIZE:
+            continue
+        data = []
+        queue = [rootName, ]
+        for nodeName in queue:
+            mask = 0
+            for child in range(8):
+                childName = nodeName + str(child)
+                if childName in counts:
+                    mask |= (1 << child)
+                    if (len(childName) - 1) <= level + HIERARCHY_STEP_SIZE:
+                        queue.append(childName)
+            data.append(struct.pack('<BI', mask, counts[nodeName]))
+        hrcAbsPath = getNodeAbsPath(outFolder, rootName, 'hrc')
+        removeFile(hrcAbsPath)
+        f = open(hrcAbsPath, 'wb')
+        f.write(''.join(data))
+        f.close()
+
+def writeCloudJS(outFolder, spec, numberPoints):
+    """ Writes the cloud.js file of the octree"""
+    boundingBox = dict(zip(('lx', 'ly', 'lz'), spec.min))
+    boundingBox.update(zip(('ux', 'uy', 'uz'), [m + spec.size for m in spec.min]))
+    tightBoundingBox = dict(zip(('lx', 'ly', 'lz'), spec.tightMin))
+    tightBoundingBox.update(zip(('ux', 'uy', 'uz'), spec.tightMax))
+    cloud = {'version': POTREE_VERSION,
+             'octreeDir': OCTREE_DIR,
+             'projection': '',
+             'points': numberPoints,
+             'boundingBox': boundingBox,
+             'tightBoundingBox': tightBoundingBox,
+             'pointAttributes': 'LAS',
+             'spacing': spec.spacing,
+             'scale': spec.template.scale[0],
+             'hierarchyStepSize': HIERARCHY_STEP_SIZE}
+    removeFile(os.path.join(outFolder, CLOUD_JS))
+    f = open(os.path.join(outFolder, CLOUD_JS), 'w')
+    json.dump(cloud, f, indent = 2)
+    f.close()
+
+def getWorkFolder(outFolder, workDir = DEFAULT_WORK_DIR):
+    """ Get the work folder of the octree in outFolder, i.e. the folder in 
+    workDir with the same path as outFolder"""
+    return os.path.join(workDir, os.path.abspath(outFolder).lstrip('/'))
+
+def removeWorkFolder(outFolder, workDir = DEFAULT_WORK_DIR):
+    """ Remove the spill files of the octree in outFolder"""
+    workFolder = getWorkFolder(outFolder, workDir)
+    if os.path.isdir(workFolder):
+        shutil.rmtree(workFolder)
+
+def loadManifest(outFolder):
+    """ Load the manifest of the octree (None if there is not or it can not be read)"""
+    manifestAbsPath = os.path.join(outFolder, MANIFEST_FILE_NAME)
+    if not os.path.isfile(manifestAbsPath):
+        return None
+    try:
+        return json.load(open(manifestAbsPath, 'r'))
+    except ValueError:
+        logging.warn('Manifest ' + manifestAbsPath + ' could not be read')
+        return None
+
+def hasManifest(outFolder):
+    """ Checks if the octree in outFolder was built by this module (i.e. it can
+    be incrementally updated)"""
+    return os.path.isfile(os.path.join(outFolder, MANIFEST_FILE_NAME))
+
+def saveManifest(outFolder, manifest):
+    """ Save the manifest of the octree: the parameters of the octree (spec), 
+    the tiles (name -> index, mtime, size, hash and partitions with points of 
+    the tile) and the number of points of each node"""
+    (fd, tempAbsPath) = tempfile.mkstemp(dir = outFolder)
+    f = os.fdopen(fd, 'w')
+    json.dump(manifest, f)
+    f.close()
+    os.rename(tempAbsPath, os.path.join(outFolder, MANIFEST_FILE_NAME))
+
+def getTileRecord(inputFile, tileIndex, partitionsNames, fileHash = None):
+    st = os.stat(inputFile)
+    return {'index': tileIndex, 'mtime': st.st_mtime, 'size': st.st_size, 'hash': fileHash, 'partitions': partitionsNames}
+
+def runTasks(function, tasks, numProcs):
+    """ Run the tasks with a pool of numProcs processes (or in this process)"""
+    if numProcs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(numProcs, len(tasks)))
+        try:
+            return pool.map(function, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    return [function(task) for task in tasks]
+
+def rebuildPartitions(spec, outFolder, workFolder, partitionsNames, counts, numProcs, chunkSize):
+    """ Rebuilds the nodes of the partitions and the shared nodes. counts is 
+    updated with the new number of points of the nodes"""
+    spillAbsPath = os.path.join(workFolder, SPILL_PARTITIONS_DIR)
+    nodesAbsPath = os.path.join(workFolder, SPILL_NODES_DIR)
+    partitionsNames = [p for p in partitionsNames if os.path.isdir(os.path.join(spillAbsPath, p))]
+    logging.info('Building the nodes of %d partitions' % len(partitionsNames))
+    newCounts = {}
+    for partitionCounts in runTasks(buildPartition, [(spec, p, spillAbsPath, nodesAbsPath, chunkSize) for p in partitionsNames], numProcs):
+        for (nodeName, count) in partitionCounts.items():
+            if not isSharedNode(spec, nodeName):
+                newCounts[nodeName] = newCounts.get(nodeName, 0) + count
+    # The shared nodes are always rewritten, their number of points is given by their spill files
+    for nodeName in os.listdir(nodesAbsPath):
+        if isSharedNode(spec, nodeName):
+            nodeAbsPath = os.path.join(nodesAbsPath, nodeName)
+            count = sum(os.path.getsize(os.path.join(nodeAbsPath, f)) for f in os.listdir(nodeAbsPath)) // spec.template.pointLength
+            if count == 0:
+                # it is removed (with its files) when the octree is finished
+                shutil.rmtree(nodeAbsPath)
+                counts[nodeName] = 0
+            else:
+                newCounts[nodeName] = count
+    logging.info('Writing %d nodes' % len(newCounts))
+    runTasks(writeNode, [(spec, nodeName, nodesAbsPath, outFolder) for nodeName in sorted(newCounts)], numProcs)
+    counts.update(newCounts)
+
+def removeNodes(spec, outFolder, workFolder, counts, partitionName):
+    """ Removes the nodes of a partition: the files of the nodes inside the 
+    partition and the spill files of the partition in the shared nodes"""
+    for nodeName in list(counts):
+        if nodeName.startswith(partitionName) and not isSharedNode(spec, nodeName):
+            for extension in ('las', 'hrc'):
+                removeFile(getNodeAbsPath(outFolder, nodeName, extension))
+            del counts[nodeName]
+    nodesAbsPath = os.path.join(workFolder, SPILL_NODES_DIR)
+    for nodeName in os.listdir(nodesAbsPath):
+        if isSharedNode(spec, nodeName):
+            removeFile(os.path.join(nodesAbsPath, nodeName, partitionName + SPILL_EXTENSION))
+    for nodeName in list(counts):
+        if isSharedNode(spec, nodeName) and not os.path.isdir(os.path.join(nodesAbsPath, nodeName)):
+            del counts[nodeName]
+
+def finishOctree(spec, outFolder, counts, tiles):
+    """ Writes the hierarchy, cloud.js and the manifest"""
+    # Remove the shared nodes without points
+    for nodeName in list(counts):
+        if counts[nodeName] == 0:
+            for extension in ('las', 'hrc'):
+                removeFile(getNodeAbsPath(outFolder, nodeName, extension))
+            del counts[nodeName]
+    writeHierarchy(outFolder, counts)
+    writeCloudJS(outFolder, spec, sum(counts.values()))
+    saveManifest(outFolder, {'spec': spec.getKey(), 'tiles': tiles, 'counts': counts})
+
+def buildOctree(inputFiles, outFolder, levels, numProcs = 1, gridSize = DEFAULT_GRID_SIZE, chunkSize = las_utils.DEFAULT_CHUNK_SIZE, workDir = DEFAULT_WORK_DIR):
+    """ Builds the Potree octree of the LAS files in outFolder, with levels
+    levels below the root (as PotreeConverter -l option). The spill files are 
+    in the work folder of outFolder in workDir (see getWorkFolder). Returns the 
+    number of points in each node"""
+    spec = OctreeSpec(inputFiles, levels, gridSize)
+    workFolder = getWorkFolder(outFolder, workDir)
+    spillAbsPath = os.path.join(workFolder, SPILL_PARTITIONS_DIR)
+    nodesAbsPath = os.path.join(workFolder, SPILL_NODES_DIR)
+    removeWorkFolder(outFolder, workDir)
+    os.makedirs(spillAbsPath)
+    os.makedirs(nodesAbsPath)
+
+    logging.info('Spilling %d LAS files to the partitions' % len(inputFiles))
+    tilesPartitions = runTasks(spillTile, [(spec, i, inputFile, spillAbsPath, chunkSize) for (i, inputFile) in enumerate(inputFiles)], numProcs)
+    tiles = {}
+    for (i, inputFile) in enumerate(inputFiles):
+        tiles[os.path.basename(inputFile)] = getTileRecord(inputFile, i, tilesPartitions[i])
+
+    counts = {}
+    rebuildPartitions(spec, outFolder, workFolder, sorted(os.listdir(spillAbsPath)), counts, numProcs, chunkSize)
+    finishOctree(spec, outFolder, counts, tiles)
+    return counts
+
+def clearFolder(absPath):
+    """ Remove the content of a folder"""
+    for name in os.listdir(absPath):
+        elementAbsPath = os.path.join(absPath, name)
+        if os.path.isdir(elementAbsPath):
+            shutil.rmtree(elementAbsPath)
+        else:
+            os.remove(elementAbsPath)
+
+def updateOctree(inputFiles, outFolder, levels, numProcs = 1, gridSize = DEFAULT_GRID_SIZE, chunkSize = las_utils.DEFAULT_CHUNK_SIZE, workDir = DEFAULT_WORK_DIR):
+    """ Updates the Potree octree in outFolder after some of the LAS files were
+    added, removed or changed. The changed files are detected by their 
+    modification time and size (and their hash if it is known) against the 
+    manifest. Only the partitions where the changed files have (or had) points 
+    and the shared nodes are rebuilt. The octree is fully rebuilt if there is 
+    no manifest (i.e. it was built with PotreeConverter) or no spill files (for 
+    example if it was fetched from the conversions cache), the parameters of 
+    the octree changed or the LAS files are not contained in its cube. Returns 
+    True if the octree was changed"""
+    manifest = loadManifest(outFolder)
+    workFolder = getWorkFolder(outFolder, workDir)
+    spec = None
+    if manifest != None and not os.path.isdir(os.path.join(workFolder, SPILL_NODES_DIR)):
+        logging.info('The spill files of the octree in ' + outFolder + ' are not in ' + workFolder)
+    elif manifest != None:
+        try:
+            spec = OctreeSpec(inputFiles, levels, gridSize, (manifest['spec']['min'], manifest['spec']['size']))
+            if spec.getKey() != manifest['spec']:
+                spec = None
+        except Exception as e:
+            logging.info(str(e))
+            spec = None
+    if spec == None:
+        logging.info('The octree in ' + outFolder + ' is fully rebuilt')
+        clearFolder(outFolder)
+        buildOctree(inputFiles, outFolder, levels, numProcs, gridSize, chunkSize, workDir)
+        return True
+
+    tiles = manifest['tiles']
+    counts = manifest['counts']
+    currentFiles = dict((os.path.basename(inputFile), inputFile) for inputFile in inputFiles)
+    (changedFiles, hashes) = ([], {})
+    for (fileName, inputFile) in sorted(currentFiles.items()):
+        tile = tiles.get(fileName)
+        st = os.stat(inputFile)
+        if tile != None and (tile['mtime'], tile['size']) == (st.st_mtime, st.st_size):
+            continue
+        if tile != None and tile['hash'] != None:
+            hashes[fileName] = converter_utils.hashFile(inputFile)
+            if hashes[fileName] == tile['hash']:
+                # only touched
+                (tile['mtime'], tile['size']) = (st.st_mtime, st.st_size)
+                continue
+        changedFiles.append(fileName)
+    removedFiles = [fileName for fileName in tiles if fileName not in currentFiles]
+    if len(changedFiles) == 0 and len(removedFiles) == 0:
+        saveManifest(outFolder, manifest)
+        logging.info('None LAS file of the octree in ' + outFolder + ' has changed')
+        return False
+    logging.info('Updating the octree in %s: %d new or changed and %d removed LAS files' % (outFolder, len(changedFiles), len(removedFiles)))
+
+    # Remove the spilled points of the changed and removed files
+    spillAbsPath = os.path.join(workFolder, SPILL_PARTITIONS_DIR)
+    affected = set()
+    for fileName in changedFiles + removedFiles:
+        tile = tiles.pop(fileName, None)
+        if tile != None:
+            for partitionName in tile['partitions']:
+                removeFile(os.path.join(spillAbsPath, partitionName, '%d' % tile['index'] + SPILL_EXTENSION))
+                affected.add(partitionName)
+
+    # Spill the points of the new and changed files
+    nextIndex = max([tile['index'] for tile in tiles.values()] + [-1, ]) + 1
+    indexes = dict((fileName, nextIndex + i) for (i, fileName) in enumerate(changedFiles))
+    tilesPartitions = runTasks(spillTile, [(spec, indexes[fileName], currentFiles[fileName], spillAbsPath, chunkSize) for fileName in changedFiles], numProcs)
+    for (fileName, partitionsNames) in zip(changedFiles, tilesPartitions):
+        if fileName not in hashes:
+            hashes[fileName] = converter_utils.hashFile(currentFiles[fileName])
+        tiles[fileName] = getTileRecord(currentFiles[fileName], indexes[fileName], partitionsNames, hashes[fileName])
+        affected.update(partitionsNames)
+
+    for partitionName in sorted(affected):
+        removeNodes(spec, outFolder, workFolder, counts, partitionName)
+        partitionAbsPath = os.path.join(spillAbsPath, partitionName)
+        if os.path.isdir(partitionAbsPath) and len(os.listdir(partitionAbsPath)) == 0:
+            shutil.rmtree(partitionAbsPath)
+    rebuildPartitions(spec, outFolder, workFolder, sorted(affected), counts, numProcs, chunkSize)
+    finishOctree(spec, outFolder, counts, tiles)
+    return True
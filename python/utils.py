@@ -3,7 +3,7 @@
 #    Created by Oscar Martinez                                                 #
 #    o.rubi@esciencecenter.nl                                                  #
 ################################################################################
-import os, time, calendar, logging
+import os, re, time, calendar, logging, collections
 import psycopg2
 
 # Python Module containing methods used in other scripts
@@ -90,6 +90,16 @@ AO_TYPE_PIC = PIC_FT
 AO_TYPE_LAB = 'LAB'
 AO_TYPE_OBJ = 'OBJ'
 
+# Default number of data items whose DB writes are grouped in a single transaction
+DEFAULT_BATCH_SIZE = 500
+# Order in which the tables of a batch are written (parents before children due to the foreign keys)
+DB_INSERT_ORDER = ['ITEM', 'ITEM_OBJECT', 'RAW_DATA_ITEM', 'RAW_DATA_ITEM_PC', 'RAW_DATA_ITEM_PC_TILE', 'RAW_DATA_ITEM_MESH', 'RAW_DATA_ITEM_PICTURE',
+                   'OSG_LOCATION', 'OSG_ITEM_OBJECT', 'OSG_LABEL', 'OSG_CAMERA', 'OSG_ITEM_CAMERA', 'OSG_DATA_ITEM', 'OSG_DATA_ITEM_PC_SITE', 'OSG_DATA_ITEM_MESH', 'OSG_DATA_ITEM_PICTURE',
+                   'OSG_DATA_ITEM_PC_BACKGROUND', 'POTREE_DATA_ITEM_PC', 'NEXUS_DATA_ITEM_MESH', 'OSG_CONFIG_SNAPSHOT']
+
+# Folder with the numbered DB migrations (NNN_description.sql)
+DEFAULT_MIGRATIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Database', 'migrations'))
+
 logger = None
 
 def checkSuperUser():
@@ -314,6 +324,112 @@ def dbExecute(cursor, query, queryArgs = None, mogrify = True):
         cursor.execute(query, queryArgs)
     cursor.connection.commit()
 
+class DBUnitOfWork(object):
+    """ Collects the inserts and the last_check updates of several data items 
+    and writes them in a single transaction. Inserts are grouped per table and 
+    written with execute_values and the last_check updates become one UPDATE 
+    per table with WHERE id = ANY(...). The writes are flushed automatically 
+    every batchSize data items (see dataItemDone). Generic updates and deletes
+    of rows are also collected and written with execute_batch (the deletes 
+    are written first and in reverse DB_INSERT_ORDER). The values of the serial 
+    columns are reserved in blocks of idsBlockSize (default batchSize) """
+    def __init__(self, cursor, batchSize = DEFAULT_BATCH_SIZE, idsBlockSize = None):
+        self.cursor = cursor
+        self.batchSize = max(1, batchSize)
+        self.idsBlockSize = max(1, idsBlockSize or self.batchSize)
+        self.numDataItems = 0
+        self.inserts = collections.OrderedDict()
+        self.touches = collections.OrderedDict()
+        self.updates = collections.OrderedDict()
+        self.deletes = collections.OrderedDict()
+        self.ids = {}
+    
+    def reserveIds(self, table, column, count):
+        """ Reserve count new values of the serial column of a table, they are 
+        used by nextId before reserving more"""
+        if count > 0:
+            rows, num = fetchDataFromDB(self.cursor, "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)", 
+                                        [table.lower(), column, count])
+            self.ids.setdefault((table, column), []).extend([row[0] for row in rows])
+    
+    def nextId(self, table, column):
+        """ Get a new value of the serial column of a table. The values are 
+        reserved in blocks to avoid a RETURNING round-trip per insert"""
+        key = (table, column)
+        if not self.ids.get(key):
+            self.reserveIds(table, column, self.idsBlockSize)
+        return self.ids[key].pop(0)
+    
+    def insert(self, table, names, values):
+        """ Add a row to be inserted in table"""
+        self.inserts.setdefault((table, tuple(names)), []).append(tuple(values))
+    
+    def touch(self, table, idColumn, rowId, lastCheck):
+        """ Add a row (by its id) whose last_check is to be set to lastCheck"""
+        self.touches.setdefault((table, idColumn, lastCheck), []).append(rowId)
+    
+    def update(self, table, idColumn, rowId, names, values):
+        """ Add a row (by its id) whose columns names are to be set to values"""
+        self.updates.setdefault((table, idColumn, tuple(names)), []).append(tuple(values) + (rowId,))
+    
+    def delete(self, table, names, values):
+        """ Add a row to be deleted from table, the row with values in the 
+        columns names"""
+        self.deletes.setdefault((table, tuple(names)), []).append(tuple(values))
+    
+    def dataItemDone(self):
+        """ Notify that all the writes of a data item have been added"""
+        self.numDataItems += 1
+        if self.numDataItems >= self.batchSize:
+            self.flush()
+    
+    def discard(self):
+        """ Drop all the pending writes (the reserved ids are kept, they are 
+        still unused values of the sequences)"""
+        self.inserts.clear()
+        self.touches.clear()
+        self.updates.clear()
+        self.deletes.clear()
+        self.numDataItems = 0
+    
+    def flush(self):
+        """ Write all the pending inserts and updates in a single transaction"""
+        if len(self.inserts) or len(self.touches) or len(self.updates) or len(self.deletes):
+            from psycopg2.extras import execute_values, execute_batch
+            def tableOrder(key):
+                if key[0] in DB_INSERT_ORDER:
+                    return DB_INSERT_ORDER.index(key[0])
+                return len(DB_INSERT_ORDER)
+            try:
+                for key in sorted(self.deletes, key = tableOrder, reverse = True):
+                    (table, names) = key
+                    rows = self.deletes[key]
+                    query = 'DELETE FROM ' + table + ' WHERE ' + ' AND '.join([name + ' = %s' for name in names])
+                    logging.debug('%s [%d rows]' % (query, len(rows)))
+                    execute_batch(self.cursor, query, rows, page_size = self.batchSize)
+                for key in sorted(self.inserts, key = tableOrder):
+                    (table, names) = key
+                    rows = self.inserts[key]
+                    query = 'INSERT INTO ' + table + ' (' + ','.join(names) + ') VALUES %s'
+                    logging.debug('%s [%d rows]' % (query, len(rows)))
+                    execute_values(self.cursor, query, rows, page_size = self.batchSize)
+                for ((table, idColumn, lastCheck), rowIds) in self.touches.items():
+                    query = 'UPDATE ' + table + ' SET last_check = %s WHERE ' + idColumn + ' = ANY(%s)'
+                    logging.debug('%s [%d rows]' % (query, len(rowIds)))
+                    self.cursor.execute(query, [lastCheck, rowIds])
+                for ((table, idColumn, names), rows) in self.updates.items():
+                    query = 'UPDATE ' + table + ' SET ' + ','.join([name + ' = %s' for name in names]) + ' WHERE ' + idColumn + ' = %s'
+                    logging.debug('%s [%d rows]' % (query, len(rows)))
+                    execute_batch(self.cursor, query, rows, page_size = self.batchSize)
+                self.cursor.connection.commit()
+            except Exception, E:
+                self.cursor.connection.rollback()
+                logging.error("Cannot write the batch of %d data items; %s: %s" % (self.numDataItems, E.__class__.__name__, E))
+                raise
+            finally:
+                self.discard()
+        self.numDataItems = 0
+
 def listRawDataItems(cursor, itemIds = None):
     if itemIds != None:
         data_items, num_items = fetchDataFromDB(cursor, "SELECT raw_data_item_id, abs_path FROM RAW_DATA_ITEM WHERE item_id IN %s ORDER BY item_id, abs_path", [tuple(itemIds),])
@@ -367,11 +483,56 @@ def load_sql_file(cursor, sqlFile):
         
     return success
 
-def codeOSGActiveObjectUniqueName(cursor, aoType, rawDataItemId = None, itemId = None, objectId = None, labelName = None ):
+def getMigrations(migrationsAbsPath):
+    """ Get the sorted list of (version, name, absPath) of the migration files 
+    (NNN_description.sql) in the migrations folder"""
+    migrations = []
+    if os.path.isdir(migrationsAbsPath):
+        for fileName in os.listdir(migrationsAbsPath):
+            m = re.match('^(\d+)_(.*)\.sql$', fileName)
+            if m:
+                migrations.append((int(m.group(1)), m.group(2), migrationsAbsPath + '/' + fileName))
+    migrations.sort()
+    return migrations
+
+def applyMigrations(cursor, migrationsAbsPath):
+    """ Apply the migrations of the migrations folder that have not been applied 
+    yet to the DB. The applied versions are stored in the SCHEMA_VERSION table. 
+    Each migration is applied (and registered) in its own transaction. 
+    Returns the list of applied versions"""
+    cursor.execute('CREATE TABLE IF NOT EXISTS SCHEMA_VERSION (version int NOT NULL, name text NOT NULL, applied timestamp DEFAULT now() NOT NULL, PRIMARY KEY (version))')
+    cursor.connection.commit()
+    cursor.execute('SELECT version FROM SCHEMA_VERSION')
+    appliedVersions = set([row[0] for row in cursor.fetchall()])
+    
+    newVersions = []
+    for (version, name, migrationAbsPath) in getMigrations(migrationsAbsPath):
+        if version in appliedVersions:
+            continue
+        msg = 'Applying migration %03d %s' % (version, name)
+        print msg
+        logging.info(msg)
+        try:
+            for statement in open(migrationAbsPath,'r').read().split(';'):
+                if statement.strip() != '':
+                    logging.debug(statement)
+                    cursor.execute(statement)
+            cursor.execute('INSERT INTO SCHEMA_VERSION (version, name) VALUES (%s, %s)', [version, name])
+            cursor.connection.commit()
+        except Exception, E:
+            cursor.connection.rollback()
+            logging.error('Cannot apply migration %s' % migrationAbsPath)
+            logging.error(" %s: %s" % (E.__class__.__name__, E))
+            raise
+        newVersions.append(version)
+    return newVersions
+
+def codeOSGActiveObjectUniqueName(cursor, aoType, rawDataItemId = None, itemId = None, objectId = None, labelName = None, absPath = None):
     """ This gets a unique name for a OSG Active Object.
     OSG Active Objects are OSG PCs, OSG Meshes, OSG pics, OSG item objects (boundings) or OSG labels
     aoType is the type of active objects. Please use AO_TYPE_MESH, AO_TYPE_PC, AO_TYPE_PIC, AO_TYPE_LAB and AO_TYPE_OBJ
-    For OSG PCs, Meshes and Pics provide rawDataItemId, 
+    For OSG PCs, Meshes and Pics provide rawDataItemId (if itemId and absPath 
+    of the raw data item are also provided the DB is not queried), 
     For OSG items objects provide itemId and objectId
     For OSG labels provide label name """
     
@@ -382,7 +543,10 @@ def codeOSGActiveObjectUniqueName(cursor, aoType, rawDataItemId = None, itemId =
     if aoType in (AO_TYPE_MESH, AO_TYPE_PC, AO_TYPE_PIC):
         if rawDataItemId == None:
             raise Exception('Raw Data item ID can not be None if Active Object Type is ' + ','.join((AO_TYPE_MESH, AO_TYPE_PC, AO_TYPE_PIC)))
-        rows, num = fetchDataFromDB(cursor, "SELECT item_id, abs_path FROM RAW_DATA_ITEM WHERE raw_data_item_id = %s", [rawDataItemId,])
+        if itemId != None and absPath != None:
+            (rows, num) = ([(itemId, absPath),], 1)
+        else:
+            rows, num = fetchDataFromDB(cursor, "SELECT item_id, abs_path FROM RAW_DATA_ITEM WHERE raw_data_item_id = %s", [rawDataItemId,])
         if num == 1:
             (itemId, absPath) = rows[0]
             isCurr = 0
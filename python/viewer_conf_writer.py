@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Streaming writer of the viewer XML configuration files
+#                   (OSG/viewer_config/viewer_conf.xsd)
+# Notes:            * The elements are written as soon as they are given (for
+#                     example while iterating a DB cursor) through a buffer,
+#                     the whole configuration is never in memory
+#                   * The output is the same as the one of the export of the
+#                     viewer_conf_api objects (same indentation, attributes
+#                     order and quoting)
+#                   * Small fixed parts (preferences, attributes) can still
+#                     be given as viewer_conf_api objects
+##############################################################################
+
+import viewer_conf_api
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+INDENT = '    '
+# Order in which viewer_conf_api exports the attributes of the elements
+CAMERA_ATTRIBUTES = ('name', 'h', 'p', 'r', 'y', 'x', 'z')
+SETTING_ATTRIBUTES = ('h', 'castShadow', 'p', 'r', 'xs', 'y', 'x', 'ys', 'z', 'zs')
+ACTIVE_OBJECT_ATTRIBUTES = ('Font', 'outline', 'labelText', 'labelColorRed',
+    'labelColorGreen', 'labelRotateScreen', 'labelColorBlue', 'uniqueName', 'prototype')
+
+def formatAttribute(name, value):
+    """ Formats the attribute like viewer_conf_api does"""
+    return ' ' + name + '=' + viewer_conf_api.quote_attrib(value).encode(viewer_conf_api.ExternalEncoding)
+
+class ViewerConfWriter(object):
+    """ Writes a viewer configuration to outfile element by element. The
+    elements with children are opened with startElement and closed with
+    endElement, the ones without children are written with writeElement"""
+    def __init__(self, outfile, bufferSize = DEFAULT_BUFFER_SIZE):
+        self.outfile = outfile
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.bufferLength = 0
+        # Open elements as [name, hasChildren]
+        self.stack = []
+
+    def write(self, data):
+        """ Buffered write (also used by the export of viewer_conf_api objects)"""
+        self.buffer.append(data)
+        self.bufferLength += len(data)
+        if self.bufferLength >= self.bufferSize:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffer):
+            self.outfile.write(''.join(self.buffer))
+            self.buffer = []
+            self.bufferLength = 0
+
+    def close(self):
+        """ Closes the open elements and flushes the buffer"""
+        while len(self.stack):
+            self.endElement()
+        self.flush()
+
+    def addChild(self):
+        # The start tag of the parent is completed when it gets its first child
+        if len(self.stack) and not self.stack[-1][1]:
+            self.write('>\n')
+            self.stack[-1][1] = True
+
+    def startElement(self, name, attributes = ()):
+        """ Opens the element, attributes is a list of (name, value), the ones
+        with None value are not written"""
+        self.addChild()
+        self.write(INDENT * len(self.stack) + '<' + name +
+            ''.join([formatAttribute(n, v) for (n, v) in attributes if v is not None]))
+        self.stack.append([name, False])
+
+    def endElement(self):
+        (name, hasChildren) = self.stack.pop()
+        if hasChildren:
+            self.write(INDENT * len(self.stack) + '</' + name + '>\n')
+        else:
+            self.write('/>\n')
+
+    def writeElement(self, name, attributes = ()):
+        self.startElement(name, attributes)
+        self.endElement()
+
+    def writeObject(self, obj, name):
+        """ Writes a viewer_conf_api object as child of the current element"""
+        self.addChild()
+        obj.export(self, len(self.stack), name_ = name)
+
+    def startConfiguration(self, version):
+        self.startElement('osgRCconfiguration', [('version', version)])
+
+    def writeObjectLibrary(self, url):
+        self.writeElement('objectLibrary', [('url', url)])
+
+    def writeCamera(self, name, x, y, z, h = None, p = None, r = None):
+        values = {'name': name, 'x': x, 'y': y, 'z': z, 'h': h, 'p': p, 'r': r}
+        self.writeElement('camera', [(a, values[a]) for a in CAMERA_ATTRIBUTES])
+
+    def writeStaticObject(self, url):
+        self.writeElement('staticObject', [('url', url)])
+
+    def writeActiveObject(self, prototype, uniqueName, setting = None, **labelAttributes):
+        """ Writes an active object of the current layer. setting is a
+        dictionary with the attributes of its setting and labelAttributes are
+        the label attributes (labelText, labelColorRed, etc.)"""
+        labelAttributes['prototype'] = prototype
+        labelAttributes['uniqueName'] = uniqueName
+        self.startElement('activeObject', [(a, labelAttributes.get(a)) for a in ACTIVE_OBJECT_ATTRIBUTES])
+        if setting != None:
+            self.writeElement('setting', [(a, setting.get(a)) for a in SETTING_ATTRIBUTES])
+        self.endElement()
@@ -281,7 +281,7 @@ if not os.path.exists(dataPath):
 print " Testing creation of the DB ..."
 sqlFile = os.path.abspath(os.path.join(testFolder, '../Database/ERDB.sql'))
 
-DBargs = testArguments(sql=sqlFile, dbname=dbName, dbuser = dbUser, \
+DBargs = testArguments(sql=sqlFile, migrate=False, migrations=utils.DEFAULT_MIGRATIONS_DIR, dbname=dbName, dbuser = dbUser, \
                 dbpass =dbPass, dbhost = dbHost, dbport = dbPort, log=logLevel)
 CreateDB.run(DBargs)
 
@@ -327,7 +327,7 @@ print " Testing updating the Z of given items in the DB... "
 
 ZArgs = testArguments(itemid=footprints_item_ids, las= footprints_drive_map,\
                      dbname= dbName, dbuser=dbUser, dbpass= dbPass,\
-                     dbhost=dbHost, dbport= dbPort, cores= 16)
+                     dbhost=dbHost, dbport= dbPort, cores= 16, engine='native', resume=False)
 UpdateDBItemZ.run(ZArgs)
 
 logFile = 'UpdateDBItemZ.log'
@@ -345,7 +345,7 @@ print "Adding BG PC data ..."
 PCBGArgs=testArguments(data=os.path.join(dataPath,'RAW'), kind=utils.BG_FT, \
                         type=utils.PC_FT, \
                         file="/home/pattydat/DATA/RAW/PC/BACK/DRIVE_1_V4", \
-                        log=logLevel, eight=False, srid='')
+                        log=logLevel, eight=False, scanthreads=4, srid='')
 AddRawDataItem.run(PCBGArgs)
 print "Adding BG PC data ...DONE"
 
@@ -356,7 +356,7 @@ PCSiteArgs=testArguments(data=os.path.join(dataPath,'RAW'), kind=utils.SITE_FT,
                         file="/home/pattydat/DATA/RAW/PC/SITE/S1/" +
                         "SITE_1_O_1_VSFM_CLEANED_aligned_DRIVE_1_V3/" +
                         "SITE_1_O_1_VSFM_CLEANED_aligned_DRIVE_1_V3.las", \
-                        log=logLevel, eight=False, srid='', site = '1')
+                        log=logLevel, eight=False, scanthreads=4, srid='', site = '1')
 AddRawDataItem.run(PCSiteArgs)
 print "Adding SITE PC data ...DONE"
 
@@ -366,7 +366,7 @@ PictArgs=testArguments(data=os.path.join(dataPath,'RAW'), kind=utils.SITE_FT,\
                         type=utils.PIC_FT, period = utils.CURR_FT, \
                         file="/home/pattydat/DATA/RAW/PICT/SITE/CURR/S42/" +
                         "SITE_42_O_A_126/SITE_42_O_A_126.JPG", \
-                        log=logLevel, eight=False, srid='', site = '42')
+                        log=logLevel, eight=False, scanthreads=4, srid='', site = '42')
 AddRawDataItem.run(PictArgs)
 print "Adding PICT SITE data ...DONE"
 
@@ -376,7 +376,7 @@ MeshArgs=testArguments(data=os.path.join(dataPath,'RAW'), kind=utils.SITE_FT, \
                         type=utils.MESH_FT, period = utils.CURR_FT,\
                         file="/home/pattydat/DATA/RAW/MESH/SITE/CURR/S20" +
                         "/SITE_20_O_1_VSFM_TEXTURE", \
-                        log=logLevel, eight=False, srid='33333', site = '20')
+                        log=logLevel, eight=False, scanthreads=4, srid='33333', site = '20')
 AddRawDataItem.run(MeshArgs)
 print "Adding MESH SITE data ...DONE"
 
@@ -390,7 +390,7 @@ print "-----------------------------------------------------------------------"
 
 # UpdateDB.py
 print " Testing updating the DB... "
-UpdateDBArgs = testArguments(data=dataPath, types='rop', ditypes='pmi',\
+UpdateDBArgs = testArguments(data=dataPath, types='rop', ditypes='pmi', workers=1, batch=500, incremental=False, manifest='', dryrun=False, scanthreads=4,\
                   dbname=dbName, dbuser=dbUser, dbpass=dbPass,\
                   dbhost=dbHost, dbport=dbPort, log=logLevel)
 
@@ -406,7 +406,7 @@ print "-----------------------------------------------------------------------"
 
 # GeneratePOTree.py
 print " Testing generating POTree... "
-PotreeArgs = testArguments(itemid='', potreeDir='',levels=4, \
+PotreeArgs = testArguments(itemid='', potreeDir='',levels=4, cache='', timeout=0, memlimit=0, engine='PotreeConverter', processes=1, workdir=GeneratePOTree.octree_builder.DEFAULT_WORK_DIR, incremental=False, \
                   dbname=dbName, dbuser=dbUser, dbpass=dbPass,\
                   dbhost=dbHost, dbport=dbPort, log=logLevel)
 
@@ -421,7 +421,7 @@ print "-----------------------------------------------------------------------"
 
 # GenerateOSG.py
 print " Testing generating OSG... "
-OSGArgs = testArguments(itemid='', osgDir='',\
+OSGArgs = testArguments(itemid='', osgDir='', jobs=1, backgrounds=False, cache='', timeout=0, memlimit=0, maxmem=0, maxcpu=0,\
                   dbname=dbName, dbuser=dbUser, dbpass=dbPass,\
                   dbhost=dbHost, dbport=dbPort, log=logLevel)
 
@@ -437,7 +437,7 @@ print "-----------------------------------------------------------------------"
     
 # UpdateDB.py
 print " Testing again updating the DB... "
-UpdateDBArgs = testArguments(data=dataPath, types='rop', ditypes='pmi',\
+UpdateDBArgs = testArguments(data=dataPath, types='rop', ditypes='pmi', workers=1, batch=500, incremental=False, manifest='', dryrun=False, scanthreads=4,\
                   dbname=dbName, dbuser=dbUser, dbpass=dbPass,\
                   dbhost=dbHost, dbport=dbPort, log=logLevel)
 
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Test of the native cut-out engine of GetItemLAS without
+#                   output file (as used by UpdateDBItemZ)
+#
+# Notes:            * It does not require the DB, the LAS files are
+#                     synthetic and written in a temporal folder
+##############################################################################
+
+# import general modules
+import os, sys, struct, shutil, tempfile
+
+# import the tested modules
+testFolder = os.path.abspath(os.path.join(os.path.abspath(__file__), os.pardir))
+scriptsFolder = os.path.abspath(os.path.join(testFolder, '../python'))
+sys.path.append(scriptsFolder)
+
+import las_utils, GetItemLAS
+
+SCALE = 0.01
+# Point format 0 records: X, Y, Z, intensity, flags, classification, scan angle, user data, point source id
+POINT_FORMAT = '<3iHBBbBH'
+
+def writeLAS(absPath, points):
+    """ Writes a LAS 1.2 file (point format 0) with the (x, y, z) points"""
+    pointLength = struct.calcsize(POINT_FORMAT)
+    (xs, ys, zs) = zip(*points)
+    header = struct.pack(las_utils.HEADER_FORMAT, 'LASF', 0, 0, '\x00' * 16, 1, 2, 'test', 'test', 1, 2015,
+        las_utils.HEADER_SIZE, las_utils.HEADER_SIZE, 0, 0, pointLength, len(points), len(points), 0, 0, 0, 0,
+        SCALE, SCALE, SCALE, 0., 0., 0., max(xs), min(xs), max(ys), min(ys), max(zs), min(zs))
+    f = open(absPath, 'wb')
+    f.write(header)
+    for (x, y, z) in points:
+        f.write(struct.pack(POINT_FORMAT, int(round(x / SCALE)), int(round(y / SCALE)), int(round(z / SCALE)), 0, 1, 0, 0, 0, 0))
+    f.close()
+
+def check(name, condition):
+    if condition:
+        print ' %s...OK' % name
+    else:
+        print 'ERROR: %s' % name
+    return condition
+
+print " Testing the native cut-out without output file... "
+folder = tempfile.mkdtemp()
+try:
+    points1 = [(float(i), float(j), float(i + j)) for i in range(10) for j in range(10)]
+    points2 = [(float(i), float(j), float(i - j)) for i in range(10, 20) for j in range(10)]
+    files = [os.path.join(folder, 'tile1.las'), os.path.join(folder, 'tile2.las')]
+    writeLAS(files[0], points1)
+    writeLAS(files[1], points2)
+    (minx, miny, maxx, maxy) = (5., 2., 14., 6.)
+    expected = [z for (x, y, z) in points1 + points2 if minx <= x <= maxx and miny <= y <= maxy]
+
+    results = [check('canUseNative without output', GetItemLAS.canUseNative(files, None)),
+               check('canUseNative with empty output', GetItemLAS.canUseNative(files, '')),
+               check('canUseNative with LAZ output', not GetItemLAS.canUseNative(files, os.path.join(folder, 'out.laz'))),
+               check('canUseNative with LAZ input', not GetItemLAS.canUseNative(files + [os.path.join(folder, 'tile3.laz')], None))]
+
+    zStats = las_utils.ZStats()
+    (numpoints, minZ, maxZ, avgZ) = GetItemLAS.cut_out_native(files, None, minx, miny, maxx, maxy, zStats = zStats)
+    results.append(check('cut_out_native statistics', (numpoints, minZ, maxZ) == (len(expected), min(expected), max(expected)) and
+                         abs(avgZ - (sum(expected) / len(expected))) < 1e-6))
+    results.append(check('cut_out_native Z statistics', zStats.numberPoints == len(expected) and
+                         abs(zStats.average() - avgZ) < 1e-6))
+    results.append(check('cut_out_native does not write files', sorted(os.listdir(folder)) == ['tile1.las', 'tile2.las']))
+finally:
+    shutil.rmtree(folder)
+if not all(results):
+    sys.exit(1)
+print " The testing of the native cut-out without output file...DONE."
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+##############################################################################
+# Description:      Test of the streaming writer of the viewer configuration:
+#                   its output must be the same as the export of the
+#                   viewer_conf_api objects with the same content
+# Notes:            * It does not require the DB
+##############################################################################
+
+# import general modules
+import os, sys, difflib
+from decimal import Decimal
+from StringIO import StringIO
+
+# import the tested modules
+testFolder = os.path.abspath(os.path.join(os.path.abspath(__file__), os.pardir))
+scriptsFolder = os.path.abspath(os.path.join(testFolder, '../python'))
+sys.path.append(scriptsFolder)
+
+import viewer_conf_api, viewer_conf_writer
+
+exampleConf = os.path.abspath(os.path.join(testFolder, '../OSG/viewer_config/viewer_conf_example.xml'))
+
+def export(rootObject):
+    """ Gets the XML of the viewer_conf_api objects"""
+    outfile = StringIO()
+    rootObject.export(outfile, 0)
+    return outfile.getvalue()
+
+def stream(rootObject, bufferSize):
+    """ Gets the XML of the content of the viewer_conf_api objects written
+    with the streaming writer"""
+    outfile = StringIO()
+    writer = viewer_conf_writer.ViewerConfWriter(outfile, bufferSize)
+    writer.startConfiguration(rootObject.get_version())
+    for objectLibrary in rootObject.get_objectLibrary():
+        writer.writeObjectLibrary(objectLibrary.get_url())
+    if rootObject.get_cameras() != None:
+        writer.startElement('cameras')
+        for c in rootObject.get_cameras().get_camera():
+            writer.writeCamera(c.get_name(), c.get_x(), c.get_y(), c.get_z(), c.get_h(), c.get_p(), c.get_r())
+        writer.endElement()
+    if rootObject.get_preferences() != None:
+        writer.writeObject(rootObject.get_preferences(), 'preferences')
+    if rootObject.get_attributes() != None:
+        writer.writeObject(rootObject.get_attributes(), 'attributes')
+    if rootObject.get_staticObjects() != None:
+        writer.startElement('staticObjects')
+        for staticObject in rootObject.get_staticObjects().get_staticObject():
+            writer.writeStaticObject(staticObject.get_url())
+        writer.endElement()
+    if rootObject.get_activeObjects() != None:
+        writer.startElement('activeObjects')
+        for layer in rootObject.get_activeObjects().get_layer():
+            writer.startElement('layer', [('name', layer.get_name())])
+            for activeObject in layer.get_activeObject():
+                setting = None
+                if activeObject.get_setting() != None:
+                    setting = dict([(a, getattr(activeObject.get_setting(), a)) for a in viewer_conf_writer.SETTING_ATTRIBUTES])
+                labelAttributes = dict([(a, getattr(activeObject, a)) for a in viewer_conf_writer.ACTIVE_OBJECT_ATTRIBUTES if a not in ('prototype', 'uniqueName')])
+                writer.writeActiveObject(activeObject.get_prototype(), activeObject.get_uniqueName(), setting, **labelAttributes)
+            writer.endElement()
+        writer.endElement()
+    writer.close()
+    return outfile.getvalue()
+
+def getSyntheticConfiguration():
+    """ Gets a configuration with the corner cases: empty containers, missing
+    attributes, values with quotes and DB types (int, float, Decimal)"""
+    rootObject = viewer_conf_api.osgRCconfiguration(version='0.2')
+    rootObject.add_objectLibrary(viewer_conf_api.objectLibrary(url='PC/SITES/1/a&b/data.prototype.xml'))
+    cameras = viewer_conf_api.cameras()
+    cameras.add_camera(viewer_conf_api.camera(name='DEF_CAM_1', x=Decimal('1.5'), y=2, z=-3.25))
+    cameras.add_camera(viewer_conf_api.camera(name='cam "2"', x=0.1, y=0.2, z=0.3, h=10, p=Decimal('-1.000'), r=0))
+    rootObject.set_cameras(cameras)
+    staticObjects = viewer_conf_api.staticObjects()
+    staticObjects.add_staticObject(viewer_conf_api.staticObject(url='PC/BACK/DRIVE_1_V3/data.osgb'))
+    rootObject.set_staticObjects(staticObjects)
+    activeObjects = viewer_conf_api.activeObjects()
+    activeObjects.add_layer(viewer_conf_api.layer(name='points'))
+    layer = viewer_conf_api.layer(name='labels')
+    activeObject = viewer_conf_api.activeObject(prototype='labelPrototype', uniqueName="it's <1>",
+        labelText='It\'s "1"', labelColorRed=Decimal('0.5'), labelColorGreen=1, labelColorBlue=0.25,
+        labelRotateScreen=True, outline=False, Font='arial')
+    activeObject.set_setting(viewer_conf_api.setting(x=1., y=2., z=None, xs=1, ys=1, zs=1, h=0, p=0, r=0, castShadow=0))
+    layer.add_activeObject(activeObject)
+    layer.add_activeObject(viewer_conf_api.activeObject(prototype='Bounding Box', uniqueName='1_obj_1'))
+    activeObjects.add_layer(layer)
+    rootObject.set_activeObjects(activeObjects)
+    return rootObject
+
+def check(name, rootObject):
+    expected = export(rootObject)
+    ok = True
+    for bufferSize in (1, 100, viewer_conf_writer.DEFAULT_BUFFER_SIZE):
+        streamed = stream(rootObject, bufferSize)
+        if streamed != expected:
+            print 'ERROR: %s streamed with a buffer of %d bytes differs from the export:' % (name, bufferSize)
+            print ''.join(difflib.unified_diff(expected.splitlines(True), streamed.splitlines(True), 'export', 'stream'))
+            ok = False
+    # The streamed configuration must be readable
+    viewer_conf_api.parseString(streamed)
+    if ok:
+        print ' %s...OK' % name
+    return ok
+
+print " Testing the streaming writer of the viewer configuration... "
+results = [check('viewer_conf_example.xml', viewer_conf_api.parse(exampleConf, silence=True)),
+           check('synthetic configuration', getSyntheticConfiguration())]
+if not all(results):
+    sys.exit(1)
+print " The testing of the streaming writer of the viewer configuration...DONE."